@@ -12,10 +12,14 @@ not, see <https://www.gnu.org/licenses/>.
 """
 
 import argparse
+import concurrent.futures
 import graphlib
 import gzip
+import contextlib
 import importlib
 import importlib.metadata
+import importlib.util
+import io
 import os
 import pathlib
 import re
@@ -27,9 +31,14 @@ import textwrap
 import uuid
 from glob import glob
 
+from .shared.alignment import start_alignment_broker, stop_alignment_broker, get_aligner, \
+    set_aligner, set_combined_queries_dir
+from .shared.assembly import AssemblyContext, FastaIndex
 from .shared.help_formatter import MyParser, MyHelpFormatter
+from .shared.index_cache import IndexCache, set_database_cache
 from .shared.misc import get_compression_type, load_fasta,reverse_complement
 from .shared.species_defs import is_kp_complex, is_ko_complex, is_escherichia
+from .shared.threads import get_threads, set_threads, split_threads
 
 
 def parse_arguments(args, all_module_names, modules):
@@ -57,6 +66,31 @@ def parse_arguments(args, all_module_names, modules):
     io_args.add_argument('--trim_headers', action='store_true',
                          help='Trim headers in the output files')
 
+    performance_args = parser.add_argument_group('Performance')
+    performance_args.add_argument('-j', '--jobs', type=int, default=1,
+                                  help='Number of assemblies to type in parallel, at most --threads '
+                                       '(default: 1)')
+    performance_args.add_argument('-t', '--threads', type=int, default=8,
+                                  help='Total number of CPU threads to use, split between parallel '
+                                       'assemblies and the minimap2, mash and Kaptive calls for '
+                                       'each assembly (default: 8)')
+    performance_args.add_argument('--parallel_modules', action='store_true',
+                                  help="Run an assembly's independent modules at the same time, "
+                                       "sharing its threads (only without --jobs)")
+    performance_args.add_argument('--aligner', type=str, choices=['minimap2', 'mappy'],
+                                  default='minimap2',
+                                  help='Run alignments with the minimap2 executable, or '
+                                       'in-process with the mappy Python package (default: '
+                                       'minimap2)')
+    performance_args.add_argument('--index_cache', type=str,
+                                  help='Directory for keeping minimap2 indices of the assemblies, '
+                                       'so they are reused when Kleborate is run on the same '
+                                       'assemblies again (default: no cache)')
+    performance_args.add_argument('--index_cache_size', type=float, default=10.0,
+                                  help='Maximum total size (in GB) of the indices in the '
+                                       '--index_cache directory: the least recently used indices '
+                                       'are removed to stay under this (default: 10)')
+
     module_args = parser.add_argument_group('Modules')
     module_args.add_argument('--list_modules', action='store_true',
                              help='Print a list of all available modules and then quit')
@@ -86,15 +120,10 @@ def main():
     all_module_names, modules = import_modules()
     args = parse_arguments(sys.argv[1:], all_module_names, modules)
     print_modules(args, all_module_names, modules)
+    check_performance_options(args)
 
     module_names, check_module_list, pass_modules = get_used_module_names(args, all_module_names, get_presets())
 
-    # Define preset_check_modules
-    preset_check_modules = []
-    if args.preset:
-        presets = get_presets()
-        preset_check_modules = [module for module, _ in presets[args.preset]['check']]
-
     module_names, module_run_order, external_programs = check_modules(args, modules, module_names, check_module_list, pass_modules)
 
     full_headers, stdout_headers = get_headers(module_names, modules)
@@ -117,70 +146,221 @@ def main():
             for file in glob(f'{args.outdir}/*{suffix}'):
                 os.remove(file)
 
+    all_results = type_assemblies(args, modules, module_run_order, check_module_list, full_headers,
+                                  external_programs)
+
+    # Results come back in the same order as the input assemblies (even when typed in parallel),
+    # so the output files are written the same way as for a serial run.
+    for assembly, (results, outfile_suffix) in zip(args.assemblies, all_results):
+        if outfile_suffix is None:
+            print(f"Assembly {assembly} does not match any specified species. Skipping to next assembly.")
+            continue
+        output_file = os.path.join(args.outdir, outfile_suffix)
+        output_results(full_headers, stdout_headers, output_file, results, args.trim_headers)
+
+
+def check_performance_options(args):
+    if args.jobs < 1:
+        sys.exit('Error: --jobs must be a positive integer')
+    if args.threads < 1:
+        sys.exit('Error: --threads must be a positive integer')
+    if args.aligner == 'mappy' and importlib.util.find_spec('mappy') is None:
+        sys.exit('Error: --aligner mappy requires the mappy Python package')
+    if args.index_cache_size <= 0:
+        sys.exit('Error: --index_cache_size must be positive')
+    if args.index_cache is not None:
+        try:
+            os.makedirs(args.index_cache, exist_ok=True)
+        except OSError:
+            sys.exit(f'Error: could not create --index_cache directory {args.index_cache}')
+
+
+def type_assemblies(args, modules, module_run_order, check_module_list, full_headers,
+                    external_programs):
+    """
+    This function types each of the input assemblies and yields a (results, outfile_suffix) tuple
+    for each, in the same order as args.assemblies. If --jobs is more than one, the assemblies are
+    typed in a pool of worker processes, but the results are still yielded in input order (and
+    anything the workers print comes out in that order too).
+
+    The --threads budget is split evenly between the concurrent assemblies, and each assembly's
+    share is what its minimap2, mash and Kaptive calls get.
+
+    Files shared by all of the run's assemblies (the combined alignment queries) are kept in a
+    temporary directory which is removed when the run is done.
+    """
+    jobs, threads_per_assembly = get_jobs_and_threads(args)
+
+    with tempfile.TemporaryDirectory() as run_temp_dir:
+        if jobs == 1:
+            set_threads(threads_per_assembly)
+            set_aligner(args.aligner)
+            set_database_cache(args.index_cache)
+            set_combined_queries_dir(run_temp_dir)
+            try:
+                for assembly in args.assemblies:
+                    yield type_assembly(assembly, args, modules, module_run_order,
+                                        check_module_list, full_headers, external_programs,
+                                        concurrent_modules=args.parallel_modules)
+            finally:
+                set_combined_queries_dir(None)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, initializer=init_worker,
+                initargs=(args, module_run_order, check_module_list, full_headers,
+                          external_programs, threads_per_assembly, run_temp_dir)) as executor:
+            for result, output in executor.map(type_assembly_in_worker, args.assemblies):
+                sys.stdout.write(output)
+                yield result
+
+
+def get_jobs_and_threads(args):
+    """
+    Returns the number of assemblies to type at once and each one's share of the --threads budget.
+    Every assembly needs at least one thread, so --jobs is capped at --threads (and at the number
+    of assemblies) to keep the total within the budget.
+    """
+    jobs = min(args.jobs, args.threads, len(args.assemblies))
+    return jobs, split_threads(args.threads, jobs)
+
 
-    for assembly in args.assemblies:
-        check_assembly(assembly)  # Check assembly before processing
+# Each worker process in the --jobs pool keeps its own copy of the run settings, so only the
+# assembly path needs to be sent with each task.
+WORKER_STATE = {}
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            unzipped_assembly = gunzip_assembly_if_necessary(assembly, temp_dir)
-            minimap2_index = build_minimap2_index(assembly, unzipped_assembly, external_programs, temp_dir)
-            results = {'strain': get_strain_name(assembly)}
 
-            pass_check = True  # default, assume no check and run all modules
+def init_worker(args, module_run_order, check_module_list, full_headers, external_programs,
+                threads_per_assembly, run_temp_dir):
+    set_threads(threads_per_assembly)
+    set_aligner(args.aligner)
+    set_database_cache(args.index_cache)
+    set_combined_queries_dir(run_temp_dir)
+    _, modules = import_modules()
+    WORKER_STATE.update(args=args, modules=modules, module_run_order=module_run_order,
+                        check_module_list=check_module_list, full_headers=full_headers,
+                        external_programs=external_programs)
 
-            # if we have 'check' modules in the preset, run these
-            if args.preset and len(check_module_list) > 0:
-                for module, check in presets[args.preset]['check']:
-                    try:
-                        module_results = modules[module].get_results(unzipped_assembly, minimap2_index, args, results)
 
-                        results.update({f'{module}__{header}': result for header, result in module_results.items()})
-                        check_function = globals()[check]
+def type_assembly_in_worker(assembly):
+    """
+    Types one assembly in a worker process. Anything printed along the way (e.g. module warnings)
+    is captured and returned with the result, so the main process can print it just before the
+    assembly's results, as a serial run would.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = type_assembly(assembly, WORKER_STATE['args'], WORKER_STATE['modules'],
+                               WORKER_STATE['module_run_order'], WORKER_STATE['check_module_list'],
+                               WORKER_STATE['full_headers'], WORKER_STATE['external_programs'])
+    return result, output.getvalue()
+
+
+def type_assembly(assembly, args, modules, module_run_order, check_module_list, full_headers,
+                  external_programs, concurrent_modules=False):
+    """
+    This function runs the used modules on a single assembly. It returns the results dictionary
+    and the suffix of the output file the results belong in (None if the assembly doesn't match
+    any of the species). Nothing is written here, so it is safe to run in a worker process.
+
+    Modules run one at a time unless concurrent_modules is True (--parallel_modules, see
+    run_modules). --jobs worker processes always run them one at a time: the CPUs are already used
+    by typing assemblies in parallel.
+    """
+    check_assembly(assembly)  # Check assembly before processing
+
+    # Define preset_check_modules
+    presets = get_presets()
+    preset_check_modules = []
+    if args.preset:
+        preset_check_modules = [module for module, _ in presets[args.preset]['check']]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        unzipped_assembly = gunzip_assembly_if_necessary(assembly, temp_dir)
+        fasta_index = build_fasta_index(assembly, unzipped_assembly, temp_dir)
+        context = AssemblyContext(unzipped_assembly, fasta_index=fasta_index)
+        minimap2_index = build_minimap2_index(assembly, context, external_programs, temp_dir,
+                                              get_index_cache(args))
+        context.minimap2_index = minimap2_index
+        results = {'strain': get_strain_name(assembly)}
 
-                        if not check_function(module_results):
-                            pass_check = False
-                            print(f"Assembly {assembly} failed in check {check}.")
-                            break  # Exit the for loop since this assembly failed the check
+        pass_check = True  # default, assume no check and run all modules
 
-                    except Exception as e:
-                        print(f"Error encountered while processing {assembly} with {module}: {e}.")
+        # if we have 'check' modules in the preset, run these
+        if args.preset and len(check_module_list) > 0:
+            for module, check in presets[args.preset]['check']:
+                try:
+                    module_results = modules[module].get_results(context, minimap2_index, args, results)
+
+                    results.update({f'{module}__{header}': result for header, result in module_results.items()})
+                    check_function = globals()[check]
+
+                    if not check_function(module_results):
                         pass_check = False
-                        break  # Exit the for loop since an error occurred
-
-            # proceed through all other modules
-            if pass_check:
-                for module in module_run_order:
-                    if module not in preset_check_modules:
-                        module_results = modules[module].get_results(unzipped_assembly, minimap2_index, args, results)
-                        results.update({f'{module}__{header}': result for header, result in module_results.items()})
-            else:
-                # Populate results with "Not Tested" for modules that did not run
-                for module in module_run_order:
-                    if module not in preset_check_modules:
-                        module_headers = [header for header in full_headers if header.startswith(module)]
-                        for header in module_headers:
-                            results[header] = 'Not Tested'
-
-            # Split the results based on species
-            if args.modules:
-                module_name = args.modules.split(',')[0] 
-                outfile_suffix = f'{module_name}_output.txt'
-            else:
-                # Determine the appropriate output file suffix based on species
-                species = results.get('enterobacterales__species__species', None)
-                if species and is_kp_complex({'species': species}):
-                    outfile_suffix = 'klebsiella_pneumo_complex_output.txt'
-                elif species and is_ko_complex({'species': species}):
-                    outfile_suffix = 'klebsiella_oxytoca_complex_output.txt'
-                elif species and is_escherichia({'species': species}):
-                    outfile_suffix = 'escherichia_output.txt'
-                else:
-                    print(f"Assembly {assembly} does not match any specified species. Skipping to next assembly.")
-                    continue
+                        print(f"Assembly {assembly} failed in check {check}.")
+                        break  # Exit the for loop since this assembly failed the check
+
+                except Exception as e:
+                    print(f"Error encountered while processing {assembly} with {module}: {e}.")
+                    pass_check = False
+                    break  # Exit the for loop since an error occurred
+
+        # proceed through all other modules
+        if pass_check:
+            # The alignment queries of all modules are aligned to the assembly up front in a
+            # single aligner call, and the modules get their hits from that.
+            queries = get_alignment_queries(module_run_order, modules, preset_check_modules)
+            if queries and 'minimap2' in external_programs:
+                start_alignment_broker(queries, context, minimap2_index)
+            try:
+                run_modules(module_run_order, modules, context, minimap2_index, args, results,
+                            preset_check_modules, concurrent_modules=concurrent_modules)
+            finally:
+                stop_alignment_broker(context)
+                get_aligner().unload(context)
+        else:
+            # Populate results with "Not Tested" for modules that did not run
+            for module in module_run_order:
+                if module not in preset_check_modules:
+                    module_headers = [header for header in full_headers if header.startswith(module)]
+                    for header in module_headers:
+                        results[header] = 'Not Tested'
+        context.close()
+
+    return results, get_outfile_suffix(args, results)
+
+
+def get_alignment_queries(module_run_order, modules, finished_modules=()):
+    """
+    Modules can (optionally) have an alignment_queries function which returns the FASTA files they
+    will align to the assembly with align_query_to_ref. This function gathers them for all modules
+    which still need to run.
+    """
+    queries = []
+    for m in module_run_order:
+        if m not in finished_modules and hasattr(modules[m], 'alignment_queries'):
+            queries += modules[m].alignment_queries()
+    return queries
 
-            # write results
-            output_file = os.path.join(args.outdir, outfile_suffix)
-            output_results(full_headers, stdout_headers, output_file, results, args.trim_headers)
+
+def get_outfile_suffix(args, results):
+    """
+    Split the results based on species: returns the suffix of the output file for this assembly's
+    results, or None if the assembly doesn't match any of the species.
+    """
+    if args.modules:
+        module_name = args.modules.split(',')[0] 
+        return f'{module_name}_output.txt'
+
+    # Determine the appropriate output file suffix based on species
+    species = results.get('enterobacterales__species__species', None)
+    if species and is_kp_complex({'species': species}):
+        return 'klebsiella_pneumo_complex_output.txt'
+    elif species and is_ko_complex({'species': species}):
+        return 'klebsiella_oxytoca_complex_output.txt'
+    elif species and is_escherichia({'species': species}):
+        return 'escherichia_output.txt'
+    return None
 
 
 # def main(): 
@@ -411,21 +591,73 @@ def get_run_order(dependency_graph):
         sys.exit('Error: module dependency graph contains a cycle')
 
 
+def run_modules(module_run_order, modules, assembly, minimap2_index, args, results,
+                finished_modules=(), concurrent_modules=False):
+    """
+    This function runs modules on one assembly (an AssemblyContext, which is given to each module's
+    get_results) and adds their results to the results dictionary. Modules in finished_modules
+    (e.g. preset check modules) have already been run and are skipped.
+
+    By default, the modules are run one at a time in the run order. If concurrent_modules is True
+    (--parallel_modules) and the assembly has more than one thread, it instead walks the module
+    dependency graph: each module is started as soon as all of
+    its prerequisites have finished, so independent modules (e.g. the MLST schemes, AMR and
+    Kaptive) run concurrently in a thread pool sized by this assembly's thread budget. Each module
+    is given a snapshot of the results so far (which always includes its prerequisites' results),
+    and its own results are merged in as soon as it finishes. Modules run this way must be
+    thread-safe, and anything they print can be interleaved.
+    """
+    modules_to_run = [m for m in module_run_order if m not in finished_modules]
+    assembly_threads = get_threads()
+    workers = max(1, min(assembly_threads, len(modules_to_run)))
+    if not concurrent_modules or workers == 1:
+        for module in modules_to_run:
+            module_results = modules[module].get_results(assembly, minimap2_index, args, results)
+            results.update({f'{module}__{header}': result
+                            for header, result in module_results.items()})
+        return
+
+    dependency_graph = {m: modules[m].prerequisite_modules() for m in module_run_order}
+    ts = graphlib.TopologicalSorter(dependency_graph)
+    ts.prepare()
+
+    # The thread budget is shared between the modules running at the same time.
+    set_threads(split_threads(assembly_threads, workers))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            while ts.is_active():
+                for module in ts.get_ready():
+                    if module in finished_modules:
+                        ts.done(module)
+                    else:
+                        future = executor.submit(modules[module].get_results, assembly,
+                                                 minimap2_index, args, dict(results))
+                        running[future] = module
+                if not running:
+                    continue
+                done, _ = concurrent.futures.wait(running,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    module = running.pop(future)
+                    module_results = future.result()
+                    results.update({f'{module}__{header}': result
+                                    for header, result in module_results.items()})
+                    ts.done(module)
+    finally:
+        set_threads(assembly_threads)
+
+
 def check_assembly(assembly):
     """
-    This function does a quick check to make sure that the input assembly looks good.
+    This function does a quick check to make sure that the input assembly exists. Its contents are
+    checked when it is indexed (build_fasta_index).
     """
     # for assembly in args.assemblies:
     if os.path.isdir(assembly):
         sys.exit('Error: ' + assembly + ' is a directory (please specify assembly files)')
     if not os.path.isfile(assembly):
         sys.exit('Error: could not find ' + assembly)
-    fasta = load_fasta(assembly)
-    if len(fasta) < 1:
-        sys.exit('Error: invalid FASTA file: ' + assembly)
-    for _, seq in fasta:
-        if len(seq) == 0:
-            sys.exit('Error: invalid FASTA file (contains a zero-length sequence): ' + assembly)
 
 
 def get_headers(module_names, modules):
@@ -458,21 +690,49 @@ def gunzip_assembly_if_necessary(assembly, temp_dir):
         return assembly
 
 
-def build_minimap2_index(assembly, unzipped_assembly, external_programs, temp_dir):
+def build_fasta_index(assembly, unzipped_assembly, temp_dir):
+    """
+    Indexes the unzipped assembly (saving a .fai file in the temp directory) so the modules can
+    fetch parts of contigs from the file instead of loading the whole assembly. The index gives the
+    contig lengths, so this is also where the assembly's contents are checked.
+    """
+    fasta_index = FastaIndex(unzipped_assembly, pathlib.Path(temp_dir) / (uuid.uuid4().hex + '.fai'))
+    if len(fasta_index) < 1:
+        fasta_index.close()
+        sys.exit('Error: invalid FASTA file: ' + assembly)
+    if any(length == 0 for length in fasta_index.lengths.values()):
+        fasta_index.close()
+        sys.exit('Error: invalid FASTA file (contains a zero-length sequence): ' + assembly)
+    return fasta_index
+
+
+def build_minimap2_index(assembly, context, external_programs, temp_dir, index_cache=None):
     """
     A lot of the modules use minimap2 alignment, so pre-building the index for this assembly once
-    can save a bit of time.
+    can save a bit of time. The mappy aligner keeps its own index in memory, so it doesn't need one.
+    With an index cache (--index_cache), the index is taken from the cache if it's there, and added
+    to the cache if it isn't.
     """
-    if 'minimap2' not in external_programs:
+    if 'minimap2' not in external_programs or get_aligner().name != 'minimap2':
         return None
     minimap2_index = (pathlib.Path(temp_dir) / (uuid.uuid4().hex + '.mmi')).resolve()
-    command = ['minimap2', '-d', minimap2_index, unzipped_assembly]
+    if index_cache is not None and index_cache.get(context.sha256, minimap2_index):
+        return minimap2_index
+    command = ['minimap2', '-t', str(get_threads()), '-d', minimap2_index, context]
     p = subprocess.run(command, capture_output=True, text=True)
     if p.returncode != 0:
         sys.exit(f'\nError: minimap2 failed to index sample {assembly}:\n{p.stderr}')
+    if index_cache is not None:
+        index_cache.put(context.sha256, minimap2_index)
     return minimap2_index
 
 
+def get_index_cache(args):
+    if args.index_cache is None:
+        return None
+    return IndexCache(args.index_cache, int(args.index_cache_size * 1024 ** 3))
+
+
 def decompress_file(in_file, out_file):
     with gzip.GzipFile(in_file, 'rb') as i, open(out_file, 'wb') as o:
         s = i.read()
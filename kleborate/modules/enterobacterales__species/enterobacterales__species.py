@@ -18,6 +18,8 @@ import pathlib
 import shutil
 import sys
 
+from ...shared.threads import get_threads
+
 
 def description():
     return 'Mash-based species detection for enterobacterales species'
@@ -82,7 +84,7 @@ def get_results(assembly, minimap2_index, args, previous_results):
 
 
 def get_enterobacterales__species(assembly, sketch_file):
-    f = os.popen('mash dist ' + str(sketch_file) + ' ' + str(assembly))
+    f = os.popen(f'mash dist -p {get_threads()} ' + str(sketch_file) + ' ' + str(assembly))
     best_species, best_distance = None, 1.0
     for line in f:
         line_parts = line.split('\t')
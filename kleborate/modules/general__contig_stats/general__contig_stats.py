@@ -11,14 +11,20 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
-import collections
 import json
 import pathlib
+import threading
 from pathlib import Path
 import ast
 
-from ...shared.misc import load_fasta
+import numpy as np
 
+from ...shared.assembly import get_contig_base_counts
+
+
+# Species specifications, keyed by file path, so they are only loaded once per process.
+SPECIES_SPECIFICATIONS = {}
+SPECIES_SPECIFICATIONS_LOCK = threading.Lock()
 
 
 def description():
@@ -67,42 +73,39 @@ def get_results(assembly, minimap2_index, args, previous_results):
 
 
 def get_contig_stats(assembly):
-    fasta = load_fasta(assembly)
-
-    base_counts = collections.defaultdict(int)
-    for _, seq in fasta:
-        for b in seq:
-            base_counts[b] += 1
-    base_counts.pop('A', None)
-    base_counts.pop('C', None)
-    base_counts.pop('G', None)
-    base_counts.pop('T', None)
-    ambiguous_base_count = sum(base_counts.values())
+    base_counts = get_contig_base_counts(assembly)
+    if not base_counts:
+        return 0, 0, 0, 0, 'no'
+
+    ambiguous_base_count = sum(ambiguous for _, ambiguous in base_counts.values())
     if ambiguous_base_count:
         ambiguous_bases = 'yes (' + str(ambiguous_base_count) + ')'
     else:
         ambiguous_bases = 'no'
 
-    contig_lengths = sorted([len(x[1]) for x in fasta])
-    if not contig_lengths:
-        return 0, 0, 0, 0, 'no'
-    longest = contig_lengths[-1]
-
-    total_size = sum(contig_lengths)
-    half_total_length = total_size / 2
-    total_so_far = 0
-    segment_lengths = contig_lengths[::-1]
-    N50 = 0
-    for length in segment_lengths:
-        total_so_far += length
-        if total_so_far >= half_total_length:
-            N50 = length
-            break
+    # The N50 is the length of the contig (from longest to shortest) which brings the total so far
+    # to half of the total size.
+    contig_lengths = np.sort(np.array([length for length, _ in base_counts.values()],
+                                      dtype=np.int64))[::-1]
+    total_size = int(contig_lengths.sum())
+    cumulative_lengths = np.cumsum(contig_lengths)
+    N50 = int(contig_lengths[np.searchsorted(cumulative_lengths, total_size / 2)])
 
-    return len(contig_lengths), N50, longest, total_size, ambiguous_bases
+    return len(contig_lengths), N50, int(contig_lengths[0]), total_size, ambiguous_bases
 
 
 def load_species_specifications(file_path):
+    """
+    Returns the species specifications in the file, which is only read once per process.
+    """
+    file_path = str(file_path)
+    with SPECIES_SPECIFICATIONS_LOCK:
+        if file_path not in SPECIES_SPECIFICATIONS:
+            SPECIES_SPECIFICATIONS[file_path] = read_species_specifications(file_path)
+        return SPECIES_SPECIFICATIONS[file_path]
+
+
+def read_species_specifications(file_path):
     with open(file_path, 'r') as file:
         # Read the entire file content into a single string
         file_content = file.read()
@@ -20,6 +20,7 @@ not, see <https://www.gnu.org/licenses/>.
 import pathlib
 
 from .general__contig_stats import *
+from ...shared.assembly import AssemblyContext
 
 
 def get_file_dir():
@@ -189,3 +190,17 @@ def test_get_results():
     assert results['total_size'] == '115'
     assert results['ambiguous_bases'] == 'no'
     assert results['QC_warnings'] == 'total_size,N50'
+
+
+def test_assembly_context():
+    # An AssemblyContext gives the same stats (from its FASTA index) as the file.
+    for i in range(1, 5):
+        assembly = get_file_dir() / f'test_{i}.fasta'
+        context = AssemblyContext(assembly)
+        assert get_contig_stats(context) == get_contig_stats(assembly)
+        context.close()
+
+
+def test_load_species_specifications():
+    species_file = data_dir() / 'species_specification.txt'
+    assert load_species_specifications(species_file) is load_species_specifications(species_file)
@@ -75,6 +75,10 @@ def data_dir():
     return pathlib.Path(__file__).parents[0] / 'data'
 
 
+def alignment_queries():
+    return sorted(data_dir().glob('*.fasta'))
+
+
 def get_results(assembly, minimap2_index, args, previous_results):
     genes = ['clbA', 'clbB', 'clbC', 'clbD', 'clbE', 'clbF', 'clbG', 'clbH', 'clbI', 'clbL',
              'clbM', 'clbN', 'clbO', 'clbP', 'clbQ']
@@ -73,6 +73,10 @@ def data_dir():
     return pathlib.Path(__file__).parents[0] / 'data'
 
 
+def alignment_queries():
+    return sorted(data_dir().glob('*.fasta'))
+
+
 def get_results(assembly, minimap2_index, args, previous_results):
     genes = ['rmpA', 'rmpC', 'rmpD']
     profiles = data_dir() / 'profiles.tsv'
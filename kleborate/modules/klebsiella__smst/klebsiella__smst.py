@@ -74,6 +74,10 @@ def data_dir():
     return pathlib.Path(__file__).parents[0] / 'data'
 
 
+def alignment_queries():
+    return sorted(data_dir().glob('*.fasta'))
+
+
 def get_results(assembly, minimap2_index, args, previous_results):
     genes = ['iroB', 'iroC', 'iroD', 'iroN']
     profiles = data_dir() / 'profiles.tsv'
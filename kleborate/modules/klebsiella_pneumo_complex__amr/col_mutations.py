@@ -18,12 +18,13 @@ from Bio.Align import substitution_matrices
 from ...shared.alignment import align_query_to_ref, truncation_check
 
 
-def check_for_mgrb_pmrb_gene_truncations(hits_dict, assembly, trunc, min_ident):
+def check_for_mgrb_pmrb_gene_truncations(hits_dict, assembly, trunc, min_ident, alignment_hits=None):
     best_mgrb_cov, best_pmrb_cov = 0.0, 0.0
     mgrb_hit, pmrb_hit = None, None
     start_codons = {'TTG', 'CTG', 'ATT', 'ATC', 'ATA', 'ATG', 'GTG'}
 
-    alignment_hits = align_query_to_ref(trunc, assembly, None, min_identity=None)
+    if alignment_hits is None:
+        alignment_hits = align_query_to_ref(trunc, assembly, None, min_identity=None)
     for hit in alignment_hits:
         assert hit.query_name == 'pmrB' or hit.query_name == 'mgrB'
         _, coverage, _ = truncation_check(hit)
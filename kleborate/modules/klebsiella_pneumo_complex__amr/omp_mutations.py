@@ -14,20 +14,16 @@ not, see <http://www.gnu.org/licenses/>.
 """
 
 from Bio.Seq import Seq
-from Bio import Align
-from Bio.Align import substitution_matrices
-from ...shared.alignment import align_query_to_ref, truncation_check, get_bases_per_ref_pos
+from ...shared.alignment import align_query_to_ref, truncation_check
 
 
-def check_omp_genes(hits_dict, assembly, omp, min_identity, min_coverage):
+def check_omp_genes(hits_dict, assembly, omp, min_identity, min_coverage, alignment_hits=None):
 
     best_ompk35_cov, best_ompk36_cov = 0.0, 0.0
     ompk36_loci = {'OmpK36': [(25, 'C')]}
     
-    # define the aligner
-    aligner = Align.PairwiseAligner(mode='global', match_score=5, mismatch_score=-4, open_gap_score = -10, extend_gap_score = -0.5)
-    
-    alignment_hits = align_query_to_ref(omp, assembly, min_query_coverage=None, min_identity=None)
+    if alignment_hits is None:
+        alignment_hits = align_query_to_ref(omp, assembly, min_query_coverage=None, min_identity=None)
     
     ompk35_hit = False
     ompk36_hit = False
@@ -42,14 +38,11 @@ def check_omp_genes(hits_dict, assembly, omp, min_identity, min_coverage):
 
         elif hit.query_name == 'OmpK36':
             ompk36_hit = True
-            query_seq = hit.query_seq
-            assembly_seq = hit.ref_seq
-            alignments = aligner.align(query_seq , assembly_seq)
-            bases_per_ref_pos = get_bases_per_ref_pos(alignments[0])
+            # the assembly's base at each locus is read through the hit's CIGAR
             loci = ompk36_loci[hit.query_name]
             for pos, wt_base in loci:
-                assembly_base = bases_per_ref_pos[pos]
-                query_base = query_seq[pos-1]
+                assembly_base = hit.get_ref_base(pos-1)
+                query_base = hit.full_query_seq[pos-1]
                 if query_base == wt_base and assembly_base == 'T':
                     hits_dict['Omp_mutations'].append(f"{hit.query_name}_{wt_base.lower()}{pos}{assembly_base.lower()}")
 
@@ -14,17 +14,17 @@ not, see <http://www.gnu.org/licenses/>.
 """
 
 from Bio.Seq import Seq
-from Bio import Align
-from Bio.Align import substitution_matrices
-from ...shared.alignment import align_query_to_ref, truncation_check, get_bases_per_ref_pos
+from ...shared.alignment import align_query_to_ref, truncation_check
 from ...shared.misc import load_fasta, reverse_complement
 
 
 
-def check_for_qrdr_mutations(hits_dict, assembly, qrdr, min_identity, min_coverage):
+def check_for_qrdr_mutations(hits_dict, assembly, qrdr, min_identity, min_coverage,
+                             alignment_hits=None):
     
     """
-    This function checks for qrdr mutations
+    This function checks for qrdr mutations. If the qrdr genes have already been aligned to the
+    assembly, their (unfiltered) hits can be given as alignment_hits.
     
     This function returns:
     * a hits dictionary with Fluoroquinolone(Qrdr) mutations
@@ -33,37 +33,23 @@ def check_for_qrdr_mutations(hits_dict, assembly, qrdr, min_identity, min_covera
     qrdr_loci = {'GyrA': [(83, 'S'), (87, 'D')],
                      'ParC': [(80, 'S'), (84, 'E')]}
 
-    gyra_ref = 'MSDLAREITPVNIEEELKNSYLDYAMSVIVGRALPDVRDGLKPVHRRVLYAMNVLGNDWN' \
-               'KAYKKSARVVGDVIGKYHPHGDSAVYDTIVRMAQPFSLRYMLVDGQGNFGSIDGDSAAAM'
-    parc_ref = 'MSDMAERLALHEFTENAYLNYSMYVIMDRALPFIGDGLKPVQRRIVYAMSELGLNASAKF' \
-               'KKSARTVGDVLGKYHPHGDSACYEAMVLMAQPFSYRYPLVDGQGNWGAPDDPKSFAAMRY'
-
-    # define PairwiseAligner
-    protein_aligner = Align.PairwiseAligner()
-    protein_aligner.substitution_matrix = substitution_matrices.load("BLOSUM62")
-    protein_aligner.open_gap_score = -10
-    protein_aligner.extend_gap_score = -0.5
-
     snps = []
 
-    alignment_hits = align_query_to_ref(qrdr, assembly, min_query_coverage=None, min_identity=min_identity) 
+    if alignment_hits is None:
+        alignment_hits = align_query_to_ref(qrdr, assembly, min_query_coverage=None, min_identity=min_identity)
+    else:
+        alignment_hits = [h for h in alignment_hits if h.percent_identity >= min_identity]
     for hit in alignment_hits:
-        _, coverage, translation = truncation_check(hit)
+        _, coverage, _ = truncation_check(hit)
         
         if coverage > min_coverage:
-            if hit.query_name == 'GyrA':
-                alignments = protein_aligner.align(gyra_ref, translation)
-            elif hit.query_name == 'ParC':
-                alignments = protein_aligner.align(parc_ref, translation)
-            else:
-                assert False
-            bases_per_ref_pos = get_bases_per_ref_pos(alignments[0])
+            # The query genes are the GyrA/ParC reference sequences, so the assembly's residues at
+            # the QRDR positions are read through the hit's CIGAR.
             loci = qrdr_loci[hit.query_name]
 
             for pos, wt_base in loci:
-                assembly_base = bases_per_ref_pos[pos]
-                if pos in bases_per_ref_pos and assembly_base != wt_base \
-                        and assembly_base != '-' and assembly_base != '.':
+                assembly_base = hit.get_ref_residue(pos)
+                if assembly_base is not None and assembly_base != wt_base:
                     snps.append(hit.query_name + '-' + str(pos) + assembly_base)
         
     if snps:
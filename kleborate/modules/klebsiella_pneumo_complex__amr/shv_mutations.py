@@ -13,164 +13,276 @@ details. You should have received a copy of the GNU General Public License along
 not, see <http://www.gnu.org/licenses/>.
 """
 
-from Bio.Seq import Seq
+import argparse
+import collections
+import hashlib
+import os
+import pathlib
+import threading
+
 from Bio import Align
 from Bio.Align import substitution_matrices
-from ...shared.misc import reverse_complement
-
-def check_for_shv_mutations(hit, hit_allele, bla_class, exact_match):
+from ...shared.misc import load_fasta, reverse_complement
+from ...shared.seq_ops import translate
+
+
+# SHV hits are translated and aligned to the SHV-1 protein.
+SHV_1_REF = 'MRYIRLCIISLLATLPLAVHASPQPLEQIKLSESQLSGRVGMIEMDLASGRTLTAWRADERFPMMSTFKVVLCGAVLAR' \
+            'VDAGDEQLERKIHYRQQDLVDYSPVSEKHLADGMTVGELCAAAITMSDNSAANLLLATVGGPAGLTAFLRQIGDNVTRL' \
+            'DRWETELNEALPGDARDTTTPASMAATLRKLLTSQRLSARSQRQLLQWMVDDRVAGPLIRSVLPAGWFIADKTGAGERG' \
+            'ARGIVALLGPNNKAERIVVIYLRDTPASMAERNQQIAGIGAALIEHWQR'
+
+# The SHV sites which are checked for mutations. Each is (Ambler position, 0-based position in
+# SHV_1_REF, SHV-1 amino acid, class, required site):
+# * A mutation at a site with a class (ESBL or inhR) gives the hit that class, but if the site has a
+#   required site (an Ambler position), only when the required site is also mutated.
+# * Mutations at sites without a class are reported but don't change the class.
+# Sites which can change the class are listed first, in the order their mutations are added to the
+# allele name. Mutations are otherwise reported in Ambler order.
+SHV_SITES = [(169, 164, 'L', 'ESBL', None),
+             (179, 174, 'D', 'ESBL', None),
+             (238, 233, 'G', 'ESBL', None),
+             (148, 143, 'L', 'ESBL', None),
+             (240, 234, 'E', 'ESBL', 35),
+             (69, 64, 'M', 'inhR', None),
+             (130, 125, 'S', 'inhR', None),
+             (234, 229, 'K', 'inhR', None),
+             (235, 230, 'T', 'inhR', None),
+             (25, 20, 'A', None, None),
+             (35, 30, 'L', None, None),
+             (146, 141, 'A', None, None),
+             (156, 151, 'G', None, None),
+             (164, 159, 'R', None, None),
+             (165, 160, 'W', None, None),
+             (166, 161, 'E', None, None),
+             (167, 162, 'T', None, None),
+             (168, 163, 'E', None, None),
+             (170, 165, 'N', None, None),
+             (171, 166, 'E', None, None),
+             (172, 167, 'A', None, None),
+             (173, 168, 'L', None, None),
+             (174, 169, 'P', None, None),
+             (175, 170, 'G', None, None),
+             (176, 171, 'D', None, None),
+             (177, 172, 'A', None, None),
+             (178, 173, 'R', None, None)]
+SHV_REF_POSITIONS = {site[0]: site[1] for site in SHV_SITES}
+
+# The omega loop (Ambler positions), whose sequence is reported when it differs from SHV-1's.
+OMEGA_LOOP = range(164, 180)
+SHV_1_OMEGA_LOOP = ''.join(SHV_1_REF[SHV_REF_POSITIONS[p]] for p in OMEGA_LOOP)
+
+# The protein aligner (with its BLOSUM62 matrix) is made when first used and then shared by all
+# hits.
+PROTEIN_ALIGNER = None
+PROTEIN_ALIGNER_LOCK = threading.Lock()
+
+# Precomputed SHV profiles (see get_shv_profiles), key = absolute path of the reference FASTA.
+SHV_PROFILES = {}
+SHV_PROFILES_LOCK = threading.Lock()
+
+ShvProfile = collections.namedtuple('ShvProfile', ['mutations', 'esbl_mutations',
+                                                   'inhr_mutations', 'has_esbl', 'has_inhr',
+                                                   'omega_loop_seq'])
+
+
+def check_for_shv_mutations(hit, hit_allele, bla_class, exact_match, ref_file=None):
     
     # Don't do anything on non-SHV genes.
     if 'SHV' not in hit_allele:
         return bla_class, [], [], None
 
-    nucl_seq = hit.ref_seq
+    # A hit which exactly matches its whole reference allele has that allele's sequence, so if the
+    # reference file (ref_file) was given, its profile is taken from the precomputed profiles.
+    # Other hits (and alleles without a precomputed profile) are translated and aligned.
+    profile = None
+    if exact_match and ref_file is not None and hit.is_exact():
+        profile = get_shv_profiles(ref_file).get(hit.query_name)
+    if profile is None:
+        profile = get_nucl_shv_profile(hit.ref_seq)
+    if profile is None:
+        return bla_class, [], [], None
 
+    if exact_match:
+        new_bla_class = bla_class
+    else:
+        new_bla_class = get_new_bla_class(profile.has_esbl, profile.has_inhr)
+    class_changing_mutations = \
+        get_class_changing_mutations(bla_class, new_bla_class, profile.esbl_mutations,
+                                     profile.inhr_mutations)
+
+    return new_bla_class, profile.mutations, class_changing_mutations, profile.omega_loop_seq
+
+
+def get_protein_aligner():
+    global PROTEIN_ALIGNER
+    with PROTEIN_ALIGNER_LOCK:
+        if PROTEIN_ALIGNER is None:
+            aligner = Align.PairwiseAligner()
+            aligner.substitution_matrix = substitution_matrices.load("BLOSUM62")
+            aligner.open_gap_score = -10
+            aligner.extend_gap_score = -0.5
+            PROTEIN_ALIGNER = aligner
+        return PROTEIN_ALIGNER
+
+
+def get_nucl_shv_profile(nucl_seq):
+    """
+    Translates an SHV gene and returns its ShvProfile (see get_shv_profile), or None if it can't be
+    translated or doesn't align well enough to SHV-1.
+    """
     # If there are any ambiguous bases in the sequence, then we can't do the translation.
     ambiguous_bases = set(b for b in nucl_seq) - {'A', 'C', 'G', 'T'}
     if ambiguous_bases:
-        return bla_class, [], [], None
+        return None
 
-    # BioPython doesn't like it if the sequence isn't a multiple of 3.
+    # Translate whole codons only.
     nucl_seq = nucl_seq[:len(nucl_seq) // 3 * 3]
 
-    coding_dna = Seq(nucl_seq)
-    translation = str(coding_dna.translate(table='Bacterial', to_stop=True))
+    translation = translate(nucl_seq, to_stop=True)
 
-    shv_1_ref = 'MRYIRLCIISLLATLPLAVHASPQPLEQIKLSESQLSGRVGMIEMDLASGRTLTAWRADERFPMMSTFKVVLCGAVLAR' \
-                'VDAGDEQLERKIHYRQQDLVDYSPVSEKHLADGMTVGELCAAAITMSDNSAANLLLATVGGPAGLTAFLRQIGDNVTRL' \
-                'DRWETELNEALPGDARDTTTPASMAATLRKLLTSQRLSARSQRQLLQWMVDDRVAGPLIRSVLPAGWFIADKTGAGERG' \
-                'ARGIVALLGPNNKAERIVVIYLRDTPASMAERNQQIAGIGAALIEHWQR'
+    return get_shv_profile(translation)
 
-    # define the aligner
-    protein_aligner = Align.PairwiseAligner()
-    protein_aligner.substitution_matrix = substitution_matrices.load("BLOSUM62")
-    protein_aligner.open_gap_score = -10
-    protein_aligner.extend_gap_score = -0.5
 
+def get_shv_profile(translation):
+    """
+    Aligns an SHV protein to SHV-1 and returns its ShvProfile, or None if it doesn't align well
+    enough (less than 90% identity) to look for SHV mutations.
+    """
+    alignment = next(iter(get_protein_aligner().align(SHV_1_REF, translation)), None)
+    if alignment is None:
+        return None
+    ref_aligned, hit_aligned = alignment
+    if get_percent_identity(ref_aligned, hit_aligned) < 0.9:
+        return None
+    return get_residue_profile(get_hit_residues(ref_aligned, hit_aligned))
 
-    alignments = protein_aligner.align(shv_1_ref, translation)
 
-    # If we didn't get any global amino acid alignments, then it's not appropriate to look for SHV
-    # mutations in this hit.
-    if not alignments:
-        return bla_class, [], [], None
+def get_percent_identity(ref_aligned, hit_aligned):
+    matches = sum(a == b for a, b in zip(ref_aligned, hit_aligned))
+    return matches / len(ref_aligned)
 
-    alignment = alignments[0]
-    ref_aligned, hit_aligned = alignment
-    score = alignment.score
-    
 
-    # If the identity of the alignment is too low, then it's not appropriate to look for SHV
-    # mutations in this hit.
-    identity = get_percent_identity(ref_aligned, hit_aligned)
-    
-    if identity < 0.9:
-        return bla_class, [], [], None
-    
-    
-    # Mutations at these sites will lead to an ESBL class:
-    pos_169_mut, pos_169_aa = get_mut(ref_aligned, hit_aligned, 164, 169, 'L')
-    pos_179_mut, pos_179_aa = get_mut(ref_aligned, hit_aligned, 174, 179, 'D')
-    pos_238_mut, pos_238_aa = get_mut(ref_aligned, hit_aligned, 233, 238, 'G')
-    pos_148_mut, pos_148_aa = get_mut(ref_aligned, hit_aligned, 143, 148, 'L')
-    
-    # Mutations at site Ambler-240 will lead to an ESBL class, but only if site Ambler-35 is also mutated.
-    pos_035_mut, pos_035_aa = get_mut(ref_aligned, hit_aligned,  30,  35, 'L')
-    pos_240_mut, pos_240_aa = get_mut(ref_aligned, hit_aligned, 234, 240, 'E')
-
-    has_esbl = (pos_169_mut or pos_179_mut or pos_238_mut or pos_148_mut or 
-                                            (pos_240_mut and pos_035_mut))
-
-    esbl_mutations = [pos_169_mut, pos_179_mut, pos_238_mut, pos_148_mut, pos_240_mut]
-
-    # Mutations at these sites will lead to inhibition:
-    pos_069_mut, pos_069_aa = get_mut(ref_aligned, hit_aligned,  64,  69, 'M')
-    pos_130_mut, pos_130_aa = get_mut(ref_aligned, hit_aligned, 125, 130, 'S')
-    pos_234_mut, pos_234_aa = get_mut(ref_aligned, hit_aligned, 229, 234, 'K')
-    pos_235_mut, pos_235_aa = get_mut(ref_aligned, hit_aligned, 230, 235, 'T')
-
-    has_inhr = (pos_069_mut or pos_130_mut or pos_234_mut or pos_235_mut)
-    inhr_mutations = [pos_069_mut, pos_130_mut, pos_234_mut, pos_235_mut]
-
-    # Mutations at these sites don't change the class, but will still be reported:
-    pos_025_mut, pos_025_aa = get_mut(ref_aligned, hit_aligned,  20,  25, 'A')
-    pos_035_mut, pos_035_aa = get_mut(ref_aligned, hit_aligned,  30,  35, 'L')
-    pos_146_mut, pos_146_aa = get_mut(ref_aligned, hit_aligned, 141, 146, 'A')
-    pos_156_mut, pos_156_aa = get_mut(ref_aligned, hit_aligned, 151, 156, 'G')
-
-    # Mutations in the omega loop, for tracking only (not class modification):
-    pos_164_mut, pos_164_aa = get_mut(ref_aligned, hit_aligned, 159, 164, 'R')
-    pos_165_mut, pos_165_aa = get_mut(ref_aligned, hit_aligned, 160, 165, 'W')
-    pos_166_mut, pos_166_aa = get_mut(ref_aligned, hit_aligned, 161, 166, 'E')
-    pos_167_mut, pos_167_aa = get_mut(ref_aligned, hit_aligned, 162, 167, 'T')
-    pos_168_mut, pos_168_aa = get_mut(ref_aligned, hit_aligned, 163, 168, 'E')
-    pos_170_mut, pos_170_aa = get_mut(ref_aligned, hit_aligned, 165, 170, 'N')
-    pos_171_mut, pos_171_aa = get_mut(ref_aligned, hit_aligned, 166, 171, 'E')
-    pos_172_mut, pos_172_aa = get_mut(ref_aligned, hit_aligned, 167, 172, 'A')
-    pos_173_mut, pos_173_aa = get_mut(ref_aligned, hit_aligned, 168, 173, 'L')
-    pos_174_mut, pos_174_aa = get_mut(ref_aligned, hit_aligned, 169, 174, 'P')
-    pos_175_mut, pos_175_aa = get_mut(ref_aligned, hit_aligned, 170, 175, 'G')
-    pos_176_mut, pos_176_aa = get_mut(ref_aligned, hit_aligned, 171, 176, 'D')
-    pos_177_mut, pos_177_aa = get_mut(ref_aligned, hit_aligned, 172, 177, 'A')
-    pos_178_mut, pos_178_aa = get_mut(ref_aligned, hit_aligned, 173, 178, 'R')
-
-    omega_loop_seq = ''.join([pos_164_aa, pos_165_aa, pos_166_aa, pos_167_aa, pos_168_aa,
-                              pos_169_aa, pos_170_aa, pos_171_aa, pos_172_aa, pos_173_aa,
-                              pos_174_aa, pos_175_aa, pos_176_aa, pos_177_aa, pos_178_aa,
-                              pos_179_aa])
-                              
-    if omega_loop_seq == 'RWETELNEALPGDARD':  # if it's the same as SHV-1
+def get_hit_residues(ref_aligned, hit_aligned):
+    """
+    Projects an alignment to SHV-1 positions, returning the hit's amino acid at each position of
+    SHV_1_REF ('-' where the hit has a deletion).
+    """
+    hit_residues = [b for a, b in zip(ref_aligned, hit_aligned) if a != '-']
+    assert len(hit_residues) == len(SHV_1_REF)
+    return hit_residues
+
+
+def get_residue_profile(hit_residues):
+    """
+    Returns the ShvProfile for an SHV protein's residues at each SHV-1 position (from
+    get_hit_residues) by checking each of the SHV_SITES.
+    """
+    mutations = {}  # key = Ambler position, value = mutation (e.g. '238S')
+    for ambler_pos, ref_pos, ref_aa, _, _ in SHV_SITES:
+        hit_aa = hit_residues[ref_pos]
+        if hit_aa != ref_aa and hit_aa != '-':
+            mutations[ambler_pos] = f'{ambler_pos}{hit_aa}'
+
+    classes = collections.defaultdict(list)  # key = class, value = its sites' mutations
+    has_class = set()
+    for ambler_pos, _, _, mutation_class, required_pos in SHV_SITES:
+        if mutation_class is not None and ambler_pos in mutations:
+            classes[mutation_class].append(mutations[ambler_pos])
+            if required_pos is None or required_pos in mutations:
+                has_class.add(mutation_class)
+
+    omega_loop_seq = ''.join(hit_residues[SHV_REF_POSITIONS[p]] for p in OMEGA_LOOP)
+    if omega_loop_seq == SHV_1_OMEGA_LOOP:
         omega_loop_seq = None
 
-    shv_mutations = [pos_025_mut, pos_035_mut, pos_069_mut, pos_130_mut, pos_146_mut, pos_148_mut,
-                     pos_156_mut, pos_164_mut, pos_165_mut, pos_166_mut, pos_167_mut, pos_168_mut,
-                     pos_169_mut, pos_170_mut, pos_171_mut, pos_172_mut, pos_173_mut, pos_174_mut,
-                     pos_175_mut, pos_176_mut, pos_177_mut, pos_178_mut, pos_179_mut, pos_234_mut,
-                     pos_235_mut, pos_238_mut, pos_240_mut]
-                     
-    shv_mutations = [m for m in shv_mutations if m]
+    return ShvProfile([mutations[p] for p in sorted(mutations)], classes['ESBL'], classes['inhR'],
+                      'ESBL' in has_class, 'inhR' in has_class, omega_loop_seq)
 
-    if exact_match:
-        new_bla_class = bla_class
-    else:
-        new_bla_class = get_new_bla_class(has_esbl, has_inhr)
-    class_changing_mutations = \
-        get_class_changing_mutations(bla_class, new_bla_class, esbl_mutations, inhr_mutations)
 
-    return new_bla_class, shv_mutations, class_changing_mutations, omega_loop_seq
+def get_shv_profiles_file(ref_file):
+    ref_file = pathlib.Path(ref_file)
+    return ref_file.with_name(f'{ref_file.stem}_SHV_profiles.tsv')
 
 
-def get_percent_identity(ref_aligned, hit_aligned):
-    matches = 0
-    for i, a in enumerate(ref_aligned):
-        b = hit_aligned[i]
-        if a == b:
-            matches += 1
-    return matches / len(ref_aligned)
+def get_file_checksum(filename):
+    checksum = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
 
 
+def get_shv_profiles(ref_file):
+    """
+    Returns the precomputed SHV profiles for a reference FASTA (made by write_shv_profiles) as a
+    dictionary {sequence name: ShvProfile}. The profiles file is only used if it was made from this
+    version of the reference file (checked with its SHA-256), otherwise no profiles are returned
+    and all hits are aligned.
+    """
+    key = os.path.abspath(ref_file)
+    with SHV_PROFILES_LOCK:
+        if key not in SHV_PROFILES:
+            SHV_PROFILES[key] = load_shv_profiles(ref_file)
+        return SHV_PROFILES[key]
+
+
+def load_shv_profiles(ref_file):
+    profiles_file = get_shv_profiles_file(ref_file)
+    if not profiles_file.is_file():
+        return {}
+    with open(profiles_file, 'rt') as f:
+        if f.readline().rstrip('\n') != f'# {get_file_checksum(ref_file)}':
+            return {}
+        f.readline()  # header
+        profiles = {}
+        for line in f:
+            name, *profile = line.rstrip('\n').split('\t')
+            profiles[name] = parse_shv_profile(profile)
+    return profiles
+
+
+def build_shv_profiles(ref_file, gene_info):
+    """
+    Makes the profiles of a reference FASTA's SHV alleles (those which check_for_shv_mutations
+    looks at), returning a dictionary {sequence name: ShvProfile}. Alleles which don't get a
+    profile are left out.
+    """
+    profiles = {}
+    for name, seq in load_fasta(ref_file):
+        if name in gene_info and 'SHV' in gene_info[name][0]:
+            profile = get_nucl_shv_profile(seq)
+            if profile is not None:
+                profiles[name] = profile
+    return profiles
+
 
-def get_mut(ref_aligned, hit_aligned, ref_pos, ambler_pos, ref_aa):
+def write_shv_profiles(ref_file, gene_info):
     """
-    ref_pos:    the index of the AA in SHV-1 (0-based because we're looking it up in Python)
-    ambler_pos: the index of the AA in the Ambler alignment (1-based because it's just for the name)
-    ref_aa:     the AA in the SHV-1 sequence
+    Writes the SHV profiles file for a reference FASTA. This needs to be run whenever the reference
+    FASTA is updated (otherwise the old profiles file is ignored).
     """
-    ref_no_gaps, hit_no_gaps = [], []
-    for i, a in enumerate(ref_aligned):
-        b = hit_aligned[i]
-        if a != '-':
-            ref_no_gaps.append(a)
-            hit_no_gaps.append(b)
-    assert len(ref_no_gaps) == 286
-    assert ref_no_gaps[ref_pos] == ref_aa
-    hit_aa = hit_no_gaps[ref_pos]
-    if ref_aa != hit_aa and hit_aa != '-':
-        mutation_notation = f'{ambler_pos}{hit_aa}'
-    else:
-        mutation_notation = ''
-    return mutation_notation, hit_aa
+    profiles = build_shv_profiles(ref_file, gene_info)
+    with open(get_shv_profiles_file(ref_file), 'wt') as f:
+        f.write(f'# {get_file_checksum(ref_file)}\n')
+        f.write('\t'.join(('name',) + ShvProfile._fields) + '\n')
+        for name, profile in profiles.items():
+            f.write('\t'.join([name] + format_shv_profile(profile)) + '\n')
+
+
+def format_shv_profile(profile):
+    mutations, esbl_mutations, inhr_mutations, has_esbl, has_inhr, omega_loop_seq = profile
+    return [';'.join(mutations) or '-', ';'.join(esbl_mutations) or '-',
+            ';'.join(inhr_mutations) or '-', 'yes' if has_esbl else 'no',
+            'yes' if has_inhr else 'no', '-' if omega_loop_seq is None else omega_loop_seq]
+
+
+def parse_shv_profile(parts):
+    mutations, esbl_mutations, inhr_mutations, has_esbl, has_inhr, omega_loop_seq = parts
+    return ShvProfile(*[[] if m == '-' else m.split(';')
+                        for m in (mutations, esbl_mutations, inhr_mutations)],
+                      has_esbl == 'yes', has_inhr == 'yes',
+                      None if omega_loop_seq == '-' else omega_loop_seq)
 
 
 def get_new_bla_class(esbl, inhr):
@@ -195,3 +307,13 @@ def get_class_changing_mutations(bla_class, new_bla_class, esbl_mutations, inhr_
             ('inhR' not in bla_class and 'inhR' in new_bla_class):
         class_changing_mutations += inhr_mutations
     return [m for m in class_changing_mutations if m]
+
+
+if __name__ == '__main__':
+    from ...shared.resMinimap import read_class_file
+    parser = argparse.ArgumentParser(description='Precompute the SHV profiles of a CARD FASTA file')
+    parser.add_argument('ref_file', type=str, help='CARD reference FASTA file')
+    parser.add_argument('class_file', type=str, help='CARD class file (clustered CSV)')
+    args = parser.parse_args()
+    gene_info, _, _ = read_class_file(args.class_file)
+    write_shv_profiles(args.ref_file, gene_info)
@@ -26,7 +26,11 @@ import pathlib
 
 
 from kleborate.shared.resMinimap import read_class_file, get_res_headers, resminimap_assembly
-from kleborate.modules.klebsiella_pneumo_complex__amr.klebsiella_pneumo_complex__amr import get_headers, get_results
+from kleborate.modules.klebsiella_pneumo_complex__amr.klebsiella_pneumo_complex__amr import get_headers, get_results, data_dir
+from kleborate.modules.klebsiella_pneumo_complex__amr.qrdr_mutations import check_for_qrdr_mutations
+from kleborate.modules.klebsiella_pneumo_complex__amr.col_mutations import check_for_mgrb_pmrb_gene_truncations
+from kleborate.modules.klebsiella_pneumo_complex__amr.omp_mutations import check_omp_genes
+from kleborate.shared.alignment import align_queries_to_ref
 
 
 def get_test_genome_dir():
@@ -62,3 +66,20 @@ def test_get_results_4():
     assert results['Flq_mutations'] == 'GyrA-83C;ParC-84D'
 
 
+
+
+def test_shared_alignment():
+    # The QRDR, MgrB/PmrB and OmpK checks give the same results with hits from one shared
+    # alignment as when they each align their own genes.
+    qrdr, trunc, omp = data_dir() / 'QRDR_120.fasta', data_dir() / 'MgrB_and_PmrB.fasta', data_dir() / 'OmpK.fasta'
+    assembly = get_test_genome_dir() / 'test_res_qrdr_2.fasta'
+    shared_hits = align_queries_to_ref([qrdr, trunc, omp], assembly)
+    separate, shared = collections.defaultdict(list), collections.defaultdict(list)
+    check_for_qrdr_mutations(separate, assembly, qrdr, 90.0, 90.0)
+    check_for_qrdr_mutations(shared, assembly, qrdr, 90.0, 90.0, alignment_hits=shared_hits[qrdr])
+    check_for_mgrb_pmrb_gene_truncations(separate, assembly, trunc, 90.0)
+    check_for_mgrb_pmrb_gene_truncations(shared, assembly, trunc, 90.0, alignment_hits=shared_hits[trunc])
+    check_omp_genes(separate, assembly, omp, 90.0, 90.0)
+    check_omp_genes(shared, assembly, omp, 90.0, 90.0, alignment_hits=shared_hits[omp])
+    assert shared['Flq_mutations']
+    assert shared == separate
@@ -27,7 +27,7 @@ import pathlib
 
 from kleborate.modules.klebsiella_pneumo_complex__amr.shv_mutations import*
 from kleborate.shared.resMinimap import read_class_file, get_res_headers, resminimap_assembly
-from kleborate.modules.klebsiella_pneumo_complex__amr.klebsiella_pneumo_complex__amr import get_headers, get_results
+from kleborate.modules.klebsiella_pneumo_complex__amr.klebsiella_pneumo_complex__amr import get_headers, get_results, data_dir
 
 
 def get_test_genome_dir():
@@ -174,3 +174,59 @@ def test_get_class_changing_mutations_08():
 
 
 
+
+def test_shv_sites():
+    assert len(SHV_1_REF) == 286
+    for ambler_pos, ref_pos, ref_aa, mutation_class, required_pos in SHV_SITES:
+        assert SHV_1_REF[ref_pos] == ref_aa
+        assert mutation_class in {None, 'ESBL', 'inhR'}
+        assert required_pos is None or required_pos in SHV_REF_POSITIONS
+    assert SHV_1_OMEGA_LOOP == 'RWETELNEALPGDARD'
+
+def test_get_shv_profile_01():
+    profile = get_shv_profile(SHV_1_REF)
+    assert profile == ShvProfile([], [], [], False, False, None)
+
+def test_get_shv_profile_02():
+    # 238S and 240K give an ESBL, and 240K is only class-changing alongside a mutation at 35.
+    hit = list(SHV_1_REF)
+    hit[233], hit[234] = 'S', 'K'
+    profile = get_shv_profile(''.join(hit))
+    assert profile.mutations == ['238S', '240K']
+    assert profile.esbl_mutations == ['238S', '240K']
+    assert profile.has_esbl and not profile.has_inhr
+    hit[233] = 'G'
+    assert not get_shv_profile(''.join(hit)).has_esbl
+    hit[30] = 'Q'
+    assert get_shv_profile(''.join(hit)).has_esbl
+
+def test_get_shv_profile_03():
+    # An inhR mutation, a deleted omega-loop residue and a low-identity protein.
+    hit = SHV_1_REF[:64] + 'I' + SHV_1_REF[65:160] + SHV_1_REF[161:]
+    profile = get_shv_profile(hit)
+    assert profile.mutations == ['69I']
+    assert profile.inhr_mutations == ['69I'] and profile.has_inhr
+    assert profile.omega_loop_seq == 'R-ETELNEALPGDARD'
+    assert get_shv_profile(SHV_1_REF[:200]) is None
+
+def test_shv_profiles_01():
+    # The precomputed profiles match the reference FASTA (if this fails, rebuild them with
+    # python -m kleborate.modules.klebsiella_pneumo_complex__amr.shv_mutations).
+    ref_file = data_dir() / 'CARD_v3.2.9.fasta'
+    gene_info, _, _ = read_class_file(data_dir() / 'CARD_AMR_clustered.csv')
+    profiles = get_shv_profiles(ref_file)
+    assert len(profiles) > 0
+    assert profiles == build_shv_profiles(ref_file, gene_info)
+
+def test_shv_profiles_02(tmp_path):
+    # Profiles made for a different version of the reference FASTA aren't used.
+    ref_file = tmp_path / 'ref.fasta'
+    ref_file.write_text('>a\nATG\n')
+    get_shv_profiles_file(ref_file).write_text('# 0123\nname\n')
+    assert load_shv_profiles(ref_file) == {}
+
+def test_format_shv_profile():
+    profile = ShvProfile(['35Q', '238S'], ['238S'], [], True, False, 'RWETELNEALRGDARD')
+    assert parse_shv_profile(format_shv_profile(profile)) == profile
+    profile = ShvProfile([], [], [], False, False, None)
+    assert parse_shv_profile(format_shv_profile(profile)) == profile
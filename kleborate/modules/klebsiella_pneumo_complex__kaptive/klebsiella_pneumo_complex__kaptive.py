@@ -21,9 +21,11 @@ import shutil
 import sys
 
 from kaptive.database import load_database
-from kaptive.misc import check_python_version, check_programs, get_logo, check_cpus, check_file
+from kaptive.misc import check_python_version, check_programs, get_logo, check_file
 from kaptive.assembly import typing_pipeline
 
+from ...shared.threads import get_threads
+
 
 def description():
     return 'In silico serotyping of K and L locus for the Klebsiella pneumoniae species complex'
@@ -47,8 +49,6 @@ def get_headers():
 def add_cli_options(parser):
     module_name = os.path.basename(__file__)[:-3]
     group = parser.add_argument_group(f'{module_name} module')
-    group.add_argument('-t', '--threads', type=check_cpus, default=8, metavar='',
-                       help="Kaptive number of threads for alignment (default: %(default)s)")
     group.add_argument('--k-db', type=load_database, default=load_database('kpsc_k'), metavar='',
                        help="Kaptive database for K-locus typing (default: kpsc_k)")
     group.add_argument('--o-db', type=load_database, default=load_database('kpsc_k'), metavar='',
@@ -57,8 +57,9 @@ def add_cli_options(parser):
 
 
 def check_cli_options(args):
-    if args.threads < 1:
-        raise ValueError("The number of threads must be at least 1.")
+    # The databases are checked when they are loaded (load_database), and Kaptive's threads come
+    # from the runner's --threads budget, which the runner checks.
+    pass
 
 
 def check_external_programs():
@@ -87,7 +88,7 @@ def get_results(assembly, minimap2_index, args, previous_results):
 
     results_dict = {}
 
-    k_results = typing_pipeline(assembly_path, args.k_db, threads=args.threads)
+    k_results = typing_pipeline(assembly_path, args.k_db, threads=get_threads())
     if k_results is not None:
         k_result_table = k_results.format('tsv')
         for line in k_result_table.split('\n'):
@@ -100,7 +101,7 @@ def get_results(assembly, minimap2_index, args, previous_results):
     else:
         print("Warning: No gene alignments sufficient for typing. Skipping k_results processing.")
 
-    o_results = typing_pipeline(assembly_path, args.o_db, threads=args.threads)
+    o_results = typing_pipeline(assembly_path, args.o_db, threads=get_threads())
     if o_results is not None:
         o_result_table = o_results.format('tsv')
         for line in o_result_table.split('\n'):
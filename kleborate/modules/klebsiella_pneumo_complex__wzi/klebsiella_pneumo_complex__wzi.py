@@ -64,6 +64,12 @@ def data_dir():
     return pathlib.Path(__file__).parents[0] / 'data'
 
 
+def alignment_queries():
+    # wzi has its own mlst (wzi.py) which aligns with align_query_to_ref, so its alleles go in the
+    # assembly's combined alignment.
+    return sorted(data_dir().glob('*.fasta'))
+
+
 def get_results(assembly, minimap2_index, args, previous_results):
     gene = 'wzi'
     profile = data_dir() / 'wzi.txt'
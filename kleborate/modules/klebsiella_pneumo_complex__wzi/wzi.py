@@ -13,6 +13,7 @@ not, see <https://www.gnu.org/licenses/>.
 import re
 
 from ...shared.alignment import align_query_to_ref, truncation_check
+from ...shared import mlst as shared_mlst
 from ...shared.mlst import get_best_hits, number_from_hit
 
 
@@ -20,44 +21,27 @@ def load_st_profiles(database_path, gene_name, extra_info_name=None):
     """
     This function returns a list of WZI ST profiles, where each value is a tuple:
     (ST number, list of allele numbers, extra info)
+
+    The wzi table is loaded with the shared MLST code, so it also gets a compiled table. Its final
+    column (the K locus) is loaded as extra info even if extra_info_name isn't given.
     """
-    profiles, first_line = [], True
     with open(database_path, 'r') as f:
-        for line in f:
-            parts = line.rstrip('\n').split('\t')
-            if first_line:
-                assert parts[0] == 'ST'
-                if extra_info_name is None:
-                    assert parts[1] == gene_name
-                else:
-                    assert parts[1] == gene_name and parts[2] == extra_info_name
-                first_line = False
-            else:
-                st = int(parts[0])
-                allele = [int(parts[1])]  # Store allele number as a list
-                extra_info = parts[2] if extra_info_name else None
-                profiles.append((st, allele, extra_info))
-    return profiles
+        header = f.readline().rstrip('\n').split('\t')
+    assert header[0] == 'ST' and header[1] == gene_name
+    if extra_info_name is not None:
+        assert header[2] == extra_info_name
+    return shared_mlst.load_st_profiles(database_path, [gene_name],
+                                        header[2] if len(header) > 2 else None)
 
 
 def get_best_matching_profile(profiles, gene_name, best_hits_per_gene):
     """
-    This function looks for an ST which best matches the hits. Each ST is scored based on the
-    number of genes which have a matching hit (i.e. a hit with the same number). So the score for
-    any ST can be 0 to the number of genes in the scheme. STs earlier in the profiles are
-    preferred, so if an assembly matches multiple STs equally well, this function will return
-    whichever is first in the profiles.
+    This function looks for an ST which best matches the hits, using the shared MLST code with a
+    single-gene scheme. STs earlier in the profiles are preferred, so if an assembly matches
+    multiple STs equally well, this function will return whichever is first in the profiles.
     """
-    best_st, best_extra_info, best_matches = 0, '', 0
-    best_allele = 0
-    for st, alleles, extra_info in profiles:
-        matches = 0
-        for allele in alleles:
-            if any(allele == number_from_hit(h) for h in best_hits_per_gene):
-                matches += 1
-                if matches > best_matches:
-                    best_st, best_allele, best_extra_info, best_matches = st, alleles, extra_info, matches
-    return best_st, best_allele, best_extra_info
+    return shared_mlst.get_best_matching_profile(profiles, [gene_name],
+                                                 {gene_name: best_hits_per_gene})
 
 
 def get_best_hit_per_gene(gene_name, best_hits_per_gene, alleles):
@@ -97,6 +97,16 @@ def check_external_programs():
     return programs
 
 
+def alignment_queries():
+    """
+    This function is optional. If the module aligns query FASTA files to the assembly with
+    align_query_to_ref, it can return those files here. Kleborate will then align the queries of
+    all modules to the assembly in a single minimap2 call before any module is run, and the
+    module's align_query_to_ref calls will get their hits from that instead of running minimap2.
+    """
+    return []
+
+
 def get_results(assembly, minimap2_index, args, previous_results):
     """
     This function carries out the module's analysis on a single assembly. It returns a dictionary
@@ -104,7 +114,10 @@ def get_results(assembly, minimap2_index, args, previous_results):
     results in string format.
 
     It takes four arguments:
-    * assembly: the path to the assembly file
+    * assembly: the assembly, as an AssemblyContext (see shared/assembly.py). This works as the
+      path to the assembly file, but it also holds the assembly's sequences (e.g. assembly.contigs)
+      so the module doesn't need to load them again. If only parts of contigs are needed, they can
+      be fetched with assembly.fasta_index, without loading the whole assembly.
     * minimap2_index: the path to the minimap2 index for the assembly
     * args: all of Kleborate's command-line arguments
     * previous_results: a dictionary of results from modules run before this one.
@@ -12,14 +12,28 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
+import atexit
+import bisect
+import collections
+import hashlib
 import os
+import pathlib
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 
-from Bio.Seq import Seq
 from Bio.Data.CodonTable import TranslationError
-from .misc import load_fasta, reverse_complement
+from .assembly import load_assembly_contigs
+from .misc import load_fasta, read_fasta, reverse_complement
+from .seq_ops import translate
+from .threads import get_threads
+
+
+# Matches the start of a sequence up to its first ambiguous base.
+UNAMBIGUOUS_PREFIX = re.compile('[ACGT]*')
 
 
 class Alignment(object):
@@ -31,8 +45,23 @@ class Alignment(object):
     percent_identity).
 
     If dictionaries of the query and reference sequences are also provided (key=name, value=seq),
-    then the Alignment object will also contain the
+    then the Alignment object will also contain the aligned parts of the query and reference
+    sequences (query_seq and ref_seq, with ref_seq on the same strand as the query).
+
+    Query positions can be projected through the CIGAR to the reference (get_ref_pos, get_ref_base,
+    get_ref_codon and get_ref_residue), so callers can look up the reference's base or amino acid
+    at a query position without aligning the sequences again.
+
+    Alignments are made in large numbers (thousands per assembly for CARD or Achtman MLST), so the
+    class uses __slots__, and the aligned sequences, reference translation, expanded CIGAR and
+    CIGAR projection are only made when first used (and then kept).
     """
+    __slots__ = ('query_name', 'query_length', 'query_start', 'query_end', 'strand',
+                 'ref_name', 'ref_length', 'ref_start', 'ref_end',
+                 'matching_bases', 'num_bases', 'percent_identity', 'query_cov', 'ref_cov',
+                 'cigar', 'alignment_score',
+                 '_query_source', '_ref_source', '_query_seq', '_ref_seq',
+                 '_translated_ref_seq', '_expanded_cigar', '_ref_offsets')
 
     def __init__(self, paf_line, query_seqs=None, ref_seqs=None):
         self.query_name, self.query_length = None, None
@@ -44,7 +73,9 @@ class Alignment(object):
         self.percent_identity = None
         self.query_cov, self.ref_cov = None, None
         self.cigar, self.alignment_score = None, None
-        self.query_seq, self.ref_seq = None, None
+        self._query_seq, self._ref_seq = None, None
+        self._translated_ref_seq, self._expanded_cigar = None, None
+        self._ref_offsets = None
 
         self.parse_paf_line(paf_line)
         self.set_identity_and_coverages()
@@ -82,12 +113,49 @@ class Alignment(object):
         self.ref_cov = 100.0 * (self.ref_end - self.ref_start) / self.ref_length
 
     def set_sequences(self, query_seqs, ref_seqs):
-        if query_seqs is not None:
-            self.query_seq = query_seqs[self.query_name][self.query_start:self.query_end]
-        if ref_seqs is not None:
-            self.ref_seq = ref_seqs[self.ref_name][self.ref_start:self.ref_end]
+        """
+        Keeps the full query and reference sequences for this alignment (not copies), so the
+        aligned parts can be cut out later. This is done now rather than keeping the dictionaries
+        because some callers rename the hit's query (e.g. to an exact amino acid match).
+        """
+        self._query_source = None if query_seqs is None else query_seqs[self.query_name]
+        self._ref_source = None if ref_seqs is None else ref_seqs[self.ref_name]
+
+    @property
+    def query_seq(self):
+        if self._query_seq is None and self._query_source is not None:
+            self._query_seq = self._query_source[self.query_start:self.query_end]
+        return self._query_seq
+
+    @property
+    def ref_seq(self):
+        if self._ref_seq is None and self._ref_source is not None:
+            self._ref_seq = self._ref_source[self.ref_start:self.ref_end]
             if self.strand == '-':
-                self.ref_seq = reverse_complement(self.ref_seq)
+                self._ref_seq = reverse_complement(self._ref_seq)
+        return self._ref_seq
+
+    @property
+    def full_ref_seq(self):
+        """
+        The whole reference sequence (e.g. contig) this alignment is on, or None if the alignment
+        was made without reference sequences.
+        """
+        return self._ref_source
+
+    @property
+    def full_query_seq(self):
+        """
+        The whole query sequence (e.g. gene) this alignment is for, or None if the alignment was
+        made without query sequences.
+        """
+        return self._query_source
+
+    @property
+    def expanded_cigar(self):
+        if self._expanded_cigar is None and self.cigar is not None:
+            self._expanded_cigar = get_expanded_cigar(self.cigar)
+        return self._expanded_cigar
 
     def __repr__(self):
         return self.query_name + ':' + str(self.query_start) + '-' + str(self.query_end) + \
@@ -96,13 +164,75 @@ class Alignment(object):
                ' (' + ('%.3f' % self.percent_identity) + '%)'
 
     def get_translated_ref_seq(self):
-        nucl_seq = self.ref_seq
-        ambiguous_bases = set(b for b in nucl_seq) - {'A', 'C', 'G', 'T'}
-        for b in ambiguous_bases:
-            nucl_seq = nucl_seq.split(b)[0]  # truncate to first ambiguous base
-        nucl_seq = nucl_seq[:len(nucl_seq) // 3 * 3]  # truncate to a multiple of 3
-        coding_dna = Seq(nucl_seq)
-        return str(coding_dna.translate(table='Bacterial', to_stop=True))
+        if self._translated_ref_seq is None:
+            # Truncate to the first ambiguous base and then to a multiple of 3.
+            nucl_seq = UNAMBIGUOUS_PREFIX.match(self.ref_seq).group()
+            nucl_seq = nucl_seq[:len(nucl_seq) // 3 * 3]
+            self._translated_ref_seq = translate(nucl_seq, to_stop=True)
+        return self._translated_ref_seq
+
+    @property
+    def ref_offsets(self):
+        """
+        A list with one value for each aligned query base (query_start to query_end): the offset in
+        ref_seq (i.e. on the query's strand) of the reference base it is aligned to, or None if the
+        query base is an insertion (has no reference base).
+        """
+        if self._ref_offsets is None and self.cigar is not None:
+            self._ref_offsets = get_ref_offsets(self.cigar, self.strand)
+        return self._ref_offsets
+
+    def get_ref_offset(self, query_pos):
+        """
+        Returns the offset in ref_seq aligned to a query position (0-based), or None if the
+        position isn't aligned to a reference base.
+        """
+        if not self.query_start <= query_pos < self.query_end or self.ref_offsets is None:
+            return None
+        return self.ref_offsets[query_pos - self.query_start]
+
+    def get_ref_pos(self, query_pos):
+        """
+        Returns the reference position (0-based, on the reference's forward strand) aligned to a
+        query position (0-based), or None if the position isn't aligned to a reference base.
+        """
+        ref_offset = self.get_ref_offset(query_pos)
+        if ref_offset is None:
+            return None
+        if self.strand == '-':
+            return self.ref_end - 1 - ref_offset
+        return self.ref_start + ref_offset
+
+    def get_ref_base(self, query_pos):
+        """
+        Returns the reference base (on the query's strand) aligned to a query position (0-based),
+        or None if the position isn't aligned to a reference base.
+        """
+        ref_offset = self.get_ref_offset(query_pos)
+        if ref_offset is None or self.ref_seq is None:
+            return None
+        return self.ref_seq[ref_offset]
+
+    def get_ref_codon(self, residue):
+        """
+        Returns the reference codon (on the query's strand) aligned to a query codon, numbered from
+        1 like residues in the query's protein. None is returned unless all three bases of the
+        codon are aligned to three consecutive reference bases (i.e. there's no indel in it).
+        """
+        query_pos = 3 * (residue - 1)
+        ref_offsets = [self.get_ref_offset(query_pos + i) for i in range(3)]
+        if ref_offsets[0] is None or self.ref_seq is None or \
+                ref_offsets != list(range(ref_offsets[0], ref_offsets[0] + 3)):
+            return None
+        return self.ref_seq[ref_offsets[0]:ref_offsets[0] + 3]
+
+    def get_ref_residue(self, residue):
+        """
+        Returns the reference's amino acid at a query protein residue (numbered from 1), or None if
+        the residue's codon isn't fully aligned (see get_ref_codon).
+        """
+        codon = self.get_ref_codon(residue)
+        return None if codon is None else translate(codon)
 
     def is_exact(self):
         """
@@ -124,20 +254,318 @@ def align_query_to_ref(query_filename, ref_filename, ref_index=None, preset='map
                      Expressed as a percentage, so values should be 0-100.
      * min_query_coverage: if provided, alignments with a query coverage lower than this are
                            discarded. Expressed as a percentage, so values should be 0-100.
+
+     The alignment is done by the current aligner (see set_aligner): the minimap2 executable by
+     default, or in-process with mappy. If the query was already aligned to the reference by an
+     AlignmentBroker, its hits are taken from the broker instead of aligning again.
      """
+     broker = ALIGNMENT_BROKERS.get(os.path.abspath(ref_filename))
+     if broker is not None and broker.has_query(query_filename, preset):
+         return broker.get_alignments(query_filename, min_identity, min_query_coverage)
+
      query_seqs = dict(load_fasta(query_filename))
-     ref_seqs = dict(load_fasta(ref_filename))
-     ref = ref_filename if ref_index is None else ref_index
-     with open(os.devnull, 'w') as dev_null:
-         out = subprocess.check_output(['minimap2','--end-bonus=10','--eqx', '-c', '-x', preset,
-                                        str(ref), str(query_filename)], stderr=dev_null)
-     alignments = [Alignment(x, query_seqs=query_seqs, ref_seqs=ref_seqs)
-                   for x in out.decode().splitlines()]
-     if min_identity is not None:
-         alignments = [a for a in alignments if a.percent_identity >= min_identity]
-     if min_query_coverage is not None:
-         alignments = [a for a in alignments if a.query_cov >= min_query_coverage]
-     return alignments
+     ref_seqs = load_assembly_contigs(ref_filename)
+     paf_lines = get_aligner().align(query_filename, ref_filename, ref_index, preset)
+     return [Alignment(x, query_seqs=query_seqs, ref_seqs=ref_seqs)
+             for x in filter_paf_lines(paf_lines, min_identity, min_query_coverage)]
+
+
+def filter_paf_lines(paf_lines, min_identity=None, min_query_coverage=None):
+    """
+    Yields the PAF lines which pass the identity and query coverage thresholds. These are checked
+    using the raw PAF columns (the same way Alignment calculates them), so Alignment objects only
+    need to be built for the hits which are kept.
+    """
+    if min_identity is None and min_query_coverage is None:
+        yield from paf_lines
+        return
+    for line in paf_lines:
+        parts = line.split('\t', 11)
+        if len(parts) < 11:
+            yield line  # not a valid PAF line, so let Alignment report the error
+            continue
+        if min_identity is not None:
+            if 100.0 * int(parts[9]) / int(parts[10]) < min_identity:
+                continue
+        if min_query_coverage is not None:
+            if 100.0 * (int(parts[3]) - int(parts[2])) / int(parts[1]) < min_query_coverage:
+                continue
+        yield line
+
+
+class Minimap2Aligner(object):
+    """
+    Aligns by running the minimap2 executable and reading its PAF output. If a prebuilt index is
+    given for the reference (see build_minimap2_index in __main__.py), minimap2 uses that.
+    """
+    name = 'minimap2'
+
+    def align(self, query_filename, ref_filename, ref_index=None, preset='map-ont'):
+        """
+        Yields PAF lines as minimap2 writes them, so they can be filtered while it is still
+        running instead of after buffering all of its output.
+        """
+        ref = ref_filename if ref_index is None else ref_index
+        command = ['minimap2', '--end-bonus=10', '--eqx', '-c', '-x', preset,
+                   '-t', str(get_threads()), str(ref), str(query_filename)]
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              text=True) as p:
+            for line in p.stdout:
+                yield line.rstrip('\n')
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, command)
+
+    def unload(self, ref_filename):
+        pass
+
+
+# minimap2's flag for =/X CIGAR operations instead of M (the --eqx option).
+MM_F_EQX = 0x4000000
+
+# minimap2's default scoring (also used by the map-ont preset): match, mismatch, gap open, gap
+# extend, long gap open, long gap extend.
+MINIMAP2_SCORING = (2, 4, 4, 2, 24, 1)
+
+
+class MappyAligner(object):
+    """
+    Aligns in-process with mappy (minimap2's Python binding), so there is no minimap2 process per
+    call and no index file on disk. The index for each reference is built on first use and kept in
+    memory until unload is called, so all of a sample's modules share it.
+
+    mappy is given the same preset and --eqx as the minimap2 executable, and its hits are used as
+    they are. They are the same as the executable's with two exceptions: mappy has no --end-bonus
+    setting, and it doesn't report an alignment score, so the AS tag is computed from the CIGAR
+    with minimap2's scoring. Results can therefore differ slightly for borderline hits.
+    """
+    name = 'mappy'
+
+    def __init__(self):
+        try:
+            import mappy
+        except ImportError:
+            sys.exit('Error: the mappy aligner requires the mappy Python package')
+        self.mappy = mappy
+        self.indices = {}  # key = (absolute reference path, preset), value = mappy.Aligner
+        self.lock = threading.Lock()
+
+    def get_index(self, ref_filename, preset):
+        key = (os.path.abspath(ref_filename), preset)
+        with self.lock:
+            if key not in self.indices:
+                index = self.mappy.Aligner(str(ref_filename), preset=preset,
+                                           n_threads=get_threads(), extra_flags=MM_F_EQX)
+                if not index:
+                    sys.exit(f'Error: mappy failed to index {ref_filename}')
+                self.indices[key] = index
+            return self.indices[key]
+
+    def align(self, query_filename, ref_filename, ref_index=None, preset='map-ont'):
+        index = self.get_index(ref_filename, preset)
+        for name, seq in read_fasta(query_filename):
+            for hit in index.map(seq, name=name):
+                yield mappy_hit_to_paf(name, len(seq), hit)
+
+    def unload(self, ref_filename):
+        key = os.path.abspath(ref_filename)
+        with self.lock:
+            for k in [k for k in self.indices if k[0] == key]:
+                del self.indices[k]
+
+
+def mappy_hit_to_paf(query_name, query_length, hit):
+    """
+    Formats a mappy hit as a PAF line like the minimap2 executable would output.
+    """
+    return '\t'.join([query_name, str(query_length), str(hit.q_st), str(hit.q_en),
+                      '+' if hit.strand == 1 else '-',
+                      hit.ctg, str(hit.ctg_len), str(hit.r_st), str(hit.r_en),
+                      str(hit.mlen), str(hit.blen), str(hit.mapq),
+                      'tp:A:' + ('P' if hit.is_primary else 'S'), f'NM:i:{hit.NM}',
+                      f'AS:i:{get_cigar_score(hit.cigar)}', 'cg:Z:' + hit.cigar_str])
+
+
+def get_cigar_score(cigar, scoring=MINIMAP2_SCORING):
+    """
+    Scores an alignment from its CIGAR (a list of [length, operation] pairs, as given by mappy)
+    using minimap2's two-piece affine gap scoring.
+    """
+    match, mismatch, gap_open, gap_extend, long_gap_open, long_gap_extend = scoring
+    score = 0
+    for length, op in cigar:
+        if op == 7:  # =
+            score += match * length
+        elif op == 8:  # X
+            score -= mismatch * length
+        elif op in (1, 2):  # I or D
+            score -= min(gap_open + gap_extend * length, long_gap_open + long_gap_extend * length)
+    return score
+
+
+ALIGNERS = {'minimap2': Minimap2Aligner, 'mappy': MappyAligner}
+
+# The aligner used by align_query_to_ref and AlignmentBroker. Like the thread count, each process
+# has its own: the runner sets it from --aligner in the main process and in each worker process.
+ALIGNER = Minimap2Aligner()
+
+
+def set_aligner(name):
+    global ALIGNER
+    if ALIGNER.name != name:
+        ALIGNER = ALIGNERS[name]()
+
+
+def get_aligner():
+    return ALIGNER
+
+
+# Alignment brokers for the assemblies currently being typed (key = absolute assembly path).
+ALIGNMENT_BROKERS = {}
+
+
+class AlignmentBroker(object):
+    """
+    Aligns many query files to one assembly with a single aligner call, instead of one call per
+    query file. Queries are combined into one FASTA with their names tagged by file (see
+    get_combined_queries), and after alignment the hits are split back up by file. minimap2 aligns
+    each query independently, so each file's hits are the same as from its own align_query_to_ref
+    call.
+
+    While a broker is registered (see start_alignment_broker), align_query_to_ref calls for one of
+    its query files against its assembly are answered from the broker.
+    """
+
+    def __init__(self, query_filenames, ref_filename, ref_index=None, preset='map-ont'):
+        self.ref_filename, self.preset = ref_filename, preset
+        self.query_files = list(dict.fromkeys(os.path.abspath(q) for q in query_filenames
+                                              if os.path.isfile(q)))
+        self.query_seqs, self.paf_lines, self.ref_seqs = {}, {}, {}
+        if self.query_files:
+            combined_queries, query_seqs = get_combined_queries(self.query_files)
+            self.query_seqs = dict(zip(self.query_files, query_seqs))
+            self.paf_lines = {q: [] for q in self.query_files}
+            self.ref_seqs = load_assembly_contigs(ref_filename)
+            self.align(combined_queries, ref_index)
+
+    def align(self, combined_queries, ref_index):
+        for line in get_aligner().align(combined_queries, self.ref_filename, ref_index,
+                                        self.preset):
+            i, line = line.split('|', 1)
+            self.paf_lines[self.query_files[int(i)]].append(line)
+
+    def has_query(self, query_filename, preset='map-ont'):
+        return preset == self.preset and os.path.abspath(query_filename) in self.paf_lines
+
+    def get_alignments(self, query_filename, min_identity=None, min_query_coverage=None):
+        key = os.path.abspath(query_filename)
+        paf_lines = filter_paf_lines(self.paf_lines[key], min_identity, min_query_coverage)
+        return [Alignment(x, query_seqs=self.query_seqs[key], ref_seqs=self.ref_seqs)
+                for x in paf_lines]
+
+
+def align_queries_to_ref(query_filenames, ref_filename, ref_index=None, min_identity=None,
+                         min_query_coverage=None):
+    """
+    Aligns several query files to one reference and returns a dictionary {query filename: list of
+    Alignment objects}, the same as align_query_to_ref for each file. Queries which the reference's
+    AlignmentBroker (if any) has already aligned are taken from it, and the rest are aligned
+    together with a single aligner call.
+    """
+    broker = ALIGNMENT_BROKERS.get(os.path.abspath(ref_filename))
+    to_align = [q for q in query_filenames if broker is None or not broker.has_query(q)]
+    if len(to_align) > 1:
+        broker = AlignmentBroker(to_align, ref_filename, ref_index)
+    return {q: broker.get_alignments(q, min_identity, min_query_coverage)
+            if broker is not None and broker.has_query(q) else
+            align_query_to_ref(q, ref_filename, ref_index=ref_index, min_identity=min_identity,
+                               min_query_coverage=min_query_coverage)
+            for q in query_filenames}
+
+
+# Combined query files (see get_combined_queries), so each set of query files is only read and
+# combined once per process. The lock stops modules in different threads combining them twice.
+COMBINED_QUERIES = {}
+COMBINED_QUERIES_LOCK = threading.Lock()
+
+# The directory combined query files are written to: the run's temporary directory, which the
+# runner sets in the main process and in each worker process. If it isn't set, a temporary
+# directory is made for the process when first needed (and removed when the process exits).
+COMBINED_QUERIES_DIR = None
+
+
+def set_combined_queries_dir(directory):
+    global COMBINED_QUERIES_DIR
+    COMBINED_QUERIES_DIR = directory
+
+
+def get_combined_queries_dir():
+    global COMBINED_QUERIES_DIR
+    if COMBINED_QUERIES_DIR is None:
+        COMBINED_QUERIES_DIR = tempfile.mkdtemp(prefix='kleborate_queries_')
+        atexit.register(shutil.rmtree, COMBINED_QUERIES_DIR, ignore_errors=True)
+    return COMBINED_QUERIES_DIR
+
+
+def get_combined_queries(query_filenames):
+    """
+    Returns a FASTA file which combines the given query files (e.g. the allele files of an MLST
+    scheme, one per locus), along with the query files' sequences as a list of {name: seq}
+    dictionaries. In the combined file, each sequence's name is tagged with the position of its
+    file in the list ('{i}|{name}'), so hits can be split back up by file.
+
+    The combined file is made the first time a set of query files is used and then reused. It is
+    named by the checksum of the query files and kept in the run's temporary directory (see
+    get_combined_queries_dir), so worker processes can share it.
+    """
+    with COMBINED_QUERIES_LOCK:
+        key = (get_combined_queries_dir(),) + \
+            tuple((os.path.abspath(q), os.stat(q).st_mtime_ns, os.stat(q).st_size)
+                  for q in query_filenames)
+        if key not in COMBINED_QUERIES:
+            COMBINED_QUERIES[key] = make_combined_queries(query_filenames)
+        return COMBINED_QUERIES[key]
+
+
+def make_combined_queries(query_filenames):
+    checksum = hashlib.sha256()
+    for query_filename in query_filenames:
+        checksum.update(pathlib.Path(query_filename).read_bytes())
+        checksum.update(b'\0')
+    combined_queries = os.path.join(get_combined_queries_dir(), f'{checksum.hexdigest()}.fasta')
+    query_seqs = [dict(load_fasta(q)) for q in query_filenames]
+    if not os.path.isfile(combined_queries) and \
+            not write_combined_queries(combined_queries, query_seqs):
+        sys.exit('Error: could not write combined query file')
+    return combined_queries, query_seqs
+
+
+def write_combined_queries(combined_queries, query_seqs):
+    """
+    Writes a combined query file, returning whether it worked. It is written to a temporary file and
+    then moved into place, so other processes never see a partly written file.
+    """
+    directory = os.path.dirname(combined_queries)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wt', dir=directory, suffix='.fasta', delete=False) as f:
+            for i, seqs in enumerate(query_seqs):
+                for name, seq in seqs.items():
+                    f.write(f'>{i}|{name}\n{seq}\n')
+        os.replace(f.name, combined_queries)
+    except OSError:
+        return False
+    return True
+
+
+def start_alignment_broker(query_filenames, ref_filename, ref_index=None):
+    broker = AlignmentBroker(query_filenames, ref_filename, ref_index)
+    ALIGNMENT_BROKERS[os.path.abspath(ref_filename)] = broker
+    return broker
+
+
+def stop_alignment_broker(ref_filename):
+    ALIGNMENT_BROKERS.pop(os.path.abspath(ref_filename), None)
+
 
 def get_expanded_cigar(cigar):
     """
@@ -153,6 +581,29 @@ def get_expanded_cigar(cigar):
     return ''.join(expanded_cigar)
 
 
+def get_ref_offsets(cigar, strand):
+    """
+    Projects query positions to the reference using a CIGAR, returning the reference offset of
+    each query base (None for inserted bases) in the query's direction (see
+    Alignment.ref_offsets). For minus-strand alignments, minimap2's CIGAR runs along the
+    reference's forward strand (the reverse of the query), so its operations are reversed first.
+    """
+    cigar_parts = re.findall(r'(\d+)([IDX=M])', cigar)
+    if strand == '-':
+        cigar_parts.reverse()
+    ref_offsets, ref_offset = [], 0
+    for size, letter in cigar_parts:
+        size = int(size)
+        if letter == 'I':
+            ref_offsets += [None] * size
+        elif letter == 'D':
+            ref_offset += size
+        else:
+            ref_offsets += range(ref_offset, ref_offset + size)
+            ref_offset += size
+    return ref_offsets
+
+
 def hits_overlap(a, b):
     if a.ref_start <= b.ref_end and b.ref_start <= a.ref_end:  # There is some overlap
         allowed_overlap = 50
@@ -163,32 +614,53 @@ def hits_overlap(a, b):
         return False
 
 
-def overlapping(hit, existing_hits):
-    existing_hits = [h for h in existing_hits if
-                     h.strand == hit.strand and h.ref_name == hit.ref_name]
-
-    for existing_hit in existing_hits:
-        if hits_overlap(hit, existing_hit):
-            return True
-
-    return False
-  
-
 def cull_redundant_hits(minimap_hits):
     
     # Sort the hits from best to worst. Hit quality is defined as the product of gene coverage,identity and score
     
     minimap_hits = sorted(minimap_hits, key=lambda x: (1/(x.percent_identity * x.alignment_score * x.query_cov), x.query_name))
 
+    # Kept hits are indexed by contig and strand, so each hit is only checked against its nearest
+    # kept neighbour instead of against all kept hits (see KeptHitIntervals).
+    kept_intervals = collections.defaultdict(KeptHitIntervals)
     filtered_minimap_hits = []
 
     for h in minimap_hits:
-        if not overlapping(h, filtered_minimap_hits):
+        if kept_intervals[(h.ref_name, h.strand)].add_if_not_overlapping(h):
             filtered_minimap_hits.append(h)
 
     return filtered_minimap_hits
 
 
+class KeptHitIntervals(object):
+    """
+    The hits kept on one contig strand by cull_redundant_hits. Two hits overlap (see hits_overlap)
+    when they share more than 50 bases, which is the same as their ref ranges with 50 bases
+    trimmed off the end (start to end-50) intersecting. Kept hits never overlap each other, so
+    their trimmed ranges are disjoint and stay sorted by both start and end. A new hit therefore
+    only needs to be checked against the last kept range starting before its trimmed end.
+
+    The check is a binary search, but keeping a hit inserts into two Python lists, which moves
+    every later element. That is O(n) per kept hit, so culling is still O(n^2) in the worst case.
+    This is accepted: the moves are a memmove of pointers, which stays small next to the alignment
+    even for thousands of kept hits on one contig strand.
+    """
+
+    def __init__(self):
+        self.starts, self.ends = [], []
+
+    def add_if_not_overlapping(self, hit):
+        start, end = hit.ref_start, hit.ref_end - 50
+        if start >= end:  # hits of 50 bases or less can't overlap another by more than 50
+            return True
+        i = bisect.bisect_left(self.starts, end)
+        if i > 0 and self.ends[i - 1] > start:
+            return False
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        return True
+
+
 def truncation_check(alignment, cov_threshold=90.0): 
     """
     This function checks to see if a gene alignment is truncated at the amino acid level. It
@@ -228,15 +700,16 @@ def check_for_exact_aa_match(ref_file, hit, contigs):
     """
 
     
-    # First, we extract the nucleotide sequence from the assembly.
-    hit_seq = hit.ref_seq
-    assembly_seqs = dict(load_fasta(contigs))
+    # First, we get the nucleotide sequence from the assembly. The hit holds its contig's
+    # sequence, so the assembly only needs to be loaded if it was made without sequences.
+    contig_seq = hit.full_ref_seq
+    if contig_seq is None:
+        contig_seq = load_assembly_contigs(contigs, names=[hit.ref_name])[hit.ref_name]
     contig_start, contig_end = hit.ref_start, hit.ref_end  # 0-based indexing
-    contig_length = len(assembly_seqs[hit.ref_name])
-    gene_nucl_seq = assembly_seqs[hit.ref_name][contig_start:contig_end]
+    contig_length = len(contig_seq)
+    gene_nucl_seq = contig_seq[contig_start:contig_end]
     if hit.strand == '-':
          gene_nucl_seq = reverse_complement(gene_nucl_seq)
-    assert hit_seq == gene_nucl_seq
     
     # We also need to check whether the first few or last few bases of the sequence is missing.
     # This is to catch cases where an alternative start/stop codon can lead to an incomplete
@@ -244,8 +717,7 @@ def check_for_exact_aa_match(ref_file, hit, contigs):
     # missing start or end bases (relative to the reference), then we add those back on and will
     # include this augmented sequence in the exact amino acid check.
     
-    ref_seqs = load_fasta(ref_file)
-    ref_length = len(dict(ref_seqs)[hit.query_name])
+    ref_length = hit.query_length
     ref_start, ref_end = sorted([hit.query_start, hit.query_end])
     missing_start = ref_start
     missing_end = ref_length - ref_end
@@ -264,23 +736,27 @@ def check_for_exact_aa_match(ref_file, hit, contigs):
             assert False
         contig_start = max(contig_start, 0)
         contig_end = min(contig_end, contig_length)
-        augmented_gene_nucl_seq = assembly_seqs[hit.ref_name][contig_start:contig_end]
+        augmented_gene_nucl_seq = contig_seq[contig_start:contig_end]
         if hit.strand == '-':
             augmented_gene_nucl_seq = reverse_complement(augmented_gene_nucl_seq)
-            
+
+    # Translate the gene in all three frames of the forward strand (see is_exact_aa_match), and
+    # the augmented gene too if there is one.
+    gene_prots = get_three_frame_translations(gene_nucl_seq)
+    if augmented_gene_nucl_seq is not None:
+        gene_prots += get_three_frame_translations(augmented_gene_nucl_seq)
+
     # Look for an amino acid match between the assembly sequence and any reference sequence.
     best_match_length = 0
     best_matches = []
-    for name, ref_nucl_seq in ref_seqs:
-        match = is_exact_aa_match(gene_nucl_seq, ref_nucl_seq)
-        if augmented_gene_nucl_seq is not None and \
-                is_exact_aa_match(augmented_gene_nucl_seq, ref_nucl_seq):
-            match = True
-        if match:
-            if len(ref_nucl_seq) > best_match_length:
+    for ref_prot, refs in get_translated_refs(ref_file).items():
+        if not any(ref_prot in gene_prot for gene_prot in gene_prots):
+            continue
+        for ref_nucl_length, name in refs:
+            if ref_nucl_length > best_match_length:
                 best_matches = [name]
-                best_match_length = len(ref_nucl_seq)
-            elif len(ref_nucl_seq) == best_match_length:
+                best_match_length = ref_nucl_length
+            elif ref_nucl_length == best_match_length:
                 best_matches.append(name)
     if not best_matches:
         return None
@@ -288,6 +764,31 @@ def check_for_exact_aa_match(ref_file, hit, contigs):
         return sorted(best_matches)[0]
 
 
+# Translated reference sequences for check_for_exact_aa_match (key = absolute path of the
+# reference FASTA). Each file is only translated once per process, under a lock.
+TRANSLATED_REFS = {}
+TRANSLATED_REFS_LOCK = threading.Lock()
+
+
+def get_translated_refs(ref_file):
+    """
+    Returns a dictionary of the translated reference sequences in a FASTA file: key = protein
+    sequence (from translate_nucl_to_prot), value = list of (nucleotide length, name) for the
+    references with that protein.
+    """
+    key = os.path.abspath(ref_file)
+    with TRANSLATED_REFS_LOCK:
+        if key not in TRANSLATED_REFS:
+            translated_refs = collections.defaultdict(list)
+            for name, seq in read_fasta(ref_file):
+                translated_refs[translate_nucl_to_prot(seq)].append((len(seq), name))
+            TRANSLATED_REFS[key] = dict(translated_refs)
+        return TRANSLATED_REFS[key]
+
+
+def get_three_frame_translations(nucl_seq):
+    return [translate_nucl_to_prot(nucl_seq[i:]) for i in range(3)]
+
 
 def is_exact_aa_match(gene_nucl_seq_1, ref_nucl_seq):
     # look at the gene nucleotide sequence in all three frames of the forward strand.
@@ -309,14 +810,14 @@ def translate_nucl_to_prot(nucl_seq):
     # codons (e.g. GTG -> M) if it works. We have to manually add the stop codon (*) here because
     # using cds=True turns that off.
     try:
-        return str(Seq(nucl_seq).translate(table='Bacterial', to_stop=False, cds=True)) + '*'
+        return translate(nucl_seq, cds=True) + '*'
     except TranslationError:
         pass
 
     # If that failed, we will translate in a more relaxed way using a nucleotide sequence truncated
     # to a multiple-of-three length.
     truncated_nucl_seq = nucl_seq[:len(nucl_seq) // 3 * 3]
-    return str(Seq(truncated_nucl_seq).translate(table='Bacterial', to_stop=False, cds=False))
+    return translate(truncated_nucl_seq)
 
 def get_bases_per_ref_pos(alignment):
     aligned_seq1, aligned_seq2 = alignment[0], alignment[1]
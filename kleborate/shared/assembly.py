@@ -0,0 +1,385 @@
+"""
+This file contains the AssemblyContext: everything Kleborate knows about the assembly being typed.
+The runner makes one for each assembly and passes it to the modules' get_results functions in
+place of the assembly's path, so the assembly is only read once, not once per module or alignment.
+
+It also contains the FastaIndex: a samtools faidx-style index of a FASTA file, which fetches parts
+of contigs straight from the (memory-mapped) file, so hits can be cut out of the assembly without
+loading the whole assembly into memory.
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+import collections.abc
+import hashlib
+import mmap
+import os
+import pathlib
+import threading
+
+from .misc import load_fasta, read_fasta
+
+
+class AssemblyContext(object):
+    """
+    An assembly being typed. It holds:
+    * path: the assembly's (unzipped) FASTA file
+    * minimap2_index: the assembly's minimap2 index (or None if there isn't one)
+    * fasta_index: a FastaIndex of the FASTA file, for fetching parts of contigs
+    * seqs: the assembly's contigs as a list of (name, seq) tuples, in file order
+    * contigs: the same as a dictionary {name: seq}
+    * contig_lengths: a dictionary {name: length}
+    * sha256: the checksum of the FASTA file's contents
+    * cache: a dictionary where modules and shared functions can keep things they work out for
+      this assembly (keyed by their own names), so that other modules can reuse them
+
+    The FASTA index, sequences and checksum are made when first used (unless they are given) and
+    then kept. Modules run in parallel threads, so this is done under a lock. The shared code only
+    uses the FASTA index (and reads whole contigs one at a time), so the whole assembly is only
+    loaded into memory if a module asks for seqs or contigs.
+
+    The context also works as a path (e.g. with open, os.path and subprocess), so modules and
+    functions which expect the assembly's path can be given the context instead.
+    """
+
+    def __init__(self, path, minimap2_index=None, seqs=None, fasta_index=None):
+        self.path = pathlib.Path(path)
+        self.minimap2_index = minimap2_index
+        self.cache = {}
+        self._seqs, self._contigs, self._sha256 = seqs, None, None
+        self._fasta_index = fasta_index
+        self._lock = threading.Lock()
+
+    def __fspath__(self):
+        return str(self.path)
+
+    def __str__(self):
+        return str(self.path)
+
+    def __repr__(self):
+        return f'AssemblyContext({str(self.path)!r})'
+
+    @property
+    def fasta_index(self):
+        with self._lock:
+            if self._fasta_index is None:
+                self._fasta_index = FastaIndex(self.path)
+        return self._fasta_index
+
+    @property
+    def seqs(self):
+        with self._lock:
+            if self._seqs is None:
+                self._seqs = load_fasta(self.path)
+        return self._seqs
+
+    @property
+    def contigs(self):
+        with self._lock:
+            if self._contigs is None:
+                if self._seqs is None:
+                    self._seqs = load_fasta(self.path)
+                self._contigs = dict(self._seqs)
+        return self._contigs
+
+    @property
+    def contig_lengths(self):
+        if self._seqs is None:
+            return dict(self.fasta_index.lengths)
+        return {name: len(seq) for name, seq in self.contigs.items()}
+
+    @property
+    def sha256(self):
+        with self._lock:
+            if self._sha256 is None:
+                sha256 = hashlib.sha256()
+                with open(self.path, 'rb') as f:
+                    for block in iter(lambda: f.read(1048576), b''):
+                        sha256.update(block)
+                self._sha256 = sha256.hexdigest()
+        return self._sha256
+
+    def close(self):
+        """
+        Closes the FASTA index's memory map (contigs can't be fetched from it after this).
+        """
+        with self._lock:
+            if self._fasta_index is not None:
+                self._fasta_index.close()
+
+
+class FastaIndex(collections.abc.Mapping):
+    """
+    A samtools faidx-style index of an uncompressed FASTA file. Each record's entry holds its
+    length, the file offset of its sequence, and the number of bases and bytes in each of its lines.
+    The file is memory-mapped, so a part of a contig is fetched by reading only the lines it covers.
+
+    The index works as a dictionary {name: IndexedContig}, where an IndexedContig has a length and
+    can be sliced (giving an uppercase str), so it can be used in place of the contig's sequence.
+
+    Building the index reads the whole file once, so the number of ambiguous (non-ACGT) bases in
+    each record is counted at the same time (ambiguous_counts). This isn't part of the .fai file,
+    so for a loaded index it is counted when first used.
+
+    If an index_path is given, the index is saved there (in .fai format) or loaded from there if it
+    already exists. Records whose lines aren't all the same length (which samtools can't index) are
+    saved with zero bases per line and the byte length of their sequence: fetching from them reads
+    their whole sequence.
+    """
+
+    def __init__(self, fasta_path, index_path=None):
+        self.fasta_path = pathlib.Path(fasta_path)
+        self.entries, self._ambiguous_counts = {}, None
+        self._file = open(self.fasta_path, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:  # empty files can't be memory-mapped
+            self._mm = b''
+        if index_path is not None and os.path.isfile(index_path):
+            self.load(index_path)
+        else:
+            self.build()
+            if index_path is not None:
+                self.save(index_path)
+
+    def __getitem__(self, name):
+        return IndexedContig(self, name, self.entries[name][0])
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def lengths(self):
+        return {name: entry[0] for name, entry in self.entries.items()}
+
+    @property
+    def ambiguous_counts(self):
+        if self._ambiguous_counts is None:
+            self._ambiguous_counts = {name: count_ambiguous_bases(self.record_bytes(name), entry[0])
+                                      for name, entry in self.entries.items()}
+        return self._ambiguous_counts
+
+    def build(self):
+        """
+        Indexes the FASTA file. Records are found the same way read_fasta finds them: names are the
+        first word of the header and records without a name are skipped.
+        """
+        mm = self._mm
+        self._ambiguous_counts = {}
+        _, start = find_header(mm, 0)
+        while start != -1:
+            header_end = mm.find(b'\n', start)
+            if header_end == -1:
+                header_end = len(mm)
+            seq_start = min(header_end + 1, len(mm))
+            seq_end, next_start = find_header(mm, seq_start)
+            header = mm[start+1:header_end].split()
+            if header:
+                name, seq_bytes = header[0].decode(), mm[seq_start:seq_end]
+                self.entries[name] = make_index_entry(seq_bytes, seq_start)
+                self._ambiguous_counts[name] = \
+                    count_ambiguous_bases(seq_bytes, self.entries[name][0])
+            start = next_start
+
+    def load(self, index_path):
+        with open(index_path, 'rt') as index_file:
+            for line in index_file:
+                name, length, offset, line_bases, line_width = line.rstrip('\n').split('\t')
+                self.entries[name] = (int(length), int(offset), int(line_bases), int(line_width))
+
+    def save(self, index_path):
+        with open(index_path, 'wt') as index_file:
+            for name, entry in self.entries.items():
+                index_file.write('\t'.join([name] + [str(x) for x in entry]) + '\n')
+
+    def record_bytes(self, name):
+        """
+        Returns the bytes of a record's sequence lines, as they are in the file.
+        """
+        length, offset, line_bases, line_width = self.entries[name]
+        if not line_bases:
+            return self._mm[offset:offset+line_width]
+        return self._mm[offset:offset + (length - 1) // line_bases * line_width +
+                        (length - 1) % line_bases + 1]
+
+    def fetch(self, name, start=0, end=None):
+        """
+        Returns the part of a contig from start to end (0-based, end exclusive) as an uppercase str.
+        """
+        length, offset, line_bases, line_width = self.entries[name]
+        start = max(start, 0)
+        end = length if end is None else min(end, length)
+        if start >= end:
+            return ''
+        if line_bases:
+            first = offset + start // line_bases * line_width + start % line_bases
+            last = offset + (end - 1) // line_bases * line_width + (end - 1) % line_bases
+            seq = self._mm[first:last+1].translate(None, b'\r\n')
+        else:
+            lines = self._mm[offset:offset+line_width].split(b'\n')
+            seq = b''.join(line.strip() for line in lines)[start:end]
+        return seq.upper().decode()
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+
+class IndexedContig(object):
+    """
+    A contig in a FastaIndex, which can be used like its sequence: len() gives its length and
+    slicing fetches that part of it from the file.
+    """
+    __slots__ = ('fasta_index', 'name', 'length')
+
+    def __init__(self, fasta_index, name, length):
+        self.fasta_index, self.name, self.length = fasta_index, name, length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(self.length)
+            seq = self.fasta_index.fetch(self.name, start, end)
+            return seq if step == 1 else seq[::step]
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError('contig index out of range')
+        return self.fasta_index.fetch(self.name, key, key + 1)
+
+    def __str__(self):
+        return self.fasta_index.fetch(self.name)
+
+    def __repr__(self):
+        return f'IndexedContig({self.name!r}, length={self.length})'
+
+
+def find_header(mm, pos):
+    """
+    Finds the first header line at or after pos (which must be the start of a line). Like
+    read_fasta, this allows whitespace before a header's '>'. Returns the start of the header's
+    line and the position of its '>', or the end of mm and -1 if there isn't a header.
+    """
+    while True:
+        i = mm.find(b'>', pos)
+        if i == -1:
+            return len(mm), -1
+        line_start = mm.rfind(b'\n', pos, i) + 1 or pos
+        if not mm[line_start:i].strip():
+            return line_start, i
+        pos = mm.find(b'\n', i) + 1
+        if pos == 0:
+            return len(mm), -1
+
+
+def make_index_entry(seq_bytes, offset):
+    """
+    Returns a record's (length, offset, line_bases, line_width) index entry from the bytes of its
+    sequence lines. If the lines aren't all the same length (apart from the last line, which can
+    be shorter, and blank lines at the end), line_bases is 0 and line_width is the length of
+    seq_bytes.
+    """
+    lines = seq_bytes.split(b'\n')
+    while lines and not lines[-1].strip():
+        lines.pop()
+    length = sum(len(line.strip()) for line in lines)
+    if not lines:
+        return length, offset, 0, len(seq_bytes)
+
+    # Lines are regular if each is its bases followed by the same line ending (\n or \r\n).
+    bases = seq_bytes.split()
+    eol = b'\r' if lines[0].endswith(b'\r') else b''
+    line_bases = len(lines[0]) - len(eol)
+    if len(bases) == len(lines) and line_bases > 0 and \
+            all(len(b) == line_bases for b in bases[:-1]) and len(bases[-1]) <= line_bases and \
+            all(line == b + eol for line, b in zip(lines, bases)):
+        return length, offset, line_bases, line_bases + len(eol) + 1
+    return length, offset, 0, len(seq_bytes)
+
+
+def count_ambiguous_bases(seq_bytes, length):
+    """
+    Returns the number of ambiguous (non-ACGT) bases in a record of the given length, from the bytes
+    of its sequence lines (which can include line endings, which aren't bases).
+    """
+    return length - len(seq_bytes) + len(seq_bytes.translate(None, b'ACGTacgt'))
+
+
+def load_assembly(assembly):
+    """
+    Returns an assembly's contigs as a list of (name, seq) tuples. The assembly can be an
+    AssemblyContext (whose sequences are reused) or a FASTA file.
+    """
+    if isinstance(assembly, AssemblyContext):
+        return assembly.seqs
+    return load_fasta(assembly)
+
+
+def iter_assembly(assembly):
+    """
+    The same as load_assembly, but yields the (name, seq) tuples one at a time, so only one contig
+    is in memory at once (unless the context has already loaded the sequences).
+    """
+    if isinstance(assembly, AssemblyContext):
+        if assembly._seqs is not None:
+            yield from assembly._seqs
+        else:
+            fasta_index = assembly.fasta_index
+            for name in fasta_index:
+                yield name, fasta_index.fetch(name)
+    else:
+        yield from read_fasta(assembly)
+
+
+def get_contig_base_counts(assembly):
+    """
+    Returns a dictionary {name: (length, number of ambiguous bases)} of an assembly's contigs. For
+    an AssemblyContext, these come from its FASTA index (where they were counted when the index was
+    built). A FASTA file is read one contig at a time.
+    """
+    if isinstance(assembly, AssemblyContext):
+        if assembly._seqs is None or assembly._fasta_index is not None:
+            fasta_index = assembly.fasta_index
+            return {name: (length, fasta_index.ambiguous_counts[name])
+                    for name, length in fasta_index.lengths.items()}
+        seqs = ((name, seq.encode()) for name, seq in assembly._seqs)
+    else:
+        seqs = ((name.decode(), seq) for name, seq in read_fasta(assembly, as_bytes=True))
+    return {name: (len(seq), len(seq.translate(None, b'ACGT'))) for name, seq in seqs}
+
+
+def load_assembly_contigs(assembly, names=None):
+    """
+    The same as load_assembly, but returns the contigs as a dictionary {name: seq}. If names are
+    given, only those contigs are included (and only those are read from a FASTA file).
+
+    For an AssemblyContext whose sequences haven't been loaded, the contigs are the IndexedContigs
+    of its FASTA index (or, if names are given, the fetched sequences), which have a length and can
+    be sliced like sequences, so only the parts which are used are read.
+    """
+    if isinstance(assembly, AssemblyContext):
+        if assembly._seqs is None:
+            fasta_index = assembly.fasta_index
+            if names is None:
+                return fasta_index
+            return {n: fasta_index.fetch(n) for n in names if n in fasta_index}
+        if names is None:
+            return assembly.contigs
+        return {n: assembly.contigs[n] for n in names if n in assembly.contigs}
+    return dict(read_fasta(assembly, names=names))
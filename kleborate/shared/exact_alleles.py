@@ -0,0 +1,221 @@
+"""
+This file contains an exact-match allele caller for MLST schemes. Most assemblies carry exact,
+known alleles for every locus of a scheme, and these can be found with an index of the alleles
+instead of aligning every allele to the assembly with minimap2.
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+import collections
+import os
+import threading
+
+from .alignment import Alignment
+from .assembly import load_assembly_contigs
+from .misc import load_fasta, reverse_complement
+
+
+# Alleles are indexed by their k-mers (of size K) at every STRIDE-th position.
+K = 24
+STRIDE = 16
+
+# Built allele indices, keyed by the allele files' paths, modification times and sizes, so each
+# scheme's index is only made once per process (and remade if its files change). Modules run in
+# threads, so indices are built under a lock.
+EXACT_ALLELE_INDICES = {}
+EXACT_ALLELE_INDICES_LOCK = threading.Lock()
+
+
+def find_exact_alleles(assembly_path, allele_paths, gene_names):
+    """
+    Looks for exact, full-length occurrences of a scheme's alleles in an assembly. Returns a
+    dictionary {gene name: list of Alignments} with the exact hits for each gene whose hits can be
+    used in place of minimap2's. Genes which aren't in the dictionary still need to be aligned.
+    """
+    key = tuple(get_file_key(allele_paths[g]) for g in gene_names)
+    with EXACT_ALLELE_INDICES_LOCK:
+        if key not in EXACT_ALLELE_INDICES:
+            EXACT_ALLELE_INDICES[key] = ExactAlleleIndex(allele_paths, gene_names)
+        index = EXACT_ALLELE_INDICES[key]
+    return index.find(load_assembly_contigs(assembly_path))
+
+
+def get_file_key(filename):
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_mtime_ns, stat.st_size
+
+
+class ExactAlleleIndex(object):
+    """
+    An index of a scheme's alleles (one FASTA file per gene) for finding exact, full-length allele
+    occurrences in an assembly.
+
+    Each allele's k-mers are indexed at every STRIDE-th position, on both strands, with the
+    allele's placement (gene, strand and offset of the k-mer in the allele). The assembly is only
+    looked up in blocks of STRIDE consecutive positions, spaced so that any exact match at least as
+    long as the scheme's shortest allele contains a whole block, and so at least one position
+    whose k-mer is indexed at the right offset. Each found k-mer gives candidate placements for
+    alleles, which are checked by looking up the assembly sequence at that placement (for each
+    allele length) in a dictionary of the allele sequences.
+    """
+
+    def __init__(self, allele_paths, gene_names):
+        self.gene_names = list(gene_names)
+        self.names, self.lengths = [], []
+        self.oriented_seqs, self.seq_names = [], []
+        self.contained = {}
+        self.anchors = collections.defaultdict(dict)
+        min_length = None
+        for g, gene_name in enumerate(self.gene_names):
+            alleles = load_fasta(allele_paths[gene_name])
+            self.names.append([name for name, _ in alleles])
+            self.lengths.append(sorted({len(seq) for _, seq in alleles}))
+            oriented_seqs = {'+': [seq for _, seq in alleles],
+                             '-': [reverse_complement(seq) for _, seq in alleles]}
+            self.oriented_seqs.append(oriented_seqs)
+            seq_names = {'+': collections.defaultdict(list), '-': collections.defaultdict(list)}
+            for strand, seqs in oriented_seqs.items():
+                for i, seq in enumerate(seqs):
+                    if set(seq) <= set('ACGT'):  # minimap2 never counts ambiguous bases as matches
+                        seq_names[strand][seq].append(i)
+                    for offset in range(0, len(seq) - K + 1, STRIDE):
+                        placements = self.anchors[seq[offset:offset+K]]
+                        placements.setdefault((g, strand, offset), []).append(i)
+            self.seq_names.append(seq_names)
+            if alleles:
+                shortest = self.lengths[-1][0]
+                min_length = shortest if min_length is None else min(min_length, shortest)
+
+        # Any K+STRIDE+spacing-2 consecutive positions contain a whole block.
+        self.spacing = 0 if min_length is None else min_length - K - STRIDE + 2
+
+    def find(self, contigs):
+        """
+        Takes the assembly's contigs as a dictionary {name: seq}, and returns the exact hits for
+        each gene where they can be used (see find_exact_alleles). The seqs can be IndexedContigs,
+        in which case each contig's whole sequence is only fetched while it is scanned.
+        """
+        if self.spacing < 1:
+            return {}
+        anchors = [[] for _ in self.gene_names]
+        for contig_name, contig in contigs.items():
+            seq = str(contig)
+            last_pos = len(seq) - K
+            for block_start in range(0, last_pos + 1, self.spacing):
+                for pos in range(block_start, min(block_start + STRIDE, last_pos + 1)):
+                    placements = self.anchors.get(seq[pos:pos+K])
+                    if placements is None:
+                        continue
+                    for (g, strand, offset), allele_indices in placements.items():
+                        anchors[g].append((contig_name, pos, strand, offset, allele_indices))
+
+        exact_hits = {}
+        for g, gene_name in enumerate(self.gene_names):
+            if anchors[g]:
+                hits = self.find_gene(g, anchors[g], contigs)
+                if hits is not None:
+                    exact_hits[gene_name] = hits
+        return exact_hits
+
+    def find_gene(self, g, anchors, contigs):
+        """
+        Returns the exact hits for one gene, or None if the gene has no exact hits or if minimap2
+        could also make a 100%-identity alignment (of part of an allele) that scores at least as
+        well as the best exact hit. In that case, the gene must be aligned to get the same hits as
+        minimap2.
+        """
+        found = set()
+        for contig_name, pos, strand, offset, _ in anchors:
+            start = pos - offset
+            if start < 0:
+                continue
+            contig = contigs[contig_name]
+            for length in self.lengths[g]:
+                if start + length > len(contig):
+                    break
+                for i in self.seq_names[g][strand].get(contig[start:start+length], []):
+                    found.add((contig_name, start, strand, i))
+        if not found:
+            return None
+
+        # Alignments are ranked by identity and then score, so the exact hits only compete with
+        # other 100%-identity alignments, which are exact matches to part of an allele. An exact
+        # match at least as long as the best exact hit either contains an indexed k-mer at a
+        # placement other than the best hits (and is found by extending the k-mer match) or it is
+        # in the same place as a best hit, i.e. the best hit's allele is in a longer allele.
+        best_length = max(len(self.oriented_seqs[g]['+'][i]) for _, _, _, i in found)
+        best_hits = {(c, start, strand, i) for c, start, strand, i in found
+                     if len(self.oriented_seqs[g]['+'][i]) == best_length}
+        if any(self.is_contained(g, i) for _, _, _, i in best_hits):
+            return None
+        best_placements = {(c, start, strand) for c, start, strand, _ in best_hits}
+        for contig_name, pos, strand, offset, allele_indices in anchors:
+            if (contig_name, pos - offset, strand) in best_placements:
+                continue
+            contig = contigs[contig_name]
+            for i in allele_indices:
+                allele = self.oriented_seqs[g][strand][i]
+                match_length = exact_match_length(allele, offset, contig, pos)
+                if best_length <= match_length < len(allele):
+                    return None
+
+        return [self.make_alignment(g, i, contig_name, contigs[contig_name], start, strand)
+                for contig_name, start, strand, i in sorted(found)]
+
+    def is_contained(self, g, i):
+        """
+        Returns whether allele i of gene g is part of a longer allele of the same gene.
+        """
+        if (g, i) not in self.contained:
+            seq = self.oriented_seqs[g]['+'][i]
+            self.contained[(g, i)] = any(len(other) > len(seq) and seq in other
+                                         for other in self.oriented_seqs[g]['+'])
+        return self.contained[(g, i)]
+
+    def make_alignment(self, g, i, contig_name, contig, start, strand):
+        """
+        Makes an Alignment for an exact hit, the same as minimap2's PAF line would give.
+        """
+        name, seq = self.names[g][i], self.oriented_seqs[g]['+'][i]
+        length = len(seq)
+        paf_line = f'{name}\t{length}\t0\t{length}\t{strand}\t' \
+                   f'{contig_name}\t{len(contig)}\t{start}\t{start + length}\t' \
+                   f'{length}\t{length}\t60\tAS:i:{2 * length}\tcg:Z:{length}='
+        return Alignment(paf_line, query_seqs={name: seq}, ref_seqs={contig_name: contig})
+
+
+def exact_match_length(allele, offset, contig, pos):
+    """
+    Given a k-mer which is at the offset in the allele and at pos in the contig, returns the length
+    of the exact match between the allele and contig which contains it.
+    """
+    right = longest_match(lambda n: allele[offset+K:offset+K+n] == contig[pos+K:pos+K+n],
+                          min(len(allele) - offset - K, len(contig) - pos - K))
+    left = longest_match(lambda n: allele[offset-n:offset] == contig[pos-n:pos],
+                         min(offset, pos))
+    return left + K + right
+
+
+def longest_match(matches, max_length):
+    """
+    Returns the largest n (0 to max_length) for which matches(n) is true, where matches is true for
+    every n up to some value and false after it.
+    """
+    low, high = 0, max_length
+    while low < high:
+        middle = (low + high + 1) // 2
+        if matches(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
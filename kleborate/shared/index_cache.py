@@ -0,0 +1,171 @@
+"""
+This file contains the minimap2 index cache (--index_cache). Without it, each assembly's minimap2
+index is built in a temporary directory and thrown away, so re-running Kleborate on the same
+assemblies (e.g. with a different preset or extra modules) builds every index again. With it,
+indices are kept in a directory, named by the assembly's contents and the minimap2 version, and
+reused by later runs. Files made from Kleborate's own databases (e.g. compiled ST profile tables)
+are kept in a subdirectory of it, or of the user's cache directory without an index cache.
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import pathlib
+import shutil
+import subprocess
+import time
+import uuid
+
+
+# The installed minimap2's version, so it's only looked up once per process.
+MINIMAP2_VERSION = None
+
+# Where files made from Kleborate's databases are kept between runs (see set_database_cache), or
+# None for the user's cache directory. Each process has its own value: the runner sets it once in
+# the main process (serial runs) or in each worker process (--jobs).
+DATABASE_CACHE_DIR = None
+
+# Temporary files older than this (in seconds) were left by a run which didn't finish, so they are
+# removed along with evicted indices.
+STALE_TEMP_FILE_AGE = 24 * 60 * 60
+
+
+class IndexCache(object):
+    """
+    A directory of minimap2 indices. Each index is named by the SHA-256 of the (unzipped) assembly
+    it was built from and the version of minimap2 which built it, so an index is only reused for
+    the same sequences and the same minimap2.
+
+    Several worker processes (or Kleborate runs) can share the directory:
+    * Indices are written to a temporary file in the directory and then renamed, so an index is
+      never seen partly written.
+    * Indices are hard-linked (or copied, if that isn't possible) out of the cache before they are
+      used, so evicting an index doesn't affect a worker which is using it.
+
+    Using an index updates its modification time, and after an index is added, the least recently
+    used indices are deleted until the directory's indices total no more than max_size bytes.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+
+    def index_path(self, sha256):
+        return self.directory / f'{sha256}_minimap2-{get_minimap2_version()}.mmi'
+
+    def get(self, sha256, dest):
+        """
+        If there is a cached index for the assembly, puts it at dest and returns True. Otherwise
+        returns False.
+        """
+        index_path = self.index_path(sha256)
+        try:
+            link_or_copy(index_path, dest)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(index_path)
+        except FileNotFoundError:  # evicted since it was linked
+            pass
+        return True
+
+    def put(self, sha256, index):
+        """
+        Adds the index (built for the assembly) to the cache and evicts old indices if needed.
+        """
+        temp_path = self.directory / f'.{uuid.uuid4().hex}.mmi.tmp'
+        index_path = self.index_path(sha256)
+        try:
+            link_or_copy(index, temp_path)
+            os.replace(temp_path, index_path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        self.evict(keep=index_path)
+
+    def evict(self, keep=None):
+        """
+        Deletes the least recently used indices (but not keep) until the cached indices total no
+        more than max_size bytes. Stale temporary files are also deleted.
+        """
+        indices, now = [], time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith('.mmi') and entry.is_file():
+                    indices.append((stat.st_mtime, stat.st_size, entry.path))
+                elif entry.name.endswith('.mmi.tmp') and now - stat.st_mtime > STALE_TEMP_FILE_AGE:
+                    os.remove(entry.path)
+            except FileNotFoundError:  # removed by another worker
+                pass
+        total_size = sum(size for _, size, _ in indices)
+        for _, size, path in sorted(indices):
+            if total_size <= self.max_size:
+                break
+            if keep is not None and os.path.basename(path) == keep.name:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def set_database_cache(index_cache_dir):
+    """
+    Sets the directory for files made from Kleborate's databases: the databases subdirectory of
+    the --index_cache directory or, without an index cache (None), of the user's cache directory
+    (see get_user_cache_dir). Nothing is ever written into Kleborate's own data directories.
+    """
+    global DATABASE_CACHE_DIR
+    if index_cache_dir is None:
+        DATABASE_CACHE_DIR = None
+    else:
+        DATABASE_CACHE_DIR = pathlib.Path(index_cache_dir) / 'databases'
+
+
+def get_database_cache_dir():
+    if DATABASE_CACHE_DIR is None:
+        return get_user_cache_dir() / 'databases'
+    return DATABASE_CACHE_DIR
+
+
+def get_user_cache_dir():
+    """
+    Returns Kleborate's directory in the user's cache directory: $XDG_CACHE_HOME/kleborate, or
+    ~/.cache/kleborate if XDG_CACHE_HOME isn't set.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                  '.cache')
+    return pathlib.Path(cache_home) / 'kleborate'
+
+
+def link_or_copy(source, dest):
+    """
+    Hard-links source to dest (which must not exist), or copies it if it can't be linked (e.g.
+    it's on a different file system).
+    """
+    try:
+        os.link(source, dest)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+def get_minimap2_version():
+    global MINIMAP2_VERSION
+    if MINIMAP2_VERSION is None:
+        p = subprocess.run(['minimap2', '--version'], capture_output=True, text=True)
+        MINIMAP2_VERSION = p.stdout.strip() or 'unknown'
+    return MINIMAP2_VERSION
@@ -15,29 +15,69 @@ not, see <https://www.gnu.org/licenses/>.
 import gzip
 import sys
 
+from .seq_ops import reverse_complement  # modules import it from here
+
 
 def load_fasta(filename):
     """
     Returns the names and sequences for the given fasta file as a list of tuples (name, seq).
     """
-    fasta_seqs = []
-    with get_open_func(filename)(filename, 'rt') as fasta_file:
-        name = ''
-        sequence = ''
-        for line in fasta_file:
+    return list(read_fasta(filename))
+
+
+def read_fasta(filename, as_bytes=False, names=None):
+    """
+    Reads a FASTA file (optionally gzipped), yielding one (name, seq) tuple per record, so records
+    can be used as they are read instead of loading the whole file. Names are the first word of
+    the header line and sequences are uppercase.
+    * as_bytes: if true, names and sequences are bytes instead of str
+    * names: if given, only records with one of these names are returned (the other records'
+             sequences are skipped, not built)
+
+    The file is read in binary, in large blocks, and each record's lines are joined once, when the
+    record ends.
+    """
+    if names is not None:
+        names = {n if isinstance(n, bytes) else n.encode() for n in names}
+    with get_open_func(filename)(filename, 'rb') as fasta_file:
+        name, lines, wanted = b'', [], False
+        for line in read_lines(fasta_file):
             line = line.strip()
-            if not line:
-                continue
-            if line[0] == '>':  # Header line = start of new contig
-                if name:
-                    fasta_seqs.append((name.split()[0], sequence.upper()))
-                    sequence = ''
-                name = line[1:]
-            else:
-                sequence += line
-        if name:
-            fasta_seqs.append((name.split()[0], sequence.upper()))
-    return fasta_seqs
+            if line.startswith(b'>'):  # Header line = start of new contig
+                if wanted:
+                    yield make_fasta_record(name, lines, as_bytes)
+                header = line[1:].split()
+                name, lines = (header[0] if header else b''), []
+                wanted = bool(name) and (names is None or name in names)
+            elif wanted:
+                lines.append(line)
+        if wanted:
+            yield make_fasta_record(name, lines, as_bytes)
+
+
+def read_lines(binary_file, block_size=1048576):
+    """
+    Yields the lines (without line endings) of a binary file. The file is read in large blocks
+    which are split into lines all at once, which is much faster than reading it line by line
+    (especially for gzipped files).
+    """
+    remainder = b''
+    while True:
+        block = binary_file.read(block_size)
+        if not block:
+            break
+        lines = (remainder + block).split(b'\n')
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def make_fasta_record(name, lines, as_bytes):
+    seq = b''.join(lines).upper()
+    if as_bytes:
+        return name, seq
+    return name.decode(), seq.decode()
 
 
 def get_compression_type(filename):
@@ -68,21 +108,3 @@ def get_open_func(filename):
         return gzip.open
     else:  # plain text
         return open
-
-
-REV_COMP_DICT = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G', 'a': 't', 't': 'a', 'g': 'c', 'c': 'g',
-                 'R': 'Y', 'Y': 'R', 'S': 'S', 'W': 'W', 'K': 'M', 'M': 'K', 'B': 'V', 'V': 'B',
-                 'D': 'H', 'H': 'D', 'N': 'N', 'r': 'y', 'y': 'r', 's': 's', 'w': 'w', 'k': 'm',
-                 'm': 'k', 'b': 'v', 'v': 'b', 'd': 'h', 'h': 'd', 'n': 'n', '.': '.', '-': '-',
-                 '?': '?'}
-
-
-def complement_base(base):
-    try:
-        return REV_COMP_DICT[base]
-    except KeyError:
-        return 'N'
-
-
-def reverse_complement(seq):
-    return ''.join([complement_base(x) for x in seq][::-1])
\ No newline at end of file
@@ -15,9 +15,18 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
+import hashlib
+import json
+import os
 import re
+import tempfile
+import threading
 
-from .alignment import align_query_to_ref, truncation_check
+import numpy as np
+
+from .alignment import align_queries_to_ref, truncation_check
+from .exact_alleles import find_exact_alleles
+from .index_cache import get_database_cache_dir
 
 
 def mlst(assembly_path, minimap2_index, profiles_path, allele_paths, gene_names, extra_info,
@@ -35,19 +44,36 @@ def mlst(assembly_path, minimap2_index, profiles_path, allele_paths, gene_names,
     * required_exact_matches: at least this many alleles must be an exact match to assign an ST
     * check_for_truncation: if true, truncation strings will be added to the allele numbers
 
+    Genes with exact, full-length allele hits are called from those (see exact_alleles.py), and
+    only the other genes are aligned (together, in one minimap2 call).
+
     This function returns:
     * the best matching ST profile (e.g. 'ST123', 'ST456-1LV' or 'NA')
     * the extra-info value for the best ST (if used, otherwise an empty string)
     * a dictionary of allele numbers in str format {gene name: allele number}
     """
     profiles = load_st_profiles(profiles_path, gene_names, extra_info)
-    hits_per_gene = {g: align_query_to_ref(allele_paths[g], assembly_path,
-                                           ref_index=minimap2_index, min_identity=min_identity,
-                                           min_query_coverage=min_coverage) for g in gene_names}
+    hits_per_gene = find_exact_alleles(assembly_path, allele_paths, gene_names)
+    unfound = [g for g in gene_names if g not in hits_per_gene]
+    hits_per_gene.update(align_alleles(assembly_path, minimap2_index, allele_paths, unfound,
+                                       min_identity, min_coverage))
     return run_single_mlst(profiles, hits_per_gene, gene_names, required_exact_matches,
                            check_for_truncation)
 
 
+def align_alleles(assembly_path, minimap2_index, allele_paths, gene_names, min_identity,
+                  min_coverage):
+    """
+    Aligns the alleles of the given genes to the assembly with a single alignment of their combined
+    allele file (see align_queries_to_ref), and returns the hits split up by gene: a dictionary
+    {gene name: list of hits}.
+    """
+    alignments = align_queries_to_ref([allele_paths[g] for g in gene_names], assembly_path,
+                                      ref_index=minimap2_index, min_identity=min_identity,
+                                      min_query_coverage=min_coverage)
+    return {g: alignments[allele_paths[g]] for g in gene_names}
+
+
 def run_single_mlst(profiles, hits_per_gene, gene_names, required_exact_matches,
                     check_for_truncation=False, report_incomplete=False):
     """
@@ -97,6 +123,12 @@ def run_single_mlst(profiles, hits_per_gene, gene_names, required_exact_matches,
     return st, extra_info, allele_numbers
 
 
+# Loaded ST profiles (see load_st_profiles), so each profiles file is only read once per process
+# (even when several modules ask for it at once).
+ST_PROFILES = {}
+ST_PROFILES_LOCK = threading.Lock()
+
+
 def load_st_profiles(database_path, gene_names, extra_info_name):
     """
     This function reads through a tab-delimited MLST database file where the first column is the ST
@@ -107,7 +139,21 @@ def load_st_profiles(database_path, gene_names, extra_info_name):
 
     This function returns a list of ST profiles, where each value is a tuple:
     (ST number, list of allele numbers, extra info)
+
+    The list is an StProfiles object (backed by a compiled table, see load_compiled_st_profiles)
+    which is shared between calls for the same file, so it must not be modified.
     """
+    stat = os.stat(database_path)
+    key = (os.path.abspath(database_path), stat.st_mtime_ns, stat.st_size,
+           tuple(gene_names), extra_info_name)
+    with ST_PROFILES_LOCK:
+        if key not in ST_PROFILES:
+            ST_PROFILES[key] = load_compiled_st_profiles(database_path, gene_names,
+                                                         extra_info_name)
+        return ST_PROFILES[key]
+
+
+def read_st_profiles(database_path, gene_names, extra_info_name):
     profiles, first_line = [], True
     with open(database_path, 'r') as f:
         for line in f:
@@ -131,6 +177,143 @@ def load_st_profiles(database_path, gene_names, extra_info_name):
     return profiles
 
 
+def load_compiled_st_profiles(database_path, gene_names, extra_info_name):
+    """
+    Loads ST profiles from a compiled table, which is made from the TSV the first time and saved in
+    the database cache directory (see get_database_cache_dir). The table is named by the TSV's path
+    and columns, and it records the TSV's size and modification time, so it is remade when the TSV
+    changes without the TSV being read to check. The saved table is two files:
+    * <name>.npy: an int32 array with one row per profile: the ST followed by the alleles. This is
+      memory-mapped, not read, so processes using the same table share its memory.
+    * <name>.json: the TSV's path, size and modification time, the columns and the extra-info
+      values.
+    If the table can't be saved (e.g. the cache directory isn't writable), the profiles are read
+    from the TSV.
+    """
+    columns = list(gene_names) + ([] if extra_info_name is None else [extra_info_name])
+    stat = os.stat(database_path)
+    source = {'path': os.path.abspath(database_path), 'size': stat.st_size,
+              'mtime_ns': stat.st_mtime_ns}
+    name = hashlib.sha256(json.dumps([source['path'], columns]).encode()).hexdigest()
+    prefix = os.path.join(get_database_cache_dir(), 'st_profiles', name)
+    profiles = read_compiled_table(prefix, source, columns)
+    if profiles is not None:
+        return profiles
+
+    profiles = read_st_profiles(database_path, list(gene_names), extra_info_name)
+    table = np.array([[st] + alleles for st, alleles, _ in profiles], dtype=np.int32)
+    table = table.reshape(len(profiles), len(gene_names) + 1)
+    extra_info = None if extra_info_name is None else [e for _, _, e in profiles]
+    if write_compiled_table(prefix, table, source, columns, extra_info):
+        compiled = read_compiled_table(prefix, source, columns)
+        if compiled is not None:
+            return compiled
+    return StProfiles(table[:, 0], table[:, 1:], extra_info)
+
+
+def read_compiled_table(prefix, source, columns):
+    """
+    Returns the StProfiles from a compiled table, or None if there isn't a valid table for the
+    given TSV (path, size and modification time) and columns.
+    """
+    try:
+        with open(f'{prefix}.json', 'rt') as f:
+            info = json.load(f)
+        if info['source'] != source or info['columns'] != columns:
+            return None
+        table = np.load(f'{prefix}.npy', mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    if table.dtype != np.int32 or table.shape != (info['rows'], info['gene_count'] + 1):
+        return None
+    return StProfiles(table[:, 0], table[:, 1:], info['extra_info'])
+
+
+def write_compiled_table(prefix, table, source, columns, extra_info):
+    """
+    Writes a compiled table, returning whether it worked. Each file is written to a temporary file
+    and then moved into place, so other processes never see a partly written table.
+    """
+    info = {'source': source, 'columns': columns, 'rows': table.shape[0],
+            'gene_count': table.shape[1] - 1, 'extra_info': extra_info}
+    directory = os.path.dirname(prefix)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.npy', delete=False) as f:
+            np.save(f, table)
+        os.replace(f.name, f'{prefix}.npy')
+        with tempfile.NamedTemporaryFile('wt', dir=directory, suffix='.json', delete=False) as f:
+            json.dump(info, f)
+        os.replace(f.name, f'{prefix}.json')
+    except OSError:
+        return False
+    return True
+
+
+class StProfiles(object):
+    """
+    A table of ST profiles which behaves like a list of (ST number, list of allele numbers, extra
+    info) tuples, but holds the STs and alleles in NumPy arrays (sts: one value per profile,
+    alleles: one row per profile and one column per gene) and the extra info in a list (or None if
+    the scheme has no extra-info column).
+
+    It also has an inverted index of the alleles for get_best_matching_profile: each column of
+    allele numbers sorted (with the profile order kept for equal numbers), so the profiles with a
+    given allele can be found with a binary search. The index is built on first use.
+    """
+
+    def __init__(self, sts, alleles, extra_info=None):
+        self.sts, self.alleles, self.extra_info = sts, alleles, extra_info
+        self._allele_index = None
+
+    @classmethod
+    def from_list(cls, profiles):
+        sts = np.array([st for st, _, _ in profiles], dtype=np.int64)
+        alleles = np.array([a for _, a, _ in profiles], dtype=np.int64).reshape(len(profiles), -1)
+        return cls(sts, alleles, [e for _, _, e in profiles])
+
+    def __len__(self):
+        return len(self.sts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('profile index out of range')
+        return (int(self.sts[i]), self.alleles[i].tolist(),
+                None if self.extra_info is None else self.extra_info[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __eq__(self, other):
+        if isinstance(other, (StProfiles, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'StProfiles({list(self)!r})'
+
+    def profiles_with_allele(self, gene_index, allele):
+        """
+        Returns the indices (in profile order) of the profiles which have the given allele number
+        for the given gene (by position in the scheme).
+        """
+        if self._allele_index is None:
+            order = np.argsort(self.alleles, axis=0, kind='stable')
+            self._allele_index = (order, np.take_along_axis(self.alleles, order, axis=0))
+        order, sorted_alleles = self._allele_index
+        limits = np.iinfo(sorted_alleles.dtype)
+        if not limits.min <= allele < limits.max:
+            return order[:0, gene_index]
+        start, end = np.searchsorted(sorted_alleles[:, gene_index], [allele, allele + 1])
+        return order[start:end, gene_index]
+
+
 def get_best_hits(hits):
     """
     Given a bunch of hits to an allele, this function returns a list of the best hits. 'Best' is
@@ -171,17 +354,24 @@ def get_best_matching_profile(profiles, gene_names, best_hits_per_gene):
     any ST can be 0 to the number of genes in the scheme. STs earlier in the profiles are
     preferred, so if an assembly matches multiple STs equally well, this function will return
     whichever is first in the profiles.
+
+    Rather than scoring every profile gene by gene, each hit allele votes for the profiles which
+    contain it (using the profiles' allele index).
     """
-    best_st, best_extra_info, best_matches = 0, '', 0
-    best_alleles = [0] * len(gene_names)
-    for st, alleles, extra_info in profiles:
-        matches = 0
-        for gene_name, allele in zip(gene_names, alleles):
-            if any(allele == number_from_hit(h) for h in best_hits_per_gene[gene_name]):
-                matches += 1
-        if matches > best_matches:
-            best_st, best_alleles, best_extra_info, best_matches = st, alleles, extra_info, matches
-    return best_st, best_alleles, best_extra_info
+    if not isinstance(profiles, StProfiles):
+        profiles = StProfiles.from_list(profiles)
+    if len(profiles) == 0:
+        return 0, [0] * len(gene_names), ''
+
+    votes = np.zeros(len(profiles), dtype=np.int32)
+    for gene_index, gene_name in enumerate(gene_names[:profiles.alleles.shape[1]]):
+        for allele in {number_from_hit(h) for h in best_hits_per_gene[gene_name]}:
+            votes[profiles.profiles_with_allele(gene_index, allele)] += 1
+
+    best = int(np.argmax(votes))  # the first of the profiles with the most votes
+    if votes[best] == 0:
+        return 0, [0] * len(gene_names), ''
+    return profiles[best]
 
 
 def get_best_hit_per_gene(gene_names, best_hits_per_gene, alleles):
@@ -16,8 +16,7 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
-from .alignment import align_query_to_ref
-from .mlst import load_st_profiles, run_single_mlst
+from .mlst import align_alleles, load_st_profiles, run_single_mlst
 from .alignment import truncation_check
 
 def multi_mlst(assembly_path, minimap2_index, profiles_path, allele_paths, gene_names, extra_info,
@@ -31,16 +30,14 @@ def multi_mlst(assembly_path, minimap2_index, profiles_path, allele_paths, gene_
     profiles = load_st_profiles(profiles_path, gene_names, extra_info)
     
     if min_spurious_coverage is not None:
-        hits_per_gene = {g: align_query_to_ref(allele_paths[g], assembly_path,
-                                               ref_index=minimap2_index, min_identity=min_spurious_identity,
-                                               min_query_coverage=min_spurious_coverage) for g in gene_names}
+        hits_per_gene = align_alleles(assembly_path, minimap2_index, allele_paths, gene_names,
+                                      min_spurious_identity, min_spurious_coverage)
 
         spurious_hits = {g: [h for h in hits_per_gene[g] 
                      if h.query_cov < min_coverage and h.percent_identity < min_identity] for g in gene_names}
     else:
-        hits_per_gene = {g: align_query_to_ref(allele_paths[g], assembly_path,
-                                               ref_index=minimap2_index, min_identity=min_identity,
-                                               min_query_coverage=min_coverage) for g in gene_names}
+        hits_per_gene = align_alleles(assembly_path, minimap2_index, allele_paths, gene_names,
+                                      min_identity, min_coverage)
         spurious_hits = None
 
 
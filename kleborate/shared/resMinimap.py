@@ -21,7 +21,7 @@ from Bio.Align import substitution_matrices
 from Bio import SeqIO
 from Bio.Data.CodonTable import TranslationError
  
-from .alignment import align_query_to_ref, cull_redundant_hits, is_exact_aa_match, translate_nucl_to_prot, check_for_exact_aa_match, truncation_check
+from .alignment import align_query_to_ref, align_queries_to_ref, cull_redundant_hits, is_exact_aa_match, translate_nucl_to_prot, check_for_exact_aa_match, truncation_check
 from .misc import load_fasta, reverse_complement
 from kleborate.modules.klebsiella_pneumo_complex__amr.shv_mutations import*
 from kleborate.modules.klebsiella_pneumo_complex__amr.qrdr_mutations import*
@@ -32,14 +32,20 @@ from kleborate.modules.klebsiella_pneumo_complex__amr.col_mutations import*
 def resminimap_assembly(assembly, minimap2_index, ref_file, gene_info, qrdr, trunc, omp,  min_coverage, min_identity,
                           min_spurious_coverage, min_spurious_identity):
     hits_dict = minimap_against_all(assembly, minimap2_index, ref_file, gene_info, min_coverage, min_identity, min_spurious_coverage, min_spurious_identity)
-    
+
+    # The QRDR, MgrB/PmrB and OmpK genes are aligned together (against the assembly's prebuilt
+    # index, if there is one) and each check gets the unfiltered hits for its genes.
+    target_hits = align_queries_to_ref([f for f in (qrdr, trunc, omp) if f], assembly,
+                                       ref_index=minimap2_index)
     if qrdr:
-        check_for_qrdr_mutations(hits_dict, assembly, qrdr, min_identity, 90.0)
-        
+        check_for_qrdr_mutations(hits_dict, assembly, qrdr, min_identity, 90.0,
+                                 alignment_hits=target_hits[qrdr])
     if trunc:
-        check_for_mgrb_pmrb_gene_truncations(hits_dict, assembly, trunc, min_identity)
+        check_for_mgrb_pmrb_gene_truncations(hits_dict, assembly, trunc, min_identity,
+                                             alignment_hits=target_hits[trunc])
     if omp:
-        check_omp_genes(hits_dict, assembly, omp, min_identity, 90.0)
+        check_omp_genes(hits_dict, assembly, omp, min_identity, 90.0,
+                        alignment_hits=target_hits[omp])
     return hits_dict
 
 
@@ -145,7 +151,7 @@ def minimap_against_all(assembly, minimap2_index, ref_file, gene_info, min_cover
             
 
             hit_bla_class, shv_muts, class_changing_muts, omega_loop_seq = \
-                    check_for_shv_mutations(hit, hit_allele, hit_bla_class, exact_match)
+                    check_for_shv_mutations(hit, hit_allele, hit_bla_class, exact_match, ref_file)
             
             # checks if the variable hit_class contains the string value 'Bla'
             # If it does, then the value of hit_class is replaced with the value of hit_bla_class.
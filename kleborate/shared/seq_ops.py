@@ -0,0 +1,146 @@
+"""
+This file contains table-driven sequence operations (reverse complement and translation) which
+give the same results as Biopython's but without making a Seq object and looking up each base or
+codon in a Python function. Kleborate translates and reverse complements a lot of hits, so these
+are used in place of Biopython throughout.
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from Bio.Data import CodonTable
+from Bio.Data.CodonTable import TranslationError
+from Bio.Seq import Seq
+
+
+REV_COMP_DICT = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G', 'a': 't', 't': 'a', 'g': 'c', 'c': 'g',
+                 'R': 'Y', 'Y': 'R', 'S': 'S', 'W': 'W', 'K': 'M', 'M': 'K', 'B': 'V', 'V': 'B',
+                 'D': 'H', 'H': 'D', 'N': 'N', 'r': 'y', 'y': 'r', 's': 's', 'w': 'w', 'k': 'm',
+                 'm': 'k', 'b': 'v', 'v': 'b', 'd': 'h', 'h': 'd', 'n': 'n', '.': '.', '-': '-',
+                 '?': '?'}
+
+# Complement tables for bytes.translate and str.translate: bases not in REV_COMP_DICT become N.
+COMPLEMENT_TABLE = bytes(ord(REV_COMP_DICT.get(chr(i), 'N')) for i in range(256))
+
+
+class ComplementDict(dict):
+    def __missing__(self, key):
+        return 'N'
+
+
+COMPLEMENT_DICT = ComplementDict({ord(b): c for b, c in REV_COMP_DICT.items()})
+
+
+# Kleborate always translates with the bacterial codon table (NCBI table 11). Unambiguous codons
+# are translated with a lookup table, and anything else (ambiguous bases, gaps, etc.) is
+# translated by Biopython, one codon at a time, and remembered in AMBIGUOUS_CODONS.
+BACTERIAL_TABLE = CodonTable.unambiguous_dna_by_id[11]
+AMBIGUOUS_BACTERIAL_TABLE = CodonTable.ambiguous_generic_by_id[11]
+CODON_TABLE = dict(BACTERIAL_TABLE.forward_table)
+CODON_TABLE.update({codon: '*' for codon in BACTERIAL_TABLE.stop_codons})
+START_CODONS = set(AMBIGUOUS_BACTERIAL_TABLE.start_codons)
+STOP_CODONS = set(AMBIGUOUS_BACTERIAL_TABLE.stop_codons)
+AMBIGUOUS_CODONS = {}
+
+# Sequences at least NUMPY_MIN_LENGTH long are translated with NumPy, where codons are numbered
+# 16*a + 4*b + c (a, b and c being the codes of their bases in BASE_CODES) and looked up in
+# CODON_CODES.
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for i, b in enumerate(b'ACGT'):
+    BASE_CODES[b] = i
+CODON_CODES = np.array([ord(CODON_TABLE[a + b + c])
+                        for a in 'ACGT' for b in 'ACGT' for c in 'ACGT'], dtype=np.uint8)
+NUMPY_MIN_LENGTH = 150
+
+
+def reverse_complement(seq):
+    """
+    Returns the reverse complement of a sequence (str or bytes). Bases are complemented with
+    REV_COMP_DICT (keeping their case), and anything else becomes N.
+    """
+    if isinstance(seq, bytes):
+        return seq.translate(COMPLEMENT_TABLE)[::-1]
+    if seq.isascii():
+        return seq.encode().translate(COMPLEMENT_TABLE)[::-1].decode()
+    return seq.translate(COMPLEMENT_DICT)[::-1]
+
+
+def translate(nucl_seq, to_stop=False, cds=False):
+    """
+    Translates a nucleotide sequence using the bacterial codon table, giving the same result as
+    str(Seq(nucl_seq).translate(table='Bacterial', to_stop=to_stop, cds=cds)):
+    * to_stop: translation ends at the first in-frame stop codon (which isn't included)
+    * cds: the sequence must be a complete coding sequence (a start codon, which is translated as
+           M, then whole codons ending with the only in-frame stop codon, which isn't included),
+           otherwise a TranslationError is raised
+    A partial codon at the end of the sequence is ignored.
+    """
+    nucl_seq = nucl_seq.upper()
+    length = len(nucl_seq)
+    if cds:
+        if nucl_seq[:3] not in START_CODONS:
+            raise TranslationError(f"First codon '{nucl_seq[:3]}' is not a start codon")
+        if length % 3 != 0:
+            raise TranslationError(f'Sequence length {length} is not a multiple of three')
+        if nucl_seq[-3:] not in STOP_CODONS:
+            raise TranslationError(f"Final codon '{nucl_seq[-3:]}' is not a stop codon")
+        nucl_seq = nucl_seq[3:-3]
+    if nucl_seq.isascii() and not nucl_seq.encode().translate(None, b'ACGT'):
+        protein = translate_unambiguous(nucl_seq)
+    else:
+        protein = translate_ambiguous(nucl_seq, to_stop or cds)
+    if '*' in protein:
+        stop = protein.index('*')
+        if cds:
+            codon = nucl_seq[3 * stop:3 * stop + 3]
+            raise TranslationError(f"Extra in frame stop codon '{codon}' found.")
+        if to_stop:
+            protein = protein[:stop]
+    return 'M' + protein if cds else protein
+
+
+def translate_unambiguous(nucl_seq):
+    """
+    Translates a sequence of A, C, G and T (stop codons are translated as *). Most genes are long
+    enough for NumPy to be faster, but short sequences are translated codon by codon.
+    """
+    length = len(nucl_seq) // 3 * 3
+    if length < NUMPY_MIN_LENGTH:
+        return ''.join([CODON_TABLE[nucl_seq[i:i+3]] for i in range(0, length, 3)])
+    codes = BASE_CODES[np.frombuffer(nucl_seq[:length].encode(), dtype=np.uint8)].reshape(-1, 3)
+    codon_codes = (codes[:, 0] << 4) | (codes[:, 1] << 2) | codes[:, 2]
+    return CODON_CODES[codon_codes].tobytes().decode()
+
+
+def translate_ambiguous(nucl_seq, stop_at_stop):
+    """
+    Translates a sequence codon by codon, using Biopython for codons which aren't in the codon
+    table. If stop_at_stop is true, translation ends after the first stop codon (*), so codons
+    after it are never translated (and can't raise an error), as in Biopython.
+    """
+    protein = []
+    for i in range(0, len(nucl_seq) // 3 * 3, 3):
+        codon = nucl_seq[i:i+3]
+        amino_acid = CODON_TABLE.get(codon)
+        if amino_acid is None:
+            amino_acid = translate_ambiguous_codon(codon)
+        protein.append(amino_acid)
+        if stop_at_stop and amino_acid == '*':
+            break
+    return ''.join(protein)
+
+
+def translate_ambiguous_codon(codon):
+    if codon not in AMBIGUOUS_CODONS:
+        AMBIGUOUS_CODONS[codon] = str(Seq(codon).translate(table=11))
+    return AMBIGUOUS_CODONS[codon]
@@ -0,0 +1,40 @@
+"""
+This file holds Kleborate's CPU budget. The runner splits the --threads budget between the
+assemblies being typed at the same time (--jobs) and sets the per-assembly share here, so that the
+external tools (minimap2, mash and Kaptive) can look it up without every module and shared function
+needing a threads argument.
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+# The number of threads each external tool call may use. Each process has its own value: the
+# runner sets it once in the main process (serial runs) or in each worker process (--jobs).
+THREADS_PER_CALL = 1
+
+
+def set_threads(threads):
+    global THREADS_PER_CALL
+    THREADS_PER_CALL = max(1, int(threads))
+
+
+def get_threads():
+    return THREADS_PER_CALL
+
+
+def split_threads(total_threads, jobs):
+    """
+    Splits a total thread budget between a number of concurrent jobs. Each job gets an equal share
+    (at least one thread), so the total in use never exceeds the budget unless there are more jobs
+    than threads (the runner caps --jobs at --threads to avoid that).
+    """
+    return max(1, total_threads // max(1, jobs))
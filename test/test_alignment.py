@@ -18,6 +18,8 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
+import os
+
 import pytest
 
 from kleborate.shared.alignment import *
@@ -51,6 +53,69 @@ def test_get_expanded_cigar():
     assert get_expanded_cigar('') == ''
 
 
+def test_expanded_cigar():
+    a = Alignment('A\t12\t0\t12\t+\tC\t1000\t60\t73\t10\t13\tAS:i:10\tcg:Z:3=1I4=2D2=1X')
+    assert a.expanded_cigar == '===I====DD==X'
+    assert a.expanded_cigar is a.expanded_cigar  # cached
+
+
+def test_get_ref_offsets():
+    assert get_ref_offsets('3=1I4=2D2=1X', '+') == [0, 1, 2, None, 3, 4, 5, 6, 9, 10, 11]
+    assert get_ref_offsets('3=1I4=2D2=1X', '-') == [0, 1, 2, 5, 6, 7, 8, None, 9, 10, 11]
+    assert get_ref_offsets('', '+') == []
+
+
+def test_cigar_projection_1():
+    # Query ATG AAA CCC GGG aligned to ATG AAC CC-T-C GGG (a mismatch and a deletion).
+    query_seqs = {'A': 'ATGAAACCCGGG'}
+    ref_seqs = {'C': 'ATGAACCCTCGGG'}
+    a = Alignment('A\t12\t0\t12\t+\tC\t13\t0\t13\t11\t13\tAS:i:10\tcg:Z:5=1X2=1D4=',
+                  query_seqs=query_seqs, ref_seqs=ref_seqs)
+    assert a.ref_offsets == [0, 1, 2, 3, 4, 5, 6, 7, 9, 10, 11, 12]
+    assert a.ref_offsets is a.ref_offsets  # cached
+    assert a.get_ref_pos(0) == 0 and a.get_ref_pos(8) == 9
+    assert a.get_ref_pos(12) is None
+    assert a.get_ref_base(5) == 'C'
+    assert a.get_ref_codon(2) == 'AAC'
+    assert a.get_ref_residue(1) == 'M'
+    assert a.get_ref_residue(2) == 'N'
+    assert a.get_ref_residue(3) is None  # the codon has a deletion
+    assert a.get_ref_residue(4) == 'G'
+    assert a.get_ref_residue(5) is None  # past the end of the alignment
+
+
+def test_cigar_projection_2():
+    # The same alignment on the minus strand.
+    query_seqs = {'A': 'ATGAAACCCGGG'}
+    ref_seqs = {'C': 'TTCCCGAGGGTTCAT'}
+    a = Alignment('A\t12\t0\t12\t-\tC\t15\t2\t15\t11\t13\tAS:i:10\tcg:Z:4=1D2=1X5=',
+                  query_seqs=query_seqs, ref_seqs=ref_seqs)
+    assert a.ref_offsets == [0, 1, 2, 3, 4, 5, 6, 7, 9, 10, 11, 12]
+    assert a.get_ref_pos(0) == 14 and a.get_ref_pos(11) == 2
+    assert a.get_ref_base(5) == 'C'
+    assert [a.get_ref_residue(i) for i in range(1, 5)] == ['M', 'N', None, 'G']
+
+    b = Alignment('A\t12\t0\t12\t-\tC\t15\t2\t15\t11\t13\tAS:i:10\tcg:Z:4=1D2=1X5=')
+    assert b.get_ref_pos(0) == 14
+    assert b.get_ref_residue(1) is None  # no sequences
+
+
+def test_lazy_sequences():
+    query_seqs = {'A': 'ACGTACGTAC'}
+    ref_seqs = {'C': 'TTTTGTACGTACGTTTT'}
+    a = Alignment('A\t10\t0\t10\t-\tC\t17\t4\t14\t10\t10\tAS:i:20\tcg:Z:10=',
+                  query_seqs=query_seqs, ref_seqs=ref_seqs)
+    assert not hasattr(a, '__dict__')
+    a.query_name = 'B'  # renaming the query doesn't change the sequences
+    assert a.query_seq == 'ACGTACGTAC'
+    assert a.ref_seq == 'ACGTACGTAC'
+    assert a.get_translated_ref_seq() == 'TYV'
+
+    b = Alignment('A\t10\t0\t10\t-\tC\t17\t4\t14\t10\t10\tAS:i:20\tcg:Z:10=')
+    assert b.query_seq is None
+    assert b.ref_seq is None
+
+
 def test_sequences_1():
     alignments = align_query_to_ref('test/test_alignment/query.fasta',
                                     'test/test_alignment/forward_hit.fasta')
@@ -100,3 +165,161 @@ def test_sequences_3():
     assert a.ref_seq.startswith('CTTCCACAACCCTCCCAAATGTCCC')
     assert a.query_seq.endswith('ATGCGCGTTAGCTGCCTGACAGCTG')
     assert a.ref_seq.endswith('ATGCGCGTTAGCTGCCTGACAGCTG')
+
+
+def test_alignment_broker():
+    queries = ['test/test_alignment/query.fasta', 'test/test_alignment/reverse_hit.fasta']
+    ref = 'test/test_alignment/imperfect_hit.fasta'
+    direct = [[(str(a), a.cigar, a.query_seq) for a in align_query_to_ref(q, ref)]
+              for q in queries]
+    start_alignment_broker(queries, ref)
+    try:
+        brokered = [[(str(a), a.cigar, a.query_seq) for a in align_query_to_ref(q, ref)]
+                    for q in queries]
+    finally:
+        stop_alignment_broker(ref)
+    assert brokered == direct
+    assert not ALIGNMENT_BROKERS
+
+
+def test_align_queries_to_ref():
+    queries = ['test/test_alignment/query.fasta', 'test/test_alignment/reverse_hit.fasta']
+    ref = 'test/test_alignment/imperfect_hit.fasta'
+    direct = {q: [(str(a), a.cigar, a.query_seq) for a in align_query_to_ref(q, ref)]
+              for q in queries}
+    for registered in [[], queries[:1], queries]:
+        if registered:
+            start_alignment_broker(registered, ref)
+        try:
+            together = align_queries_to_ref(queries, ref)
+        finally:
+            stop_alignment_broker(ref)
+        assert {q: [(str(a), a.cigar, a.query_seq) for a in together[q]]
+                for q in queries} == direct
+    assert align_queries_to_ref([], ref) == {}
+
+
+def test_get_combined_queries(tmp_path):
+    query_dir, run_dir = tmp_path / 'db', tmp_path / 'run'
+    query_dir.mkdir()
+    run_dir.mkdir()
+    query_1, query_2 = query_dir / 'abc.fasta', query_dir / 'xyz.fasta'
+    query_1.write_text('>abc_1\nACGTACGT\n>abc_2\nACGTACGA\n')
+    query_2.write_text('>xyz_1\nGGGGCCCC\n')
+    set_combined_queries_dir(str(run_dir))
+    try:
+        combined, query_seqs = get_combined_queries([query_1, query_2])
+        assert os.path.dirname(combined) == str(run_dir)
+        assert sorted(os.listdir(query_dir)) == ['abc.fasta', 'xyz.fasta']
+        assert query_seqs == [{'abc_1': 'ACGTACGT', 'abc_2': 'ACGTACGA'}, {'xyz_1': 'GGGGCCCC'}]
+        with open(combined, 'rt') as f:
+            assert f.read() == '>0|abc_1\nACGTACGT\n>0|abc_2\nACGTACGA\n>1|xyz_1\nGGGGCCCC\n'
+        assert get_combined_queries([query_1, query_2])[0] == combined
+
+        # The combined file is reused by other processes, and a changed query file gets a new one.
+        COMBINED_QUERIES.clear()
+        assert get_combined_queries([query_1, query_2])[0] == combined
+        query_2.write_text('>xyz_1\nGGGGCCCA\n')
+        COMBINED_QUERIES.clear()
+        new_combined, query_seqs = get_combined_queries([query_1, query_2])
+        assert new_combined != combined
+        assert query_seqs[1] == {'xyz_1': 'GGGGCCCA'}
+        assert sorted(os.listdir(run_dir)) == \
+            sorted([os.path.basename(combined), os.path.basename(new_combined)])
+    finally:
+        set_combined_queries_dir(None)
+
+    # Without a run directory, the process gets its own temporary directory.
+    combined, _ = get_combined_queries([query_1, query_2])
+    assert os.path.dirname(combined) == get_combined_queries_dir() != str(run_dir)
+
+
+def test_mappy_aligner():
+    pytest.importorskip('mappy')
+    for ref in ['forward_hit', 'reverse_hit', 'imperfect_hit']:
+        query, ref = 'test/test_alignment/query.fasta', f'test/test_alignment/{ref}.fasta'
+        a = [Alignment(x) for x in Minimap2Aligner().align(query, ref)]
+        b = [Alignment(x) for x in MappyAligner().align(query, ref)]
+        assert [str(x) for x in a] == [str(x) for x in b]
+        assert [x.cigar for x in a] == [x.cigar for x in b]
+        assert [x.alignment_score for x in a] == [x.alignment_score for x in b]
+
+
+def test_set_aligner():
+    pytest.importorskip('mappy')
+    try:
+        set_aligner('mappy')
+        assert get_aligner().name == 'mappy'
+        alignments = align_query_to_ref('test/test_alignment/query.fasta',
+                                        'test/test_alignment/forward_hit.fasta')
+        assert len(alignments) == 1
+        assert alignments[0].percent_identity == 100.0
+    finally:
+        set_aligner('minimap2')
+    assert get_aligner().name == 'minimap2'
+
+
+def test_get_cigar_score():
+    assert get_cigar_score([[500, 7], [1, 2], [500, 7]]) == 1994
+    assert get_cigar_score([[10, 7], [1, 8], [10, 7]]) == 36
+    assert get_cigar_score([[10, 7], [100, 1], [10, 7]]) == 40 - 124
+
+
+def test_filter_paf_lines():
+    lines = ['a\t1000\t0\t1000\t+\td\t10001\t3910\t4911\t1000\t1001\t60\tcg:Z:500=1D500=',
+             'b\t1000\t0\t500\t+\td\t10001\t3910\t4410\t500\t500\t60\tcg:Z:500=',
+             'c\t1000\t0\t1000\t+\td\t10001\t3910\t4910\t900\t1000\t60\tcg:Z:1000M']
+    assert list(filter_paf_lines(lines)) == lines
+    assert [x[0] for x in filter_paf_lines(lines, min_identity=95.0)] == ['a', 'b']
+    assert [x[0] for x in filter_paf_lines(lines, min_query_coverage=90.0)] == ['a', 'c']
+    assert [x[0] for x in filter_paf_lines(lines, 95.0, 90.0)] == ['a']
+    for line in lines:  # raw-field filtering must agree with the Alignment attributes
+        a = Alignment(line)
+        assert bool(list(filter_paf_lines([line], 95.0, 90.0))) == \
+            (a.percent_identity >= 95.0 and a.query_cov >= 90.0)
+
+
+def test_minimap2_aligner_error():
+    with pytest.raises(subprocess.CalledProcessError):
+        list(Minimap2Aligner().align('test/test_alignment/query.fasta', 'not_a_file.fasta'))
+
+
+def test_cull_redundant_hits():
+    # The interval index should keep exactly the same hits as checking against every kept hit.
+    import random
+    rng = random.Random(0)
+    for _ in range(20):
+        hits = []
+        for i in range(200):
+            start = rng.randint(0, 5000)
+            end = start + rng.choice([30, 50, 51, 52, 100, rng.randint(1, 1500)])
+            length = end - start
+            matches = rng.randint(length // 2, length)
+            hits.append(Alignment(f'gene_{i}\t{length}\t0\t{length}\t{rng.choice("+-")}\t'
+                                  f'contig_{rng.randint(1, 3)}\t10000\t{start}\t{end}\t'
+                                  f'{matches}\t{length}\tAS:i:{rng.randint(1, 5000)}'))
+        expected = []
+        for h in sorted(hits, key=lambda x: (1/(x.percent_identity * x.alignment_score *
+                                                 x.query_cov), x.query_name)):
+            if not any(e.strand == h.strand and e.ref_name == h.ref_name and hits_overlap(h, e)
+                       for e in expected):
+                expected.append(h)
+        assert cull_redundant_hits(hits) == expected
+
+
+def test_check_for_exact_aa_match(tmp_path):
+    ref_file = tmp_path / 'refs.fasta'
+    ref_file.write_text('>geneA_1\nATGAAACCCGGGTAA\n'
+                        '>geneA_0\nATGAAGCCTGGGTAA\n'  # same protein as geneA_1
+                        '>geneA_2\nATGAAACCCGGGTTTTAA\n'
+                        '>geneB\nATGTTTTAA\n')
+    contig = 'GGGGGGGGGGATGAAGCCCGGGTAACCCCCCCCCC'  # synonymous change in geneA
+    hit = Alignment('geneA_1\t15\t0\t15\t+\tcontig\t35\t10\t25\t14\t15\tAS:i:22\tcg:Z:5=1X9=',
+                    ref_seqs={'contig': contig})
+    assert check_for_exact_aa_match(str(ref_file), hit, None) == 'geneA_0'
+    assert get_translated_refs(str(ref_file))['MKPG*'] == [(15, 'geneA_1'), (15, 'geneA_0')]
+
+    contig = 'GGGGGGGGGGATGAAGCCCTGGTAACCCCCCCCCC'  # non-synonymous change in geneA
+    hit = Alignment('geneA_1\t15\t0\t15\t+\tcontig\t35\t10\t25\t13\t15\tAS:i:18\tcg:Z:5=1X3=1X5=',
+                    ref_seqs={'contig': contig})
+    assert check_for_exact_aa_match(str(ref_file), hit, None) is None
@@ -0,0 +1,137 @@
+"""
+This file contains tests for Kleborate. To run all tests, go the repo's root directory and run:
+  python3 -m pytest
+
+To get code coverage stats:
+  coverage run --source . -m pytest && coverage report -m
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import os
+import pathlib
+
+from kleborate.shared.alignment import align_query_to_ref
+from kleborate.shared.assembly import *
+from kleborate.shared.misc import load_fasta
+
+
+def test_assembly_context(tmp_path):
+    assembly = tmp_path / 'assembly.fasta'
+    assembly.write_text('>a\nACGTACGT\n>b\nacgt\n')
+    context = AssemblyContext(assembly, 'assembly.mmi')
+    assert context.seqs == [('a', 'ACGTACGT'), ('b', 'ACGT')]
+    assert context.contigs == {'a': 'ACGTACGT', 'b': 'ACGT'}
+    assert context.contig_lengths == {'a': 8, 'b': 4}
+    assert context.sha256 == hashlib.sha256(assembly.read_bytes()).hexdigest()
+    assert context.minimap2_index == 'assembly.mmi'
+    assert context.cache == {}
+
+
+def test_assembly_context_given_seqs(tmp_path):
+    # Sequences which have already been loaded aren't loaded again.
+    context = AssemblyContext(tmp_path / 'missing.fasta', seqs=[('a', 'ACGT')])
+    assert context.contigs == {'a': 'ACGT'}
+    assert load_assembly(context) == [('a', 'ACGT')]
+    assert load_assembly_contigs(context) == {'a': 'ACGT'}
+
+
+def test_assembly_context_as_path(tmp_path):
+    # Code which expects the assembly's path can be given the context.
+    assembly = tmp_path / 'assembly.fasta'
+    assembly.write_text('>a\nACGT\n')
+    context = AssemblyContext(assembly)
+    assert os.fspath(context) == str(context) == str(assembly)
+    assert pathlib.Path(context) == assembly
+    assert os.path.isfile(context)
+    with open(context, 'rt') as f:
+        assert f.read() == '>a\nACGT\n'
+    assert load_assembly(assembly) == load_assembly(context) == [('a', 'ACGT')]
+
+
+def test_align_to_assembly_context():
+    ref = 'test/test_alignment/imperfect_hit.fasta'
+    query = 'test/test_alignment/query.fasta'
+    context = AssemblyContext(ref)
+    direct = [(str(a), a.cigar, a.ref_seq) for a in align_query_to_ref(query, ref)]
+    assert [(str(a), a.cigar, a.ref_seq) for a in align_query_to_ref(query, context)] == direct
+
+
+def test_fasta_index(tmp_path):
+    # Contigs fetched from the index match the loaded sequences, whatever the line layout (and
+    # headers with whitespace before them).
+    assembly = tmp_path / 'assembly.fasta'
+    assembly.write_bytes(b'junk\n>a desc\nACGTA\nCGTAC\nGT\n\n>\nAAAA\n>b\r\nacgt\r\nAC\r\n'
+                         b'>c\nACG\nACGTA\nA\n>d\n>e\nTTTTTGGGGG\n  >f desc\nACGT\n\t>g\nGG')
+    fasta_index = FastaIndex(assembly)
+    seqs = dict(load_fasta(assembly))
+    assert list(fasta_index) == list(seqs) == ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+    assert fasta_index.lengths == {name: len(seq) for name, seq in seqs.items()}
+    for name, seq in seqs.items():
+        for start in range(len(seq) + 1):
+            for end in range(start, len(seq) + 2):
+                assert fasta_index.fetch(name, start, end) == seq[start:end]
+        contig = fasta_index[name]
+        assert len(contig) == len(seq)
+        assert str(contig) == contig[:] == seq
+        assert contig[2:-1] == seq[2:-1]
+        if seq:
+            assert contig[-1] == seq[-1]
+    assert fasta_index.entries['a'][2:] == (5, 6)  # regular lines
+    assert fasta_index.entries['b'][2:] == (4, 6)  # Windows line endings
+    assert fasta_index.entries['c'][2] == 0  # irregular lines
+    fasta_index.close()
+
+
+def test_fasta_index_file(tmp_path):
+    # The index is saved in .fai format and loaded from there if it exists.
+    assembly = tmp_path / 'assembly.fasta'
+    assembly.write_text('>a\nACGTACGT\nACG\n>b\nCCCC\n')
+    index_path = tmp_path / 'assembly.fasta.fai'
+    FastaIndex(assembly, index_path).close()
+    assert index_path.read_text() == 'a\t11\t3\t8\t9\nb\t4\t19\t4\t5\n'
+    fasta_index = FastaIndex(assembly, index_path)
+    assert fasta_index.fetch('a', 6, 10) == 'GTAC'
+    assert fasta_index.fetch('b') == 'CCCC'
+    fasta_index.close()
+
+
+def test_assembly_context_fasta_index(tmp_path):
+    # Without loaded sequences, the shared code reads contigs through the FASTA index.
+    assembly = tmp_path / 'assembly.fasta'
+    assembly.write_text('>a\nACGTACGT\n>b\nacgt\n')
+    context = AssemblyContext(assembly)
+    contigs = load_assembly_contigs(context)
+    assert isinstance(contigs, FastaIndex)
+    assert contigs['a'][2:6] == 'GTAC'
+    assert load_assembly_contigs(context, names=['b', 'c']) == {'b': 'ACGT'}
+    assert list(iter_assembly(context)) == [('a', 'ACGTACGT'), ('b', 'ACGT')]
+    assert context.contig_lengths == {'a': 8, 'b': 4}
+    assert context._seqs is None
+    context.close()
+
+
+def test_fasta_index_ambiguous_counts(tmp_path):
+    # Ambiguous bases are counted when the index is built, or when first used for a loaded index.
+    assembly = tmp_path / 'assembly.fasta'
+    assembly.write_text('>a\nACGNN\nacgtr\nA\n>b\r\nAC-T\r\n>c\nACG\nACGTN\n>d\nACGT\n')
+    index_path = tmp_path / 'assembly.fasta.fai'
+    expected = {'a': (11, 3), 'b': (4, 1), 'c': (8, 1), 'd': (4, 0)}
+    for _ in range(2):
+        context = AssemblyContext(assembly, fasta_index=FastaIndex(assembly, index_path))
+        assert get_contig_base_counts(context) == expected
+        context.close()
+    assert get_contig_base_counts(assembly) == expected
+    assert get_contig_base_counts(AssemblyContext(tmp_path / 'missing.fasta',
+                                                  seqs=[('a', 'ACGTN')])) == {'a': (5, 1)}
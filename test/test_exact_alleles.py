@@ -0,0 +1,219 @@
+"""
+This file contains tests for Kleborate. To run all tests, go the repo's root directory and run:
+  python3 -m pytest
+
+To get code coverage stats:
+  coverage run --source . -m pytest && coverage report -m
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+import random
+
+from kleborate.shared.alignment import align_query_to_ref
+from kleborate.shared.exact_alleles import *
+from kleborate.shared.misc import reverse_complement
+from kleborate.shared.mlst import align_alleles, get_best_hits
+
+
+def random_seq(length):
+    return ''.join(random.choice('ACGT') for _ in range(length))
+
+
+def mutate(seq, count):
+    seq = list(seq)
+    for i in random.sample(range(len(seq)), count):
+        seq[i] = random.choice([b for b in 'ACGT' if b != seq[i]])
+    return ''.join(seq)
+
+
+def write_fasta(filename, seqs):
+    with open(filename, 'wt') as f:
+        for name, seq in seqs:
+            f.write(f'>{name}\n{seq}\n')
+
+
+def make_scheme(tmp_path):
+    random.seed(0)
+    abc = random_seq(400)
+    abc_alleles = [abc] + [mutate(abc, 3) for _ in range(5)]
+    abc_alleles.append(abc[:200] + 'GTA' + abc[200:])  # an allele with an insertion
+    xyz = random_seq(350)
+    xyz_alleles = [xyz] + [mutate(xyz, 2) for _ in range(5)]
+    allele_paths = {'abc': tmp_path / 'abc.fasta', 'xyz': tmp_path / 'xyz.fasta'}
+    write_fasta(allele_paths['abc'], [(f'abc_{i+1}', s) for i, s in enumerate(abc_alleles)])
+    write_fasta(allele_paths['xyz'], [(f'xyz_{i+1}', s) for i, s in enumerate(xyz_alleles)])
+    return allele_paths, abc_alleles, xyz_alleles
+
+
+def hit_key(h):
+    return h.query_name, h.strand, h.ref_name, h.ref_start, h.ref_end, h.percent_identity, \
+        h.alignment_score, h.cigar, h.query_seq, h.ref_seq
+
+
+def test_find_exact_alleles_1(tmp_path):
+    # Exact hits on both strands give the same best hits as minimap2.
+    allele_paths, abc_alleles, xyz_alleles = make_scheme(tmp_path)
+    assembly = tmp_path / 'assembly.fasta'
+    write_fasta(assembly, [('contig_1', random_seq(1000) + abc_alleles[2] + random_seq(1000)),
+                           ('contig_2', random_seq(500) + reverse_complement(xyz_alleles[4]) +
+                            random_seq(700))])
+    exact_hits = find_exact_alleles(assembly, allele_paths, ['abc', 'xyz'])
+    assert sorted(exact_hits) == ['abc', 'xyz']
+    assert [str(h) for h in exact_hits['abc']] == \
+        ['abc_3:0-400(+), contig_1:1000-1400 (100.000%)']
+    assert [str(h) for h in exact_hits['xyz']] == \
+        ['xyz_5:0-350(-), contig_2:500-850 (100.000%)']
+    for gene in ['abc', 'xyz']:
+        hits = align_query_to_ref(allele_paths[gene], assembly)
+        assert [hit_key(h) for h in get_best_hits(exact_hits[gene])] == \
+            [hit_key(h) for h in get_best_hits(hits)]
+
+
+def test_find_exact_alleles_2(tmp_path):
+    # Genes without an exact hit are left out, so they can be aligned.
+    allele_paths, abc_alleles, xyz_alleles = make_scheme(tmp_path)
+    assembly = tmp_path / 'assembly.fasta'
+    write_fasta(assembly, [('contig_1', random_seq(1000) + abc_alleles[6] + random_seq(1000) +
+                            mutate(xyz_alleles[0], 1) + random_seq(300))])
+    exact_hits = find_exact_alleles(assembly, allele_paths, ['abc', 'xyz'])
+    assert sorted(exact_hits) == ['abc']
+    assert [h.query_name for h in exact_hits['abc']] == ['abc_7']
+
+
+def test_find_exact_alleles_3(tmp_path):
+    # Every exact hit is found, including multiple copies and alleles at the ends of contigs.
+    allele_paths, abc_alleles, _ = make_scheme(tmp_path)
+    assembly = tmp_path / 'assembly.fasta'
+    write_fasta(assembly, [('contig_1', abc_alleles[1] + random_seq(600) + abc_alleles[1]),
+                           ('contig_2', reverse_complement(abc_alleles[1]))])
+    exact_hits = find_exact_alleles(assembly, allele_paths, ['abc'])
+    assert [str(h) for h in exact_hits['abc']] == \
+        ['abc_2:0-400(+), contig_1:0-400 (100.000%)',
+         'abc_2:0-400(+), contig_1:1000-1400 (100.000%)',
+         'abc_2:0-400(-), contig_2:0-400 (100.000%)']
+
+
+def test_find_exact_alleles_4(tmp_path):
+    # If an exact hit's allele is part of a longer allele, the longer allele's alignment is also
+    # 100% identity with a higher score, so the gene needs to be aligned.
+    allele_paths, abc_alleles, _ = make_scheme(tmp_path)
+    write_fasta(allele_paths['abc'], [('abc_1', abc_alleles[0]),
+                                      ('abc_2', random_seq(50) + abc_alleles[0])])
+    assembly = tmp_path / 'assembly.fasta'
+    write_fasta(assembly, [('contig_1', random_seq(1000) + abc_alleles[0] + random_seq(1000))])
+    assert find_exact_alleles(assembly, allele_paths, ['abc']) == {}
+
+
+def test_find_exact_alleles_5(tmp_path):
+    # The same goes for an exact match to most of a longer allele somewhere else in the assembly.
+    allele_paths, abc_alleles, _ = make_scheme(tmp_path)
+    longer = abc_alleles[3] + random_seq(100)
+    write_fasta(allele_paths['abc'], [('abc_1', abc_alleles[0]), ('abc_2', longer)])
+    assembly = tmp_path / 'assembly.fasta'
+    write_fasta(assembly, [('contig_1', random_seq(1000) + abc_alleles[0] + random_seq(1000)),
+                           ('contig_2', random_seq(300) + longer[:450] + random_seq(300))])
+    assert find_exact_alleles(assembly, allele_paths, ['abc']) == {}
+
+    # But not if that match is shorter than the exact hit.
+    write_fasta(assembly, [('contig_1', random_seq(1000) + abc_alleles[0] + random_seq(1000)),
+                           ('contig_2', random_seq(300) + longer[:380] + random_seq(300))])
+    assert sorted(find_exact_alleles(assembly, allele_paths, ['abc'])) == ['abc']
+
+
+def check_against_aligner(assembly, allele_paths, gene_names):
+    """
+    Checks that taking each gene's hits from find_exact_alleles (and aligning the genes it leaves
+    out, as mlst does) gives the same best hits as aligning every gene with align_alleles. Returns
+    the genes whose hits came from find_exact_alleles.
+    """
+    exact_hits = find_exact_alleles(assembly, allele_paths, gene_names)
+    aligned_hits = align_alleles(assembly, None, allele_paths, gene_names, 90.0, 80.0)
+    for gene in gene_names:
+        hits = exact_hits[gene] if gene in exact_hits else aligned_hits[gene]
+        assert sorted(hit_key(h) for h in get_best_hits(hits)) == \
+            sorted(hit_key(h) for h in get_best_hits(aligned_hits[gene]))
+    return sorted(exact_hits)
+
+
+def test_against_aligner_contained_alleles(tmp_path):
+    # Alleles which are part of a longer allele (at its start, middle or end).
+    allele_paths, abc_alleles, _ = make_scheme(tmp_path)
+    longer = random_seq(60) + abc_alleles[0] + random_seq(60)
+    write_fasta(allele_paths['abc'], [('abc_1', longer), ('abc_2', longer[:400]),
+                                      ('abc_3', longer[60:460]), ('abc_4', longer[-400:])])
+    assembly = tmp_path / 'assembly.fasta'
+    for part in [longer[:400], longer[60:460], longer[-400:]]:
+        write_fasta(assembly, [('contig_1', random_seq(1000) + part + random_seq(1000))])
+        assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == []
+
+    # The longest allele isn't part of another, so its exact hit is used.
+    write_fasta(assembly, [('contig_1', random_seq(1000) + longer + random_seq(1000))])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == ['abc']
+
+
+def test_against_aligner_contig_edges(tmp_path):
+    # Exact hits at the start and end of contigs (on both strands) and whole-contig hits.
+    allele_paths, abc_alleles, xyz_alleles = make_scheme(tmp_path)
+    assembly = tmp_path / 'assembly.fasta'
+    write_fasta(assembly, [('contig_1', abc_alleles[1] + random_seq(800)),
+                           ('contig_2', random_seq(800) + reverse_complement(xyz_alleles[2]))])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == ['abc', 'xyz']
+    write_fasta(assembly, [('contig_1', reverse_complement(abc_alleles[1]) + random_seq(800)),
+                           ('contig_2', random_seq(800) + xyz_alleles[2])])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == ['abc', 'xyz']
+    write_fasta(assembly, [('contig_1', abc_alleles[1]), ('contig_2', xyz_alleles[2])])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == ['abc', 'xyz']
+
+    # An allele cut short by the end of a contig isn't an exact hit.
+    write_fasta(assembly, [('contig_1', random_seq(800) + abc_alleles[1][:380]),
+                           ('contig_2', xyz_alleles[2][20:] + random_seq(800))])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == []
+
+    # Nor is an allele whose longer version runs off the end of the contig.
+    write_fasta(allele_paths['abc'], [('abc_1', abc_alleles[0]),
+                                      ('abc_2', abc_alleles[0] + random_seq(30))])
+    write_fasta(assembly, [('contig_1', random_seq(800) + abc_alleles[0])])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == []
+
+
+def test_against_aligner_ambiguous_bases(tmp_path):
+    # minimap2 doesn't count ambiguous bases as matches, so a hit with one (in the assembly or in
+    # the allele) isn't exact.
+    allele_paths, abc_alleles, xyz_alleles = make_scheme(tmp_path)
+    assembly = tmp_path / 'assembly.fasta'
+    with_n = abc_alleles[1][:200] + 'N' + abc_alleles[1][201:]
+    write_fasta(assembly, [('contig_1', random_seq(800) + with_n + random_seq(800)),
+                           ('contig_2', random_seq(800) + xyz_alleles[2] + random_seq(800))])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == ['xyz']
+
+    write_fasta(allele_paths['abc'], [('abc_1', abc_alleles[0]), ('abc_2', with_n)])
+    write_fasta(assembly, [('contig_1', random_seq(800) + with_n + random_seq(800))])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == []
+
+    # Ambiguous bases next to an exact hit don't stop it being used.
+    write_fasta(assembly, [('contig_1', 'N' * 50 + abc_alleles[0] + 'NNNN' + random_seq(800))])
+    assert check_against_aligner(assembly, allele_paths, ['abc', 'xyz']) == ['abc']
+
+
+def test_exact_match_length():
+    allele = 'AAAAAAAAAA' + 'C' * K + 'GGGGGGGGGG'
+    assert exact_match_length(allele, 10, allele, 10) == len(allele)
+    assert exact_match_length(allele, 10, 'TAAAA' + 'C' * K + 'GGGT', 5) == K + 7
+    assert exact_match_length(allele, 10, 'C' * K, 0) == K
+
+
+def test_longest_match():
+    for n in range(11):
+        assert longest_match(lambda i: i <= n, 10) == n
+    assert longest_match(lambda i: True, 0) == 0
@@ -0,0 +1,74 @@
+"""
+This file contains tests for Kleborate. To run all tests, go the repo's root directory and run:
+  python3 -m pytest
+
+To get code coverage stats:
+  coverage run --source . -m pytest && coverage report -m
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import time
+
+from kleborate.shared.index_cache import *
+
+
+def make_index(path, size):
+    path.write_bytes(b'i' * size)
+    return path
+
+
+def test_get_and_put(tmp_path):
+    cache = IndexCache(tmp_path / 'cache', 1000)
+    os.makedirs(cache.directory)
+    assert not cache.get('abc', tmp_path / 'a.mmi')
+    cache.put('abc', make_index(tmp_path / 'built.mmi', 10))
+    assert cache.index_path('abc').is_file()
+    assert get_minimap2_version() in cache.index_path('abc').name
+    assert cache.get('abc', tmp_path / 'a.mmi')
+    assert (tmp_path / 'a.mmi').read_bytes() == b'i' * 10
+    assert not cache.get('xyz', tmp_path / 'x.mmi')
+    assert [f for f in os.listdir(cache.directory) if not f.endswith('.mmi')] == []
+
+
+def test_evict(tmp_path):
+    # The least recently used indices are removed to keep the cache under its maximum size.
+    cache = IndexCache(tmp_path, 250)
+    for i, name in enumerate(['a', 'b', 'c']):
+        cache.put(name, make_index(tmp_path / f'{name}.built', 100))
+        os.utime(cache.index_path(name), (time.time() - 100 + i, time.time() - 100 + i))
+    assert not cache.index_path('a').exists()  # evicted when c was added
+    assert cache.get('b', tmp_path / 'b.mmi')  # b is now the most recently used
+    cache.put('d', make_index(tmp_path / 'd.built', 100))
+    assert [cache.index_path(n).exists() for n in 'abcd'] == [False, True, False, True]
+
+    # The index just added is kept even if it's bigger than the maximum size.
+    cache.put('e', make_index(tmp_path / 'e.built', 300))
+    assert [cache.index_path(n).exists() for n in 'bde'] == [False, False, True]
+
+
+def test_database_cache_dir(tmp_path, monkeypatch):
+    # Without an index cache, database files go in the user's cache directory.
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    assert get_database_cache_dir() == tmp_path / 'xdg' / 'kleborate' / 'databases'
+    monkeypatch.delenv('XDG_CACHE_HOME')
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert get_database_cache_dir() == tmp_path / '.cache' / 'kleborate' / 'databases'
+
+    set_database_cache(tmp_path / 'index')
+    try:
+        assert get_database_cache_dir() == tmp_path / 'index' / 'databases'
+    finally:
+        set_database_cache(None)
@@ -18,6 +18,7 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
+import argparse
 import collections
 import pathlib
 import pytest
@@ -25,6 +26,7 @@ import re
 import tempfile
 
 import kleborate.__main__
+from kleborate.shared.threads import set_threads
 
 
 def test_get_version():
@@ -330,3 +332,117 @@ def test_get_run_order_2():
     dependency_graph = {'a': ['b'], 'b': ['a'], 'c': []}
     with pytest.raises(SystemExit) as e:
         assert kleborate.__main__.get_run_order(dependency_graph)
+
+
+def run_main(monkeypatch, args):
+    monkeypatch.setattr('sys.argv', ['kleborate'] + args)
+    kleborate.__main__.main()
+
+
+def test_jobs_output_matches_serial(monkeypatch, capsys):
+    assemblies = ['test/test_genomes/GCF_000968155.1.fna.gz',
+                  'test/test_genomes/GCF_000016305.1.fna.gz',
+                  'test/test_main/test.fasta']
+    outputs, stdouts = [], []
+    for jobs in ['1', '2']:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            capsys.readouterr()
+            run_main(monkeypatch, ['-a'] + assemblies + ['-o', tmp_dir, '-j', jobs,
+                                                         '-m', 'klebsiella_pneumo_complex__mlst'])
+            stdouts.append(capsys.readouterr().out)
+            out_file = pathlib.Path(tmp_dir) / 'klebsiella_pneumo_complex__mlst_output.txt'
+            outputs.append(open(out_file, 'rt').read())
+    assert outputs[0] == outputs[1]
+    assert stdouts[0] == stdouts[1]
+    assert [line.split('\t')[0] for line in outputs[1].splitlines()[1:]] == \
+        ['GCF_000968155.1', 'GCF_000016305.1', 'test']
+
+
+def test_parallel_modules_output_matches_serial(monkeypatch, capsys):
+    # Modules only run concurrently with --parallel_modules, and the results are the same.
+    concurrent_calls = []
+    run_modules = kleborate.__main__.run_modules
+    def logged_run_modules(*args, concurrent_modules=False):
+        concurrent_calls.append(concurrent_modules)
+        return run_modules(*args, concurrent_modules=concurrent_modules)
+    monkeypatch.setattr(kleborate.__main__, 'run_modules', logged_run_modules)
+    assemblies = ['test/test_genomes/GCF_000968155.1.fna.gz',
+                  'test/test_genomes/GCF_000016305.1.fna.gz']
+    modules = 'klebsiella_pneumo_complex__mlst,klebsiella_pneumo_complex__wzi'
+    outputs, stdouts = [], []
+    for parallel_modules in [[], ['--parallel_modules']]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            capsys.readouterr()
+            run_main(monkeypatch, ['-a'] + assemblies + ['-o', tmp_dir, '-m', modules] +
+                     parallel_modules)
+            stdouts.append(capsys.readouterr().out)
+            out_file = pathlib.Path(tmp_dir) / 'klebsiella_pneumo_complex__mlst_output.txt'
+            outputs.append(open(out_file, 'rt').read())
+    assert concurrent_calls == [False, False, True, True]
+    assert outputs[0] == outputs[1]
+    assert stdouts[0] == stdouts[1]
+
+
+class FakeModule:
+    def __init__(self, name, prerequisites, log=None):
+        self.name, self.prerequisites, self.log = name, prerequisites, log
+
+    def prerequisite_modules(self):
+        return self.prerequisites
+
+    def get_results(self, assembly, minimap2_index, args, previous_results):
+        for p in self.prerequisites:
+            assert f'{p}__result' in previous_results
+        if self.log is not None:
+            self.log.append(self.name)
+        return {'result': self.name}
+
+
+def test_run_modules_1():
+    modules = {'a': FakeModule('a', []), 'b': FakeModule('b', ['a']),
+               'c': FakeModule('c', []), 'd': FakeModule('d', ['b', 'c'])}
+    run_order = kleborate.__main__.get_run_order({m: modules[m].prerequisite_modules()
+                                                  for m in modules})
+    results = {}
+    set_threads(4)
+    try:
+        kleborate.__main__.run_modules(run_order, modules, 'assembly', None, None, results,
+                                       concurrent_modules=True)
+    finally:
+        set_threads(1)
+    assert results == {'a__result': 'a', 'b__result': 'b', 'c__result': 'c', 'd__result': 'd'}
+
+
+def test_run_modules_2():
+    # Modules which have already been run (e.g. preset check modules) are not run again.
+    modules = {'a': FakeModule('a', []), 'b': FakeModule('b', ['a'])}
+    results = {'a__result': 'already run'}
+    kleborate.__main__.run_modules(['a', 'b'], modules, 'assembly', None, None, results, ['a'])
+    assert results == {'a__result': 'already run', 'b__result': 'b'}
+
+
+def test_run_modules_3():
+    # By default (and always in --jobs worker processes), modules run one at a time in the run
+    # order, even with threads to spare.
+    log = []
+    modules = {'a': FakeModule('a', [], log), 'b': FakeModule('b', ['a'], log),
+               'c': FakeModule('c', [], log)}
+    results = {}
+    set_threads(4)
+    try:
+        kleborate.__main__.run_modules(['c', 'a', 'b'], modules, 'assembly', None, None, results)
+    finally:
+        set_threads(1)
+    assert log == ['c', 'a', 'b']
+    assert results == {'a__result': 'a', 'b__result': 'b', 'c__result': 'c'}
+
+
+def test_get_jobs_and_threads():
+    def get(jobs, threads, assemblies):
+        args = argparse.Namespace(jobs=jobs, threads=threads, assemblies=['a.fasta'] * assemblies)
+        return kleborate.__main__.get_jobs_and_threads(args)
+    assert get(1, 8, 10) == (1, 8)
+    assert get(4, 8, 10) == (4, 2)
+    assert get(4, 8, 2) == (2, 4)
+    assert get(16, 8, 20) == (8, 1)
+    assert get(3, 8, 10) == (3, 2)
@@ -78,3 +78,53 @@ def test_load_fasta_2():
 def test_load_fasta_3():
     fasta_seqs = load_fasta('test/test_misc/empty.fasta')
     assert len(fasta_seqs) == 0
+
+
+def test_read_fasta_1():
+    # Records are read one at a time, and can be returned as bytes.
+    records = read_fasta('test/test_misc/lowercase.fasta', as_bytes=True)
+    name, seq = next(records)
+    assert isinstance(name, bytes) and seq.startswith(b'TTGCCTGTA')
+    name, seq = next(records)
+    assert seq.startswith(b'ATTCTCAGA')
+    with pytest.raises(StopIteration):
+        next(records)
+
+
+def test_read_fasta_2():
+    # Only the wanted records are returned.
+    all_seqs = load_fasta('test/test_misc/lowercase.fasta')
+    second_name = all_seqs[1][0]
+    assert list(read_fasta('test/test_misc/lowercase.fasta', names=[second_name])) == \
+        all_seqs[1:]
+    assert list(read_fasta('test/test_misc/lowercase.fasta', names={second_name.encode()})) == \
+        all_seqs[1:]
+    assert list(read_fasta('test/test_misc/lowercase.fasta', names=[])) == []
+
+
+def test_read_fasta_3(tmp_path):
+    # Windows line endings, headers with descriptions, a missing final newline and a gzipped file.
+    fasta = b'>a description\r\nacgt\r\nACGT\r\n\r\n>b\r\nGGCC'
+    plain_file, gzipped_file = tmp_path / 'test.fasta', tmp_path / 'test.fasta.gz'
+    plain_file.write_bytes(fasta)
+    with gzip.open(gzipped_file, 'wb') as f:
+        f.write(fasta)
+    for filename in [plain_file, gzipped_file]:
+        assert load_fasta(filename) == [('a', 'ACGTACGT'), ('b', 'GGCC')]
+
+
+def test_read_fasta_4(tmp_path):
+    # Lines are stripped before looking for headers, so indented headers aren't read as sequence.
+    fasta_file = tmp_path / 'test.fasta'
+    fasta_file.write_bytes(b'  >a description\nACGT\n  acgt  \n\t>b\nGGCC\n')
+    assert load_fasta(fasta_file) == [('a', 'ACGTACGT'), ('b', 'GGCC')]
+    assert list(read_fasta(fasta_file, as_bytes=True, names=['b'])) == [(b'b', b'GGCC')]
+
+
+def test_read_lines(tmp_path):
+    text = b'first line\nsecond line\n\nlast line'
+    test_file = tmp_path / 'test.txt'
+    test_file.write_bytes(text)
+    for block_size in [1, 3, 7, 1000]:
+        with open(test_file, 'rb') as f:
+            assert list(read_lines(f, block_size)) == text.split(b'\n')
@@ -18,11 +18,13 @@ details. You should have received a copy of the GNU General Public License along
 not, see <https://www.gnu.org/licenses/>.
 """
 
+import os
 import pathlib
 import tempfile
 
 from kleborate.shared.mlst import *
 from kleborate.shared.alignment import Alignment
+from kleborate.shared.index_cache import set_database_cache
 
 
 def test_load_st_profiles_1():
@@ -252,3 +254,101 @@ def test_get_best_matching_profile_6():
     assert best_hit_per_gene['abcD'].query_name == 'abcD_1'
     assert best_hit_per_gene['efgH'].query_name == 'efgH_2'
     assert best_hit_per_gene['ijkL'].query_name == 'ijkL_2'
+
+
+def test_get_best_matching_profile_7():
+    # The allele index should give the same answer (including ties going to the earliest ST) as
+    # scoring every profile.
+    import random
+    rng = random.Random(0)
+    gene_names = ['abcD', 'efgH', 'ijkL', 'mnoP']
+    profiles = StProfiles.from_list([(st, [rng.randint(1, 4) for _ in gene_names], str(st))
+                                     for st in range(1, 200)])
+    for _ in range(200):
+        best_hits_per_gene = {g: [Alignment(f'{g}_{rng.randint(1, 5)}\t100\t0\t100\t+\t'
+                                            'tig\t100\t0\t100\t100\t100\tAS:i:100\tcg:Z:100=')
+                                  for _ in range(rng.randint(0, 2))]
+                              for g in gene_names}
+        expected = (0, [0] * len(gene_names), '')
+        best_matches = 0
+        for st, alleles, extra_info in profiles:
+            matches = sum(any(allele == number_from_hit(h) for h in best_hits_per_gene[g])
+                          for g, allele in zip(gene_names, alleles))
+            if matches > best_matches:
+                expected, best_matches = (st, alleles, extra_info), matches
+        assert get_best_matching_profile(profiles, gene_names, best_hits_per_gene) == expected
+        assert get_best_matching_profile(list(profiles), gene_names,
+                                         best_hits_per_gene) == expected
+
+
+def test_load_st_profiles_3():
+    # Loading the same file again gives the same profiles. With a database cache (--index_cache),
+    # the compiled table is saved there (not next to the TSV) and used in a new process (simulated
+    # by clearing the loaded profiles).
+    gene_names = ['abcD', 'efgH', 'ijkL']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile_dir, cache_dir = pathlib.Path(tmp_dir) / 'db', pathlib.Path(tmp_dir) / 'cache'
+        profile_dir.mkdir()
+        profile_file = profile_dir / 'profiles'
+        with open(profile_file, 'wt') as f:
+            f.write('ST\tabcD\tefgH\tijkL\textra\n')
+            f.write('1\t1\t1\t1\ta\n')
+            f.write('2\t1\t2\t1\tb\n')
+        set_database_cache(cache_dir)
+        try:
+            ST_PROFILES.clear()
+            profiles = load_st_profiles(profile_file, gene_names, 'extra')
+            assert load_st_profiles(profile_file, gene_names, 'extra') is profiles
+            assert os.listdir(profile_dir) == ['profiles']
+            assert len(list((cache_dir / 'databases' / 'st_profiles').glob('*.npy'))) == 1
+            assert list(profiles.profiles_with_allele(0, 1)) == [0, 1]
+            assert list(profiles.profiles_with_allele(1, 2)) == [1]
+            assert list(profiles.profiles_with_allele(1, 3)) == []
+
+            ST_PROFILES.clear()
+            compiled = load_st_profiles(profile_file, gene_names, 'extra')
+            assert compiled is not profiles
+            assert isinstance(compiled.alleles, np.memmap) or isinstance(compiled.alleles.base,
+                                                                         np.memmap)
+            assert compiled == [(1, [1, 1, 1], 'a'), (2, [1, 2, 1], 'b')]
+
+            # A changed TSV means the compiled table is remade (in place of the old one).
+            with open(profile_file, 'at') as f:
+                f.write('3\t2\t2\t2\tc\n')
+            ST_PROFILES.clear()
+            assert load_st_profiles(profile_file, gene_names, 'extra')[-1] == (3, [2, 2, 2], 'c')
+            assert len(list((cache_dir / 'databases' / 'st_profiles').glob('*.npy'))) == 1
+        finally:
+            set_database_cache(None)
+            ST_PROFILES.clear()
+
+
+def test_load_st_profiles_4(monkeypatch):
+    # Without an index cache, the compiled table is kept in the user's cache directory.
+    gene_names = ['abcD', 'efgH', 'ijkL']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile_dir, user_cache = pathlib.Path(tmp_dir) / 'db', pathlib.Path(tmp_dir) / 'cache'
+        profile_dir.mkdir()
+        profile_file = profile_dir / 'profiles'
+        with open(profile_file, 'wt') as f:
+            f.write('ST\tabcD\tefgH\tijkL\n')
+            f.write('1\t1\t1\t1\n')
+        monkeypatch.setenv('XDG_CACHE_HOME', str(user_cache))
+        try:
+            ST_PROFILES.clear()
+            assert load_st_profiles(profile_file, gene_names, None) == [(1, [1, 1, 1], None)]
+            assert os.listdir(profile_dir) == ['profiles']
+            table_dir = user_cache / 'kleborate' / 'databases' / 'st_profiles'
+            assert len(list(table_dir.glob('*.npy'))) == 1
+        finally:
+            ST_PROFILES.clear()
+
+
+def test_st_profiles():
+    profiles = StProfiles.from_list([(1, [1, 1, 1], None), (2, [1, 2, 1], None)])
+    assert len(profiles) == 2
+    assert profiles[1] == (2, [1, 2, 1], None)
+    assert profiles[-1] == (2, [1, 2, 1], None)
+    assert profiles[:1] == [(1, [1, 1, 1], None)]
+    assert profiles == [(1, [1, 1, 1], None), (2, [1, 2, 1], None)]
+    assert list(profiles.profiles_with_allele(0, 10**20)) == []
@@ -0,0 +1,85 @@
+"""
+This file contains tests for Kleborate. To run all tests, go the repo's root directory and run:
+  python3 -m pytest
+
+To get code coverage stats:
+  coverage run --source . -m pytest && coverage report -m
+
+Copyright 2023 Kat Holt
+Copyright 2023 Ryan Wick (rrwick@gmail.com)
+https://github.com/katholt/Kleborate/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import itertools
+import random
+
+import pytest
+from Bio.Data.CodonTable import TranslationError
+from Bio.Seq import Seq
+
+from kleborate.shared.seq_ops import *
+
+
+def biopython_translate(nucl_seq, to_stop=False, cds=False):
+    try:
+        return str(Seq(nucl_seq).translate(table='Bacterial', to_stop=to_stop, cds=cds))
+    except TranslationError as e:
+        return str(e)
+
+
+def seq_ops_translate(nucl_seq, to_stop=False, cds=False):
+    try:
+        return translate(nucl_seq, to_stop=to_stop, cds=cds)
+    except TranslationError as e:
+        return str(e)
+
+
+def test_reverse_complement_1():
+    assert reverse_complement('ACGTRYN-acgtryn') == 'nryacgt-NRYACGT'
+    assert reverse_complement(b'AACGTX') == b'NACGTT'
+    assert reverse_complement('ACGé') == 'NCGT'
+    assert reverse_complement('') == ''
+
+
+def test_translate_codons():
+    # Every codon (including ambiguous ones) translates the same as with Biopython.
+    for codon in itertools.product('ACGTNRY', repeat=3):
+        codon = ''.join(codon)
+        assert translate(codon) == biopython_translate(codon)
+        assert translate(codon.lower()) == biopython_translate(codon)
+
+
+def test_translate_sequences():
+    # Short and long (NumPy-translated) sequences, with and without stop codons, ambiguous bases or
+    # a complete CDS, translate the same as with Biopython.
+    random.seed(0)
+    sense_codons = [c for c, a in CODON_TABLE.items() if a != '*']
+    for _ in range(200):
+        codons = random.choices(sense_codons, k=random.choice([1, 10, 100, 400]))
+        if random.random() < 0.5:
+            codons[random.randrange(len(codons))] = random.choice(['TAA', 'TAG', 'TGA', 'TAR'])
+        if random.random() < 0.3:
+            codons[random.randrange(len(codons))] = random.choice(['NNN', 'ACN', 'GGR', 'A-C'])
+        if random.random() < 0.5:
+            codons = [random.choice(['ATG', 'GTG', 'TTG', 'ATT', 'CCC'])] + codons + ['TAA']
+        nucl_seq = ''.join(codons)
+        for to_stop, cds in itertools.product([False, True], repeat=2):
+            assert seq_ops_translate(nucl_seq, to_stop, cds) == \
+                biopython_translate(nucl_seq, to_stop, cds)
+
+
+def test_translate_errors():
+    with pytest.raises(TranslationError):
+        translate('ATGAAATA', cds=True)
+    with pytest.raises(TranslationError):
+        translate('A?C')
+    assert translate('TAAA?C', to_stop=True) == ''
@@ -0,0 +1,37 @@
+"""
+This file contains tests for Kleborate. To run all tests, go the repo's root directory and run:
+  python3 -m pytest
+
+To get code coverage stats:
+  coverage run --source . -m pytest && coverage report -m
+
+Copyright 2024 Kat Holt
+Copyright 2024 Ryan Wick (rrwick@gmail.com)
+https://github.com/klebgenomics/KleborateModular/
+
+This file is part of Kleborate. Kleborate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Kleborate is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Kleborate. If
+not, see <https://www.gnu.org/licenses/>.
+"""
+
+from kleborate.shared.threads import *
+
+
+def test_split_threads():
+    assert split_threads(64, 1) == 64
+    assert split_threads(64, 8) == 8
+    assert split_threads(10, 4) == 2
+    assert split_threads(4, 16) == 1
+
+
+def test_set_threads():
+    original = get_threads()
+    set_threads(4)
+    assert get_threads() == 4
+    set_threads(0)
+    assert get_threads() == 1
+    set_threads(original)